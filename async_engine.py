@@ -0,0 +1,380 @@
+"""Asynchroniczny silnik wyszukiwania (asyncio) z interfejsem IPCheckerThread.
+
+Wszystkie wyszukiwania działają jako korutyny na jednej pętli asyncio
+uruchomionej w osobnym wątku (get_loop), zamiast wątku QThread na każde
+sprawdzenie. AsyncIPChecker udostępnia te same sygnały co IPCheckerThread
+(finished/error/progress), które Qt dostarcza do wątku GUI jako połączenia
+kolejkowane. Anulowanie (cancel) i limity czasu przerywają korutyny, a tym
+samym zamykają ich połączenia.
+
+Zapytania HTTP obsługuje minimalny klient GET na asyncio.open_connection
+(bez zależności poza biblioteką standardową; bez obsługi proxy).
+"""
+import asyncio
+import json
+import ssl
+import threading
+import time
+from urllib.parse import urlparse
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from ip_lookup import (
+    CONFIG, DNS_CACHE, FAMILIES, LOOKUP_CACHE, METRICS, PROVIDER_BUDGET, IPDetectionError, NoConnectivityError,
+    ProviderUnavailableError, _retry_after, begin_check, check_error_message, detection_failed, dns_error_result,
+    dual_stack_result, family_label, get_offline_db, hedge_stagger, normalize_ip_data, order_info_services,
+    order_ip_services, parse_ip_response, provider_health, reserve_request, validate_ip, validate_url,
+)
+from provider_health import backoff_delay, is_dns_error, provider_key
+
+_loop = None
+_loop_lock = threading.Lock()
+_ssl_context = ssl.create_default_context()
+
+
+def get_loop():
+    """Zwraca wspólną pętlę asyncio (uruchamianą przy pierwszym użyciu)"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="asyncio-lookups", daemon=True).start()
+        return _loop
+
+
+class AsyncHTTPError(Exception):
+    def __init__(self, url, status, retry_after=None):
+        super().__init__(f"HTTP {status} dla {url}")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AsyncResponse:
+    """Odpowiedź z interfejsem zgodnym z używaną częścią requests.Response"""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AsyncHTTPError(self.url, self.status_code, _retry_after(self))
+
+
+async def _read_chunked(reader):
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            await reader.readline()
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+async def http_get(url, timeout, family=0):
+    """Wykonuje GET i zwraca AsyncResponse (połączenie zamykane po odpowiedzi).
+
+    `family` (socket.AF_INET/AF_INET6) ogranicza połączenie do jednej rodziny adresów.
+    """
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+    async def request():
+        reader, writer = await asyncio.open_connection(
+            parsed.hostname, parsed.port or (443 if https else 80),
+            ssl=_ssl_context if https else None, family=family,
+        )
+        try:
+            writer.write(
+                f"GET {path} HTTP/1.1\r\nHost: {parsed.netloc}\r\nUser-Agent: IPChecker/1.0\r\n"
+                f"Accept: */*\r\nConnection: close\r\n\r\n".encode("ascii")
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split(b" ", 2)[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                body = await _read_chunked(reader)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+            return AsyncResponse(url, status, headers, body)
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(request(), timeout)
+
+
+async def async_fetch_url(url, deadline, on_attempt=None, version=None):
+    """Asynchroniczny odpowiednik fetch_url (ponowienia w budżecie `deadline`)"""
+    if not validate_url(url):
+        raise ValueError(f"Nieprawidłowy URL: {url}")
+
+    health = provider_health(version)
+    family = family_label(version)
+    for attempt in range(CONFIG['max_retries']):
+        if not health.allow(url):
+            METRICS.incr("circuit_open_skips", provider=provider_key(url), family=family)
+            raise ProviderUnavailableError(f"Dostawca {provider_key(url)} chwilowo wyłączony (bezpiecznik)")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Przekroczono budżet czasu dla {url}")
+        wait_for_token = reserve_request(url, deadline, version)
+        if wait_for_token > 0:
+            try:
+                await asyncio.sleep(wait_for_token)
+            except asyncio.CancelledError:
+                PROVIDER_BUDGET.release(url)  # Przegrany wyścig - zapytanie nie zostało wysłane
+                raise
+            remaining = max(0.001, deadline - time.monotonic())
+        started = time.monotonic()
+        try:
+            if on_attempt is not None:
+                on_attempt(attempt)
+            with METRICS.span("provider_attempt", provider=provider_key(url), family=family) as span:
+                try:
+                    response = await http_get(url, remaining, FAMILIES.get(version, 0))
+                except asyncio.CancelledError:
+                    span["outcome"] = "cancelled"  # Przegrany wyścig, a nie błąd dostawcy
+                    raise
+                response.raise_for_status()
+                span["outcome"] = "ok"
+            health.record_success(url, time.monotonic() - started)
+            return response
+        # IncompleteReadError (EOFError) - serwer zamknął połączenie w trakcie treści
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, AsyncHTTPError, ValueError,
+                IndexError) as e:
+            DNS_CACHE.invalidate(urlparse(url).hostname)
+            rate_limited = isinstance(e, AsyncHTTPError) and e.status == 429
+            METRICS.incr("provider_failures", provider=provider_key(url), family=family,
+                         kind="dns" if is_dns_error(e) else "rate_limited" if rate_limited else "error")
+            health.record_failure(
+                url, rate_limited=rate_limited,
+                retry_after=e.retry_after if rate_limited else None,
+            )
+            if rate_limited:
+                PROVIDER_BUDGET.record_rate_limited(url, e.retry_after)
+            if is_dns_error(e) or rate_limited:
+                # Błąd DNS lub limit zapytań - ponawianie dla tego samego hosta nie ma sensu
+                raise
+            if attempt == CONFIG['max_retries'] - 1:
+                raise
+            delay = min(backoff_delay(attempt), max(0.0, deadline - time.monotonic()))
+            METRICS.incr("retries", provider=provider_key(url), family=family)
+            print(f"Próba {attempt + 1} nie powiodła się: {e} (ponowienie za {delay:.2f} s)")
+            await asyncio.sleep(delay)
+
+
+async def async_race_first(factories, deadline, stagger=0.0):
+    """Asynchroniczny odpowiednik race_first: factories to lista (nazwa, funkcja -> korutyna)"""
+    queue = list(factories)
+    if not queue:
+        raise ValueError("Brak serwisów do sprawdzenia")
+    tasks = {}
+    last_error = None
+    try:
+        while queue or tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if queue and (not tasks or stagger <= 0):
+                name, factory = queue.pop(0)
+                tasks[asyncio.ensure_future(factory())] = name
+                if stagger <= 0:
+                    continue  # Tryb 'race' - uruchom od razu wszystkie
+            wait_time = min(remaining, stagger) if queue else remaining
+            done, _ = await asyncio.wait(tasks, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks.pop(task)
+                try:
+                    return name, task.result()
+                except Exception as e:
+                    print(f"Błąd serwisu {name}: {e}")
+                    last_error = e
+            if queue and time.monotonic() < deadline:
+                # Błąd lub brak odpowiedzi w czasie `stagger` - uruchom kolejny serwis
+                name, factory = queue.pop(0)
+                tasks[asyncio.ensure_future(factory())] = name
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if last_error is not None and not tasks:
+        raise last_error
+    raise TimeoutError("Przekroczono budżet czasu sprawdzenia")
+
+
+async def async_fetch_ip(service, response_type, deadline, on_attempt=None, version=4):
+    response = await async_fetch_url(service, deadline, on_attempt, version)
+    ip = parse_ip_response(response, response_type)
+    if not ip or not validate_ip(ip, version):
+        raise ValueError(f"Nieprawidłowa odpowiedź IPv{version} z {service}: {ip!r}")
+    return ip
+
+
+async def async_detect_public_ips(dns_error_mode=False, deadline=None, on_attempt=None):
+    """Asynchroniczny odpowiednik detect_public_ips (wyścigi IPv4 i IPv6 naraz)"""
+    if deadline is None:
+        deadline = time.monotonic() + CONFIG['check_deadline']
+
+    async def race(version):
+        family_deadline = deadline if version == 4 else min(deadline, time.monotonic() + CONFIG['ip6_timeout'])
+        factories = [
+            (service, lambda s=service, t=response_type: async_fetch_ip(s, t, family_deadline, on_attempt, version))
+            for service, response_type in order_ip_services(dns_error_mode, version)
+        ]
+        with METRICS.span("ip_fetch", family=family_label(version)) as span:
+            service, ip = await async_race_first(factories, family_deadline, hedge_stagger())
+            span["provider"] = provider_key(service)
+        print(f"Pobrano i zwalidowano IPv{version}: {ip} ({service})")
+        return ip
+
+    versions = [4, 6] if CONFIG['dual_stack'] else [4]
+    results = await asyncio.gather(*(race(version) for version in versions), return_exceptions=True)
+    addresses = {}
+    for version, result in zip(versions, results):
+        if isinstance(result, Exception):
+            print(f"Błąd pobierania IPv{version}: {result}")
+        else:
+            addresses[version] = result
+    if not addresses:
+        raise results[0]
+    return addresses
+
+
+async def async_fetch_info(service, ip, deadline, on_attempt=None):
+    response = await async_fetch_url(service.format(ip=ip), deadline, on_attempt)
+    with METRICS.span("normalization"):
+        normalized_data = normalize_ip_data(response.json(), ip)
+    if "loc" not in normalized_data:  # Kluczowe jest 'loc'
+        raise ValueError(f"Brak lokalizacji w odpowiedzi z {service}")
+    return normalized_data
+
+
+async def async_lookup_ip_info(ip, deadline=None, on_attempt=None, cache=LOOKUP_CACHE):
+    """Asynchroniczny odpowiednik lookup_ip_info (offline baza, cache, info_services)"""
+    offline_db = get_offline_db()
+    if offline_db is not None:
+        data = offline_db.lookup(ip)
+        if data is not None and "loc" in data:
+            METRICS.incr("info_lookups", source="offline_db")
+            return data
+    info_cache_key = f"info_{ip}"
+    data = cache.get(info_cache_key)
+    if data is not None:
+        METRICS.incr("info_lookups", source="cache")
+        return data
+    METRICS.incr("info_lookups", source="network")
+
+    if deadline is None:
+        deadline = time.monotonic() + CONFIG['check_deadline']
+    factories = [
+        (service, lambda s=service: async_fetch_info(s, ip, deadline, on_attempt))
+        for service in order_info_services()
+    ]
+    with METRICS.span("info_fetch") as span:
+        service, normalized_data = await async_race_first(factories, deadline, hedge_stagger())
+        span["provider"] = provider_key(service)
+    cache.put(info_cache_key, normalized_data)
+    print(f"Pobrano dane lokalizacyjne dla {ip} ({service})")
+    return normalized_data
+
+
+async def async_lookup_addresses(addresses, deadline=None, on_attempt=None, cache=LOOKUP_CACHE):
+    """Asynchroniczny odpowiednik lookup_addresses; zwraca {ip: dane lub wyjątek}"""
+    ips = list(dict.fromkeys(addresses.values()))
+    results = await asyncio.gather(
+        *(async_lookup_ip_info(ip, deadline, on_attempt, cache) for ip in ips), return_exceptions=True
+    )
+    for ip, result in zip(ips, results):
+        if isinstance(result, Exception):
+            print(f"Błąd pobrania info dla {ip}: {result}")
+    return dict(zip(ips, results))
+
+
+async def async_lookup_many(ips, concurrency=100):
+    """Wyszukuje wiele adresów naraz; zwraca słownik ip -> dane lub wyjątek"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(ip):
+        async with semaphore:
+            try:
+                return ip, await async_lookup_ip_info(ip)
+            except Exception as e:
+                return ip, e
+
+    return dict(await asyncio.gather(*(one(ip) for ip in set(ips))))
+
+
+class AsyncIPChecker(QObject):
+    """Sprawdzenie IP jako korutyna na wspólnej pętli; sygnały jak w IPCheckerThread"""
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    cancelled = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._future = None
+
+    def start(self):
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), get_loop())
+
+    def isRunning(self):
+        return self._future is not None and not self._future.done()
+
+    def cancel(self):
+        """Przerywa sprawdzenie (wraz z trwającymi zapytaniami)"""
+        if self.isRunning():
+            self._future.cancel()
+
+    def _emit_attempt(self, attempt):
+        self.progress.emit(int((attempt + 1) / CONFIG['max_retries'] * 33))
+
+    async def _run(self):
+        try:
+            with METRICS.span("check", engine="async"):
+                await self._check()
+        except asyncio.CancelledError:
+            self.cancelled.emit()
+            raise
+        except Exception as e:
+            print(f"Nieoczekiwany błąd silnika asynchronicznego: {e}")
+            self.error.emit(f"Nieoczekiwany błąd: {e}")
+
+    async def _check(self):
+        # Te same kroki co ip_lookup.check_public_ip, z zapytaniami jako korutyny
+        try:
+            dns_error_mode = await asyncio.get_running_loop().run_in_executor(None, begin_check)
+            deadline = time.monotonic() + CONFIG['check_deadline']
+            try:
+                addresses = await async_detect_public_ips(dns_error_mode, deadline, self._emit_attempt)
+            except Exception as e:
+                raise detection_failed(e, dns_error_mode) from e
+        except (NoConnectivityError, IPDetectionError) as e:
+            self.error.emit(check_error_message(e))
+            return
+
+        if dns_error_mode:
+            self.finished.emit(dns_error_result(addresses))
+            return
+        infos = await async_lookup_addresses(addresses, deadline, self._emit_attempt)
+        self.finished.emit(dual_stack_result(addresses, infos))
@@ -0,0 +1,155 @@
+"""Sprawdzanie łączności z internetem i cache rozwiązywania nazw DNS.
+
+ConnectivityProbe zastępuje synchroniczne sprawdzenie (połączenie z 8.8.8.8:53,
+potem gethostbyname) wykonywane przed każdym wyszukiwaniem: sondy routingu
+i DNS działają równolegle, pierwsza udana rozstrzyga, a werdykt jest
+zapamiętywany na krótki czas. Cache jest unieważniany przez zdarzenia zmiany
+sieci (monitor netlink) oraz przez nieudane zapytania.
+
+DNSCache przechowuje wyniki getaddrinfo dla hostów dostawców, dzięki czemu
+kolejne zapytania (requests/urllib3 i silnik async) nie czekają na resolver.
+"""
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Wynik sondy: True - jest łączność, "DNS_ERROR" - routing działa, DNS nie, False - brak sieci
+DNS_ERROR = "DNS_ERROR"
+
+
+class DNSCache:
+    """Cache getaddrinfo dla wybranych hostów (np. dostawców), z TTL"""
+
+    def __init__(self, ttl=300, hosts=()):
+        self.ttl = ttl
+        self.hosts = set(hosts)
+        self._entries = {}  # (host, port, family, type, proto, flags) -> (wynik, czas ważności)
+        self._lock = threading.Lock()
+        self._original = socket.getaddrinfo
+        self._installed = False
+        self.hits = 0
+        self.misses = 0
+
+    def install(self):
+        """Podmienia socket.getaddrinfo, żeby zapytania do hostów dostawców trafiały do cache"""
+        if not self._installed:
+            socket.getaddrinfo = self.getaddrinfo
+            self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            socket.getaddrinfo = self._original
+            self._installed = False
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        if isinstance(host, bytes):
+            host = host.decode("idna")
+        if host not in self.hosts:
+            return self._original(host, port, family, type, proto, flags)
+        key = (host, port, family, type, proto, flags)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[1] > time.monotonic():
+                self.hits += 1
+                return list(cached[0])
+            self.misses += 1
+        result = self._original(host, port, family, type, proto, flags)
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+        return list(result)
+
+    def resolve(self, host, port=443):
+        """Rozwiązuje nazwę z pominięciem cache i zapisuje wynik (sonda DNS, rozgrzewanie)"""
+        result = self._original(host, port, 0, socket.SOCK_STREAM)
+        if host in self.hosts:
+            with self._lock:
+                self._entries[(host, port, 0, socket.SOCK_STREAM, 0, 0)] = (result, time.monotonic() + self.ttl)
+        return result
+
+    def invalidate(self, host=None):
+        """Usuwa wpisy dla hosta albo (host=None) cały cache"""
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == host]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class ConnectivityProbe:
+    """Równoległe sondy łączności z zapamiętanym werdyktem"""
+
+    def __init__(self, dns_cache=None, route_targets=(("8.8.8.8", 53), ("1.1.1.1", 53)),
+                 dns_hosts=("google.com",), ttl=30, failure_ttl=5, timeout=2):
+        self.dns_cache = dns_cache
+        self.route_targets = list(route_targets)
+        self.dns_hosts = list(dns_hosts)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl  # Negatywny werdykt pamiętany krócej
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._verdict = None
+        self._expires = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.route_targets) + len(self.dns_hosts),
+            thread_name_prefix="connectivity",
+        )
+
+    def _connect(self, target):
+        socket.create_connection(target, timeout=self.timeout).close()
+
+    def _resolve(self, host):
+        if self.dns_cache is not None:
+            self.dns_cache.resolve(host)
+        else:
+            socket.getaddrinfo(host, 443, 0, socket.SOCK_STREAM)
+
+    def _any_succeeds(self, futures, deadline):
+        """True, gdy którakolwiek sonda zakończy się sukcesem przed terminem"""
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                return False
+            if any(future.exception() is None for future in done):
+                return True
+        return False
+
+    def probe(self):
+        """Wykonuje sondy (bez cache): routing IP i DNS równolegle"""
+        deadline = time.monotonic() + self.timeout + 0.5
+        route = [self._executor.submit(self._connect, target) for target in self.route_targets]
+        dns = [self._executor.submit(self._resolve, host) for host in self.dns_hosts]
+        if not self._any_succeeds(route, deadline):
+            return False
+        if not self._any_succeeds(dns, deadline):
+            print("Połączenie IP działa, ale DNS nie odpowiada.")
+            return DNS_ERROR
+        return True
+
+    def status(self):
+        """Werdykt z cache albo z nowej sondy (równoczesne wywołania czekają na jedną sondę)"""
+        with self._lock:
+            if self._verdict is not None and time.monotonic() < self._expires:
+                return self._verdict
+            verdict = self.probe()
+            self._verdict = verdict
+            self._expires = time.monotonic() + (self.ttl if verdict is True else self.failure_ttl)
+            return verdict
+
+    def invalidate(self, reason=None):
+        """Zapomina werdykt i cache DNS (zmiana sieci, nieudane sprawdzenie)"""
+        with self._lock:
+            had_verdict = self._verdict is not None
+            self._verdict = None
+            self._expires = 0.0
+        if self.dns_cache is not None:
+            self.dns_cache.invalidate()
+        if had_verdict and reason:
+            print(f"Unieważniono stan łączności ({reason})")
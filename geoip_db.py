@@ -0,0 +1,215 @@
+"""Offline baza geolokalizacji IPv4 (zakresy adresów) w zwartym pliku binarnym.
+
+Układ pliku (little-endian):
+    nagłówek        MAGIC, liczba zakresów N, liczba napisów S
+    starts[N]       uint32 - posortowane początki zakresów (tablica do wyszukiwania binarnego)
+    records[N]      RECORD - koniec zakresu, id napisów pól, szer./dł. geogr. * 10^4
+    str_offsets[S+1] uint32 - przesunięcia napisów w bloku UTF-8
+    strings         blok UTF-8 z internowanymi napisami (id 0 = pusty napis)
+
+Plik jest mapowany w pamięci (mmap). Wyszukiwanie to bisect po widoku
+memoryview na tablicy starts, bez tworzenia obiektów dla rekordów.
+
+Użycie:
+    python geoip_db.py import zakresy.csv geoip.bin
+    python geoip_db.py lookup geoip.bin 8.8.8.8
+"""
+import bisect
+import csv
+import json
+import mmap
+import socket
+import struct
+import sys
+from array import array
+
+MAGIC = b"IPGEODB1"
+HEADER = struct.Struct("<8sII")
+FIELDS = ("country", "region", "city", "postal", "timezone", "org")
+# koniec zakresu, id napisów dla FIELDS, lat * 10^4, lon * 10^4
+RECORD = struct.Struct("<I6Iii")
+NO_COORD = -(2 ** 31)
+COORD_SCALE = 10000
+CSV_COLUMNS = ("start", "end") + FIELDS + ("lat", "lon")
+MAX_IPV4 = 2 ** 32 - 1
+
+
+def ip_to_int(ip):
+    """Zamienia adres IPv4 (lub liczbę w postaci tekstu) na int"""
+    ip = ip.strip()
+    if ip.isdigit():
+        value = int(ip)
+        if value > MAX_IPV4:
+            raise ValueError(f"Liczba poza zakresem IPv4: {ip}")
+        return value
+    return struct.unpack("!I", socket.inet_aton(ip))[0]
+
+
+def _coord(value):
+    try:
+        return round(float(value) * COORD_SCALE)
+    except (TypeError, ValueError):
+        return NO_COORD
+
+
+def build_database(csv_path, out_path):
+    """Importuje CSV z zakresami IP do pliku binarnego i zwraca liczbę zakresów.
+
+    Kolumny CSV: start, end, country, region, city, postal, timezone, org, lat, lon
+    (start/end jako adresy IPv4 lub liczby). Wiersz nagłówka jest opcjonalny.
+    Zakresy nachodzące na wcześniejszy (wg początku, przy równym - wg kolejności
+    w pliku) są przycinane do części niepokrytej, a całkowicie pokryte pomijane,
+    żeby wyszukiwanie binarne zawsze trafiało we właściwy rekord.
+    """
+    strings = {"": 0}
+    starts = array("I")
+    rows = []  # (end, id pól..., lat, lon) - tylko liczby, napisy są internowane
+
+    def intern(value):
+        value = (value or "").strip()
+        string_id = strings.get(value)
+        if string_id is None:
+            string_id = strings[value] = len(strings)
+        return string_id
+
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            row = (row + [""] * len(CSV_COLUMNS))[:len(CSV_COLUMNS)]
+            try:
+                start, end = ip_to_int(row[0]), ip_to_int(row[1])
+            except (OSError, ValueError):
+                continue  # Nagłówek lub uszkodzony wiersz
+            if end < start:
+                start, end = end, start
+            starts.append(start)
+            rows.append((end, *(intern(v) for v in row[2:8]), _coord(row[8]), _coord(row[9])))
+
+    order = []
+    sorted_starts = array("I")
+    last_end = -1
+    clipped = skipped = 0
+    for i in sorted(range(len(starts)), key=starts.__getitem__):
+        start, end = starts[i], rows[i][0]
+        if end <= last_end:
+            skipped += 1
+            continue
+        if start <= last_end:
+            start = last_end + 1
+            clipped += 1
+        order.append(i)
+        sorted_starts.append(start)
+        last_end = end
+    if clipped or skipped:
+        print(f"Nachodzące zakresy: przycięto {clipped}, pominięto {skipped}")
+    string_blob = bytearray()
+    str_offsets = array("I", [0])
+    for value in sorted(strings, key=strings.get):
+        string_blob += value.encode("utf-8")
+        str_offsets.append(len(string_blob))
+    if sys.byteorder != "little":
+        sorted_starts.byteswap()
+        str_offsets.byteswap()
+
+    with open(out_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(order), len(strings)))
+        out.write(sorted_starts.tobytes())
+        for i in order:
+            out.write(RECORD.pack(*rows[i]))
+        out.write(str_offsets.tobytes())
+        out.write(string_blob)
+    return len(order)
+
+
+class GeoIPDatabase:
+    """Odczyt bazy zbudowanej przez build_database()"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, string_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Nieprawidłowy plik bazy GeoIP: {path}")
+
+        starts_at = HEADER.size
+        self._records_at = starts_at + 4 * self.count
+        offsets_at = self._records_at + RECORD.size * self.count
+        self._strings_at = offsets_at + 4 * (string_count + 1)
+
+        view = memoryview(self._mm)
+        self._starts = view[starts_at:self._records_at].cast("I")
+        self._str_offsets = view[offsets_at:self._strings_at].cast("I")
+        if sys.byteorder != "little":
+            # Rzadki przypadek - kopia z zamianą kolejności bajtów zamiast widoku
+            self._starts = array("I", self._starts)
+            self._starts.byteswap()
+            self._str_offsets = array("I", self._str_offsets)
+            self._str_offsets.byteswap()
+        self._string_cache = {}
+
+    def _string(self, string_id):
+        value = self._string_cache.get(string_id)
+        if value is None:
+            begin = self._strings_at + self._str_offsets[string_id]
+            end = self._strings_at + self._str_offsets[string_id + 1]
+            value = self._string_cache[string_id] = self._mm[begin:end].decode("utf-8")
+        return value
+
+    def find(self, ip):
+        """Zwraca indeks zakresu zawierającego IP lub -1"""
+        try:
+            key = ip_to_int(ip) if isinstance(ip, str) else ip
+        except (OSError, ValueError):
+            return -1
+        index = bisect.bisect_right(self._starts, key) - 1
+        if index < 0:
+            return -1
+        end = struct.unpack_from("<I", self._mm, self._records_at + RECORD.size * index)[0]
+        return index if key <= end else -1
+
+    def lookup(self, ip):
+        """Zwraca dane w formacie normalize_ip_data albo None, gdy IP nie ma w bazie"""
+        index = self.find(ip)
+        if index < 0:
+            return None
+        _, *string_ids, lat, lon = RECORD.unpack_from(self._mm, self._records_at + RECORD.size * index)
+        data = {"ip": ip}
+        for field, string_id in zip(FIELDS, string_ids):
+            if string_id:
+                data[field] = self._string(string_id)
+        if lat != NO_COORD and lon != NO_COORD:
+            data["lat"] = lat / COORD_SCALE
+            data["lon"] = lon / COORD_SCALE
+            data["loc"] = f"{data['lat']},{data['lon']}"
+        return data
+
+    def close(self):
+        # Widoki memoryview muszą zostać zwolnione przed zamknięciem mmap
+        self._starts = self._str_offsets = None
+        self._mm.close()
+        self._file.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 3 and argv[0] == "import":
+        count = build_database(argv[1], argv[2])
+        print(f"Zaimportowano {count} zakresów do {argv[2]}")
+        return 0
+    if len(argv) >= 3 and argv[0] == "lookup":
+        db = GeoIPDatabase(argv[1])
+        try:
+            for ip in argv[2:]:
+                print(json.dumps(db.lookup(ip), ensure_ascii=False))
+        finally:
+            db.close()
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
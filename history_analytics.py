@@ -0,0 +1,404 @@
+"""Analiza historii sprawdzeń na kolumnowych tablicach NumPy.
+
+Historia jest wczytywana z HistoryStore do tablic: czasy (sekundy epoki,
+int64) i kody wartości (int32) dla IP, dostawcy, miasta i kraju - napisy są
+przechowywane raz w słowniku kodów. Na tych tablicach, bez pętli po wpisach:
+    - zdarzenia zmiany IP (i dostawcy/miasta),
+    - czas przebywania (dwell time) per IP / dostawca / miasto,
+    - liczba sprawdzeń na dzień,
+    - rozkład przerw między sprawdzeniami.
+Nowe sprawdzenia dopisuje się przyrostowo (append / update_from_store).
+Przedziały z bazy (kolejne identyczne wyniki, count > 1) są rozwijane na
+pojedyncze sprawdzenia równomiernie rozłożone między timestamp a last_seen.
+
+Pierwszy odczyt milionów wpisów z SQLite trwa kilka sekund, więc tablice są
+zapisywane obok bazy (<baza>.analytics.npz); kolejne uruchomienia wczytują je
+w milisekundach i doczytują z bazy tylko nowe wpisy.
+
+    python history_analytics.py --db ip_history.db --top 20
+    python history_analytics.py --json > raport.json
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from history_store import HistoryStore
+
+FIELDS = ("ip", "org", "city", "country")
+
+# Granice koszyków rozkładu przerw (s): 1 min, 5 min, 15 min, 1 h, 6 h, 1 doba, 7 dni
+GAP_BINS = (60, 300, 900, 3600, 6 * 3600, 86400, 7 * 86400)
+GAP_LABELS = ("<1 min", "1-5 min", "5-15 min", "15-60 min", "1-6 h", "6-24 h", "1-7 dni", ">7 dni")
+
+MISSING = ""  # Kod 0 - brak wartości (np. sprawdzenie bez lokalizacji)
+
+
+class Vocabulary:
+    """Dwukierunkowe mapowanie napis <-> kod int32"""
+
+    def __init__(self):
+        self.values = [MISSING]
+        self.index = {MISSING: 0}
+
+    def code(self, value):
+        value = MISSING if value is None else str(value)
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values, count):
+        return np.fromiter((self.code(value) for value in values), dtype=np.int32, count=count)
+
+    def decode(self, codes):
+        return [self.values[code] for code in codes]
+
+
+def _parse_timestamps(values):
+    """Napisy "%Y-%m-%d %H:%M:%S" -> sekundy (czas lokalny traktowany jak UTC, różnice są poprawne)"""
+    return np.array(values, dtype="datetime64[s]").astype(np.int64)
+
+
+class HistoryAnalytics:
+    def __init__(self, max_gap=6 * 3600):
+        # Przerwa dłuższa niż max_gap (np. wyłączony komputer) nie jest liczona do czasu przebywania
+        self.max_gap = max_gap
+        self.vocab = {field: Vocabulary() for field in FIELDS}
+        self.last_id = 0
+        self.rows_read = 0  # Wiersze bazy o id <= last_id (również pominięte - bez czasu)
+        # Ostatni przedział bazy rośnie przy kolejnych sprawdzeniach - ile sprawdzeń
+        # z niego jest już w tablicach i czy leżą na ich końcu (można je podmienić)
+        self.last_row_count = 0
+        self._last_row_at_end = True
+        self._size = 0
+        self._ts = np.empty(0, dtype=np.int64)
+        self._codes = {field: np.empty(0, dtype=np.int32) for field in FIELDS}
+
+    @classmethod
+    def from_store(cls, store, snapshot=None, **kwargs):
+        """Tablice dla całej bazy; z `snapshot` (plik .npz) doczytywane są tylko nowe wpisy"""
+        analytics = None
+        if snapshot is not None and Path(snapshot).exists():
+            try:
+                analytics = cls.load(snapshot, **kwargs)
+                if (analytics.last_row_count is None
+                        or store.count_through(analytics.last_id) != analytics.rows_read):
+                    print("Zapisane statystyki nie pasują do bazy historii - wczytuję od nowa.")
+                    analytics = None
+            except Exception as e:
+                print(f"Błąd wczytywania zapisanych statystyk {snapshot}: {e}")
+                analytics = None
+        if analytics is None:
+            analytics = cls(**kwargs)
+        if analytics.update_from_store(store) and snapshot is not None:
+            analytics.save(snapshot)
+        return analytics
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        meta = {
+            "last_id": self.last_id,
+            "rows_read": self.rows_read,
+            "last_row_count": self.last_row_count,
+            "last_row_at_end": self._last_row_at_end,
+            "vocab": {field: self.vocab[field].values for field in FIELDS},
+        }
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, ts=self.timestamps, meta=np.array(json.dumps(meta)),
+                         **{field: self.codes(field) for field in FIELDS})
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Błąd zapisywania statystyk {path}: {e}")
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        analytics = cls(**kwargs)
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            analytics._ts = data["ts"].astype(np.int64)
+            analytics._codes = {field: data[field].astype(np.int32) for field in FIELDS}
+        analytics._size = len(analytics._ts)
+        analytics.last_id = meta["last_id"]
+        analytics.rows_read = meta["rows_read"]
+        analytics.last_row_count = meta.get("last_row_count")  # Brak - zapis sprzed kompakcji historii
+        analytics._last_row_at_end = meta.get("last_row_at_end", False)
+        for field in FIELDS:
+            vocab = analytics.vocab[field]
+            vocab.values = meta["vocab"][field]
+            vocab.index = {value: code for code, value in enumerate(vocab.values)}
+        return analytics
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def timestamps(self):
+        return self._ts[:self._size]
+
+    def codes(self, field):
+        return self._codes[field][:self._size]
+
+    def _reserve(self, extra):
+        """Powiększa tablice z zapasem (podwajanie), żeby dopisywanie było zamortyzowane O(1)"""
+        needed = self._size + extra
+        if needed <= len(self._ts):
+            return
+        capacity = max(needed, 2 * len(self._ts), 1024)
+        self._ts = np.resize(self._ts, capacity)
+        for field in FIELDS:
+            self._codes[field] = np.resize(self._codes[field], capacity)
+
+    def _extend(self, timestamps, columns):
+        """Dopisuje sprawdzenia; zwraca False, jeśli trzeba było posortować tablice"""
+        count = len(timestamps)
+        if not count:
+            return True
+        self._reserve(count)
+        start, end = self._size, self._size + count
+        previous_last = self._ts[start - 1] if start else None
+        self._ts[start:end] = timestamps
+        for field in FIELDS:
+            self._codes[field][start:end] = self.vocab[field].encode(columns[field], count)
+        self._size = end
+        # Wpisy zwykle przychodzą chronologicznie; inaczej (np. import starego JSON) sortujemy raz
+        block = self._ts[start:end]
+        if (previous_last is not None and block[0] < previous_last) or np.any(np.diff(block) < 0):
+            order = np.argsort(self.timestamps, kind="stable")
+            self._ts[:end] = self._ts[:end][order]
+            for field in FIELDS:
+                self._codes[field][:end] = self._codes[field][:end][order]
+            return False
+        return True
+
+    def _clear(self):
+        self.__init__(self.max_gap)
+
+    def update_from_store(self, store):
+        """Dopisuje sprawdzenia dodane do bazy od ostatniego odczytu; zwraca ich liczbę"""
+        # id > last_id - 1: ostatni przedział czytany ponownie, bo mógł zostać wydłużony
+        rows = store.rows_since(max(self.last_id - 1, 0), ("timestamp", "last_seen", "count") + FIELDS)
+        replaced = 0
+        if rows and rows[0][0] == self.last_id and self.last_id:
+            grown = rows.pop(0)
+            if grown[1] and grown[3] != self.last_row_count:
+                if not self._last_row_at_end:
+                    # Po sortowaniu sprawdzenia ostatniego przedziału nie leżą na końcu tablic
+                    self._clear()
+                    return self.update_from_store(store)
+                replaced = self.last_row_count
+                self._size -= replaced
+                self.rows_read -= 1
+                rows.insert(0, grown)
+        if not rows:
+            return 0
+        self.rows_read += len(rows)
+        self.last_id = rows[-1][0]
+        self.last_row_count = rows[-1][3] if rows[-1][1] else 0
+        rows = [row for row in rows if row[1]]
+        if not rows:
+            return 0
+        _, first, last, counts, *columns = zip(*rows)
+        counts = np.array(counts, dtype=np.int64)
+        first = _parse_timestamps(first)
+        last = _parse_timestamps(last)
+        # Rozwinięcie przedziałów: k-te z n sprawdzeń w chwili first + (last - first) * k / (n - 1)
+        total = int(counts.sum())
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        k = np.arange(total, dtype=np.int64) - starts
+        steps = np.repeat((last - first) / np.maximum(counts - 1, 1), counts)
+        timestamps = np.repeat(first, counts) + np.round(k * steps).astype(np.int64)
+        expanded = {field: np.repeat(np.array(values, dtype=object), counts)
+                    for field, values in zip(FIELDS, columns)}
+        self._last_row_at_end = self._extend(timestamps, expanded)
+        return total - replaced
+
+    def append(self, entry):
+        """Dopisuje jedno sprawdzenie (słownik jak w historii)"""
+        if not entry.get("timestamp"):
+            return
+        self._extend(_parse_timestamps([entry["timestamp"]]),
+                     {field: [entry.get(field)] for field in FIELDS})
+        self._last_row_at_end = False  # Ostatni przedział bazy nie jest już na końcu tablic
+
+    def _runs(self, field):
+        """Początki ciągów kolejnych sprawdzeń z tą samą wartością pola"""
+        codes = self.codes(field)
+        if not len(codes):
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+
+    def change_events(self, field="ip", limit=None):
+        """Zmiany wartości pola między kolejnymi sprawdzeniami (najnowsze na końcu)"""
+        codes = self.codes(field)
+        changes = self._runs(field)[1:]
+        if limit is not None:
+            changes = changes[-limit:]
+        values = self.vocab[field].values
+        timestamps = self.timestamps[changes].astype("datetime64[s]")
+        return [
+            {"timestamp": str(at).replace("T", " "), "old": values[old], "new": values[new]}
+            for at, old, new in zip(timestamps, codes[changes - 1], codes[changes])
+        ]
+
+    def dwell(self, field="ip", top=None):
+        """Łączny czas przebywania per wartość pola: [(wartość, sekundy, liczba sprawdzeń)]
+
+        Odstęp między sprawdzeniem a kolejnym jest przypisywany wartości z
+        pierwszego z nich (ograniczony do max_gap).
+        """
+        codes = self.codes(field)
+        vocab_size = len(self.vocab[field].values)
+        if len(codes) < 2:
+            seconds = np.zeros(vocab_size)
+        else:
+            gaps = np.minimum(np.diff(self.timestamps), self.max_gap)
+            seconds = np.bincount(codes[:-1], weights=gaps, minlength=vocab_size)
+        checks = np.bincount(codes, minlength=vocab_size)
+        order = np.argsort(-seconds, kind="stable")
+        order = order[checks[order] > 0]
+        if top is not None:
+            order = order[:top]
+        values = self.vocab[field].values
+        return [(values[code], float(seconds[code]), int(checks[code])) for code in order]
+
+    def checks_per_day(self):
+        """(dni jako datetime64[D], liczba sprawdzeń) - tylko dni z co najmniej jednym sprawdzeniem"""
+        days, counts = np.unique(self.timestamps // 86400, return_counts=True)
+        return days.astype("datetime64[D]"), counts
+
+    def gaps(self):
+        return np.diff(self.timestamps)
+
+    def gap_distribution(self):
+        gaps = self.gaps()
+        if not len(gaps):
+            return {"count": 0}
+        histogram = np.bincount(np.searchsorted(GAP_BINS, gaps, side="right"), minlength=len(GAP_LABELS))
+        p50, p90, p99 = np.percentile(gaps, [50, 90, 99])
+        return {
+            "count": int(len(gaps)),
+            "mean_s": float(gaps.mean()),
+            "p50_s": float(p50),
+            "p90_s": float(p90),
+            "p99_s": float(p99),
+            "max_s": int(gaps.max()),
+            "histogram": dict(zip(GAP_LABELS, map(int, histogram))),
+        }
+
+    def summary(self):
+        if not self._size:
+            return {"checks": 0}
+        first, last = self.timestamps[[0, -1]].astype("datetime64[s]")
+        return {
+            "checks": self._size,
+            "first": str(first).replace("T", " "),
+            "last": str(last).replace("T", " "),
+            "unique_ips": int(len(np.unique(self.codes("ip")))),
+            "ip_changes": int(len(self._runs("ip")) - 1),
+            "org_changes": int(len(self._runs("org")) - 1),
+        }
+
+    def report(self, top=10, changes=20):
+        """Raport w postaci gotowej do JSON (CLI, panel statystyk)"""
+        days, counts = self.checks_per_day()
+        return {
+            "summary": self.summary(),
+            "ip_changes": self.change_events("ip", limit=changes),
+            "dwell": {
+                field: [{"value": value or "N/A", "seconds": seconds, "checks": checks}
+                        for value, seconds, checks in self.dwell(field, top)]
+                for field in ("ip", "org", "city")
+            },
+            "checks_per_day": {
+                "days": int(len(days)),
+                "mean": float(counts.mean()) if len(counts) else 0.0,
+                "max": int(counts.max()) if len(counts) else 0,
+                "last_days": {str(day): int(count) for day, count in zip(days[-14:], counts[-14:])},
+            },
+            "gaps": self.gap_distribution(),
+        }
+
+
+def snapshot_path(db_path):
+    """Plik z zapisanymi tablicami dla danej bazy historii"""
+    return Path(f"{db_path}.analytics.npz")
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes = seconds // 60
+    if days:
+        return f"{days} d {hours} h"
+    if hours:
+        return f"{hours} h {minutes} min"
+    return f"{minutes} min"
+
+
+def format_report(report):
+    """Raport jako tekst (CLI i panel statystyk w GUI)"""
+    summary = report["summary"]
+    if not summary["checks"]:
+        return "Brak sprawdzeń w historii."
+    lines = [
+        f"Sprawdzeń: {summary['checks']} ({summary['first']} - {summary['last']})",
+        f"Unikalnych IP: {summary['unique_ips']}, zmian IP: {summary['ip_changes']}, "
+        f"zmian dostawcy: {summary['org_changes']}",
+    ]
+    titles = {"ip": "Czas przebywania per IP", "org": "Czas per dostawca", "city": "Czas per miasto"}
+    for field, rows in report["dwell"].items():
+        lines += ["", f"{titles[field]}:"]
+        for row in rows:
+            lines.append(f"  {row['value']:<40} {format_duration(row['seconds']):>12} {row['checks']:>8} spr.")
+    per_day = report["checks_per_day"]
+    lines += ["", f"Sprawdzenia na dzień: średnio {per_day['mean']:.1f}, maks. {per_day['max']} "
+                  f"({per_day['days']} dni z aktywnością)"]
+    for day, count in per_day["last_days"].items():
+        lines.append(f"  {day} {count:>6}")
+    gaps = report["gaps"]
+    if gaps["count"]:
+        lines += ["", f"Przerwy między sprawdzeniami: mediana {format_duration(gaps['p50_s'])}, "
+                      f"p90 {format_duration(gaps['p90_s'])}, maks. {format_duration(gaps['max_s'])}"]
+        for label, count in gaps["histogram"].items():
+            lines.append(f"  {label:<10} {count:>8}")
+    if report["ip_changes"]:
+        lines += ["", "Ostatnie zmiany IP:"]
+        for event in reversed(report["ip_changes"]):
+            lines.append(f"  {event['timestamp']}  {event['old'] or 'N/A'} -> {event['new'] or 'N/A'}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Statystyki historii sprawdzeń IP")
+    parser.add_argument("--db", default="ip_history.db", help="Baza historii (history_store.py)")
+    parser.add_argument("--top", type=int, default=10, help="Ile pozycji w rankingach czasu przebywania")
+    parser.add_argument("--max-gap", type=float, default=6 * 3600,
+                        help="Maks. przerwa (s) liczona do czasu przebywania")
+    parser.add_argument("--json", action="store_true", help="Raport w formacie JSON")
+    parser.add_argument("--no-snapshot", action="store_true", help="Nie używaj ani nie zapisuj pliku .npz")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    try:
+        snapshot = None if args.no_snapshot else snapshot_path(args.db)
+        analytics = HistoryAnalytics.from_store(store, snapshot, max_gap=args.max_gap)
+    finally:
+        store.close()
+    report = analytics.report(top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Klastry lokalizacji z historii dla warstwy mapy (siatka per poziom przybliżenia).
+
+Dla każdego poziomu przybliżenia od `min_zoom` do `max_zoom` świat w rzucie
+Web Mercator jest dzielony na komórki `cell_px` x `cell_px` pikseli ekranu.
+Komórka przechowuje liczbę sprawdzeń, sumy współrzędnych (środek klastra to
+średnia ważona liczbą sprawdzeń), liczbę różnych lokalizacji i ostatni adres
+IP. Wszystko trzymane jest w posortowanych tablicach NumPy per poziom:
+    - wczytanie całej historii to kilka operacji wektorowych na poziom,
+    - nowe sprawdzenie aktualizuje jedną komórkę na poziom (add),
+    - geojson(zoom, bbox) zwraca tylko komórki widocznego obszaru - na ekran
+      mieści się najwyżej kilkaset komórek, niezależnie od rozmiaru historii.
+
+Mapa (map.html) pobiera klastry widoku przez ipmap://app/history/<zoom>.geojson?bbox=...
+
+    python history_clusters.py ip_history.db --zoom 6 --bbox 14,49,24,55
+"""
+import argparse
+import json
+import math
+import sys
+
+import numpy as np
+
+from history_store import HistoryStore
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878  # Granica rzutu Web Mercator
+ROW_COLUMNS = ("loc", "count", "ip")
+
+
+def parse_locations(values):
+    """Tablice (lat, lon) z napisów "lat,lon"; maska poprawnych wpisów"""
+    lat = np.full(len(values), np.nan)
+    lon = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        if not value:
+            continue
+        try:
+            lat_text, lon_text = value.split(",")
+            lat[i], lon[i] = float(lat_text), float(lon_text)
+        except ValueError:
+            pass
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    return lat, lon, valid
+
+
+def cell_keys(lat, lon, zoom, cell_px):
+    """Klucze komórek siatki danego poziomu (wiersz * szerokość + kolumna)"""
+    cells = TILE_SIZE * 2 ** zoom // cell_px  # Liczba komórek w wierszu i w kolumnie
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lon) + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    column = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+    row = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+    return row * cells + column
+
+
+class _Level:
+    """Komórki jednego poziomu - tablice równoległe, posortowane po kluczu"""
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.lat_sums = np.empty(0)
+        self.lon_sums = np.empty(0)
+        self.points = np.empty(0, dtype=np.int64)
+        self.ips = np.empty(0, dtype=object)
+
+    def add(self, key, lat, lon, count, new_point, ip):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            self.counts[i] += count
+            self.lat_sums[i] += lat * count
+            self.lon_sums[i] += lon * count
+            self.points[i] += new_point
+            self.ips[i] = ip
+            return
+        self.keys = np.insert(self.keys, i, key)
+        self.counts = np.insert(self.counts, i, count)
+        self.lat_sums = np.insert(self.lat_sums, i, lat * count)
+        self.lon_sums = np.insert(self.lon_sums, i, lon * count)
+        self.points = np.insert(self.points, i, int(new_point))
+        self.ips = np.insert(self.ips, i, ip)
+
+    def merge(self, keys, lat, lon, counts, new_points, ips):
+        """Dołącza paczkę sprawdzeń (w kolejności dodania) - wektorowo, dla wczytania i dużych przyrostów"""
+        all_keys = np.concatenate((self.keys, keys))
+        merged, inverse = np.unique(all_keys, return_inverse=True)
+        size = len(merged)
+        weights = np.concatenate((self.counts, counts)).astype(np.float64)
+        self.counts = np.bincount(inverse, weights, size).astype(np.int64)
+        self.lat_sums = np.bincount(inverse, np.concatenate((self.lat_sums, lat * counts)), size)
+        self.lon_sums = np.bincount(inverse, np.concatenate((self.lon_sums, lon * counts)), size)
+        self.points = np.bincount(
+            inverse, np.concatenate((self.points, new_points)).astype(np.float64), size).astype(np.int64)
+        # Ostatni adres komórki - z najpóźniejszej pozycji (kolejność zapisu przy powtórzonych
+        # indeksach w merged_ips[inverse] = ... NumPy pozostawia nieokreśloną)
+        last = np.zeros(size, dtype=np.int64)
+        np.maximum.at(last, inverse, np.arange(len(inverse)))
+        self.ips = np.concatenate((self.ips, ips))[last]
+        self.keys = merged
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in
+                   (self.keys, self.counts, self.lat_sums, self.lon_sums, self.points, self.ips))
+
+
+class HistoryClusters:
+    # Od tylu nowych wierszy update_from_store łączy je wektorowo zamiast dodawać po jednym
+    MERGE_THRESHOLD = 64
+
+    def __init__(self, min_zoom=0, max_zoom=16, cell_px=64):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.levels = {zoom: _Level() for zoom in range(min_zoom, max_zoom + 1)}
+        self._locations = set()  # Różne punkty (lat, lon) - do liczby lokalizacji w komórce
+        self.last_id = 0
+        self.last_row_count = 0
+        self.checks = 0
+
+    @classmethod
+    def from_store(cls, store, **options):
+        clusters = cls(**options)
+        clusters.update_from_store(store)
+        return clusters
+
+    def update_from_store(self, store):
+        """Dołącza sprawdzenia dodane do bazy od ostatniego odczytu; zwraca ich liczbę.
+
+        Jak w HistoryAnalytics ostatni przedział jest czytany ponownie, bo
+        kolejne identyczne sprawdzenie zwiększa jego licznik zamiast dodać wiersz.
+        """
+        rows = store.rows_since(max(self.last_id - 1, 0), ROW_COLUMNS)
+        if not rows:
+            return 0
+        last_row_count = rows[-1][2] or 1
+        if self.last_id and rows[0][0] == self.last_id:
+            # Z przeczytanego już przedziału liczą się tylko nowe sprawdzenia
+            row_id, loc, count, ip = rows[0]
+            rows[0] = (row_id, loc, (count or 1) - self.last_row_count, ip)
+        self.last_id = rows[-1][0]
+        self.last_row_count = last_row_count
+        rows = [row for row in rows if row[2] and row[2] > 0]
+        if not rows:
+            return 0
+        _, locs, counts, ips = zip(*rows)
+        lat, lon, valid = parse_locations(locs)
+        counts = np.array([count or 1 for count in counts], dtype=np.int64)
+        added = int(counts[valid].sum())
+        if len(rows) < self.MERGE_THRESHOLD:
+            for i in np.flatnonzero(valid):
+                self.add(lat[i], lon[i], int(counts[i]), ips[i])
+        else:
+            self._merge(lat[valid], lon[valid], counts[valid], np.array(ips, dtype=object)[valid])
+        return added
+
+    def add(self, lat, lon, count=1, ip=None):
+        """Dodaje `count` sprawdzeń z punktu (lat, lon) - jedna komórka na poziom"""
+        lat, lon = float(lat), float(lon)
+        point = (lat, lon)
+        new_point = point not in self._locations
+        self._locations.add(point)
+        for zoom, level in self.levels.items():
+            key = int(cell_keys(np.array([lat]), np.array([lon]), zoom, self.cell_px)[0])
+            level.add(key, lat, lon, count, new_point, ip)
+        self.checks += count
+
+    def _merge(self, lat, lon, counts, ips):
+        # Nowa lokalizacja liczy się w komórce raz - przy jej pierwszym wystąpieniu w paczce
+        new_points = np.zeros(len(lat), dtype=np.int64)
+        for i, point in enumerate(zip(lat.tolist(), lon.tolist())):
+            if point not in self._locations:
+                self._locations.add(point)
+                new_points[i] = 1
+        for zoom, level in self.levels.items():
+            level.merge(cell_keys(lat, lon, zoom, self.cell_px), lat, lon, counts, new_points, ips)
+        self.checks += int(counts.sum())
+
+    def features(self, zoom, bbox=None):
+        """Klastry poziomu jako lista cech GeoJSON; bbox = (zachód, południe, wschód, północ)"""
+        level = self.levels[min(max(int(zoom), self.min_zoom), self.max_zoom)]
+        lat = level.lat_sums / np.maximum(level.counts, 1)
+        lon = level.lon_sums / np.maximum(level.counts, 1)
+        selected = np.ones(len(lat), dtype=bool)
+        if bbox is not None:
+            west, south, east, north = bbox
+            selected = (lat >= south) & (lat <= north)
+            if east - west < 360:
+                # Długość liczona od zachodniej krawędzi - widok może przekraczać południk 180
+                selected &= (lon - west) % 360 <= east - west
+        return [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(x, 5), round(y, 5)]},
+                "properties": {"n": n, "p": p, "ip": ip},
+            }
+            for x, y, n, p, ip in zip(
+                lon[selected].tolist(), lat[selected].tolist(), level.counts[selected].tolist(),
+                level.points[selected].tolist(), level.ips[selected].tolist(),
+            )
+        ]
+
+    def geojson(self, zoom, bbox=None):
+        """FeatureCollection z klastrami poziomu (bytes UTF-8)"""
+        collection = {"type": "FeatureCollection", "features": self.features(zoom, bbox)}
+        return json.dumps(collection, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels.values())
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "locations": len(self._locations),
+            "cells": {zoom: len(level.keys) for zoom, level in self.levels.items()},
+        }
+
+
+def parse_bbox(text):
+    """bbox z napisu "zachód,południe,wschód,północ" (jak LatLngBounds.toBBoxString); None - błędny"""
+    try:
+        west, south, east, north = (float(part) for part in text.split(","))
+    except (AttributeError, ValueError):
+        return None
+    return west, south, east, north
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Klastry lokalizacji z historii (GeoJSON)")
+    parser.add_argument("db", help="Plik bazy historii (ip_history.db)")
+    parser.add_argument("--zoom", type=int, default=6)
+    parser.add_argument("--bbox", help="zachód,południe,wschód,północ")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    try:
+        clusters = HistoryClusters.from_store(store)
+    finally:
+        store.close()
+    bbox = parse_bbox(args.bbox) if args.bbox else None
+    sys.stdout.write(clusters.geojson(args.zoom, bbox).decode("utf-8") + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Zwarta reprezentacja wpisów historii w pamięci.
+
+Zamiast słownika na każdy wpis (z powtarzanymi napisami miasta, kraju,
+dostawcy itd. i sformatowanym czasem) HistoryRows trzyma kolumny w tablicach
+array: czasy jako sekundy (int64), licznik jako uint32, a pola tekstowe jako
+kody do słowników napisów (StringPool) - każda wartość jest przechowywana raz
+dla całego procesu. Wpis zajmuje ok. 60 bajtów zamiast ok. 1-2 kB.
+
+Na zewnątrz HistoryRows zachowuje się jak lista słowników historii
+(len, indeksowanie, iteracja, append/insert/extend); słownik wpisu jest
+budowany dopiero przy odczycie, a value(i, pole) czyta jedno pole bez niego.
+"""
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from history_store import HISTORY_FIELDS, STORED_COLUMNS, TIMESTAMP_FORMAT
+
+TEXT_FIELDS = ["ip"] + HISTORY_FIELDS
+TIME_FIELDS = ["timestamp", "last_seen"]
+EPOCH = datetime(1970, 1, 1)  # Czas historii jest lokalny (bez strefy) - liczony od tej daty bez konwersji
+NO_TIME = -(2 ** 63)
+ONE_SECOND = timedelta(seconds=1)
+
+
+class StringPool:
+    """Internowanie napisów: wartość przechowywana raz, wpisy trzymają jej kod (0 - brak)"""
+
+    def __init__(self):
+        self.values = [None]
+        self.index = {None: 0}
+        self._lock = threading.Lock()  # Strony historii są czytane także w wątku tła
+
+    def codes(self, values):
+        """Kody listy wartości (znane wartości wyszukiwane w C przez map)"""
+        codes = list(map(self.index.get, values))
+        if None in codes:
+            for value in set(values).difference(self.index):
+                self.code(value)
+            codes = list(map(self.index.get, values))
+        return codes
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            with self._lock:
+                code = self.index.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.index[value] = code
+        return code
+
+
+# Słowniki wspólne dla wszystkich kontenerów - extend() między nimi nie przekodowuje napisów.
+# Celowo żyją przez cały proces i nie są przycinane: kody w istniejących kontenerach muszą
+# pozostać ważne, a wartości (miasta, kraje, dostawcy, adresy IP) powtarzają się, więc
+# rozmiar słowników rośnie z liczbą różnych wartości w historii, nie z liczbą odczytów.
+POOLS = {field: StringPool() for field in TEXT_FIELDS}
+# Czasy w innym formacie niż TIMESTAMP_FORMAT (np. z ręcznie edytowanego JSON) - kodowane jako -1 - kod;
+# jak POOLS - na cały proces (takich czasów jest niewiele, tylko ze starych plików)
+RAW_TIMES = StringPool()
+
+
+def encode_time(value):
+    if value is None:
+        return NO_TIME
+    # fromisoformat jest wielokrotnie szybsze od strptime; długość i spacja
+    # gwarantują dokładnie TIMESTAMP_FORMAT (bez ułamków sekund i strefy)
+    if isinstance(value, str) and len(value) == 19 and value[10] == " ":
+        try:
+            return (datetime.fromisoformat(value) - EPOCH) // ONE_SECOND
+        except ValueError:
+            pass
+    return -1 - RAW_TIMES.code(value)
+
+
+def decode_time(value):
+    if value == NO_TIME:
+        return None
+    if value < 0:
+        return RAW_TIMES.values[-1 - value]
+    return (EPOCH + timedelta(seconds=value)).strftime(TIMESTAMP_FORMAT)
+
+
+class HistoryRows:
+    def __init__(self, entries=()):
+        self._times = {field: array("q") for field in TIME_FIELDS}
+        self._counts = array("I")
+        self._codes = {field: array("I") for field in TEXT_FIELDS}
+        self.extend(entries)
+
+    @classmethod
+    def from_tuples(cls, rows):
+        """Buduje kontener z krotek w kolejności STORED_COLUMNS (HistoryStore.query_raw)"""
+        result = cls()
+        columns = dict(zip(STORED_COLUMNS, zip(*rows))) if rows else {}
+        for field in TIME_FIELDS:
+            result._times[field] = array("q", map(encode_time, columns.get(field, ())))
+        result._counts = array("I", [count or 1 for count in columns.get("count", ())])
+        for field in TEXT_FIELDS:
+            result._codes[field] = array("I", POOLS[field].codes(columns.get(field, ())))
+        return result
+
+    @classmethod
+    def from_store(cls, store, **query):
+        """Wpisy z HistoryStore (argumenty jak w query) bez pośrednich słowników"""
+        return cls.from_tuples(store.query_raw(**query))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _index(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Indeks wpisu historii poza zakresem")
+        return i
+
+    def value(self, i, field):
+        """Jedno pole wpisu (None, gdy brak) - bez budowania słownika"""
+        if field in POOLS:
+            return POOLS[field].values[self._codes[field][i]]
+        if field in self._times:
+            return decode_time(self._times[field][i])
+        if field == "count":
+            return self._counts[i]
+        return None
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = self._index(i)
+        entry = {}
+        for field in STORED_COLUMNS:
+            value = self.value(i, field)
+            if value is not None:
+                entry[field] = value
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _encoded(self, entry):
+        return (
+            {field: encode_time(entry.get(field) or (entry.get("timestamp") if field == "last_seen" else None))
+             for field in TIME_FIELDS},
+            entry.get("count") or 1,
+            {field: POOLS[field].code(entry.get(field)) for field in TEXT_FIELDS},
+        )
+
+    def insert(self, i, entry):
+        times, count, codes = self._encoded(entry)
+        for field, value in times.items():
+            self._times[field].insert(i, value)
+        self._counts.insert(i, count)
+        for field, code in codes.items():
+            self._codes[field].insert(i, code)
+
+    def append(self, entry):
+        self.insert(len(self), entry)
+
+    def __setitem__(self, i, entry):
+        i = self._index(i)
+        times, count, codes = self._encoded(entry)
+        for field, value in times.items():
+            self._times[field][i] = value
+        self._counts[i] = count
+        for field, code in codes.items():
+            self._codes[field][i] = code
+
+    def extend(self, entries):
+        if isinstance(entries, HistoryRows):
+            # Wspólne słowniki napisów - wystarczy dokleić tablice
+            for field in TIME_FIELDS:
+                self._times[field].extend(entries._times[field])
+            self._counts.extend(entries._counts)
+            for field in TEXT_FIELDS:
+                self._codes[field].extend(entries._codes[field])
+            return
+        for entry in entries:
+            self.append(entry)
+
+    def nbytes(self):
+        """Rozmiar tablic kolumn (bez współdzielonych słowników napisów)"""
+        arrays = list(self._times.values()) + [self._counts] + list(self._codes.values())
+        return sum(len(column) * column.itemsize for column in arrays)
@@ -0,0 +1,400 @@
+"""Historia sprawdzeń w bazie SQLite (tylko dopisywanie).
+
+Zastępuje przepisywanie całego ip_history.json po każdym sprawdzeniu:
+każdy wpis to jeden INSERT w transakcji (tryb WAL), a odczyty są
+stronicowane i korzystają z indeksów po czasie i adresie IP.
+
+Kolejne identyczne wyniki (ten sam IP, lokalizacja i dostawca) są zapisywane
+jako jeden przedział: timestamp (pierwsze wystąpienie), last_seen (ostatnie)
+i count (liczba sprawdzeń). Nowe sprawdzenie wydłuża ostatni przedział, o ile
+od poprzedniego nie minęło więcej niż `compact_max_gap`. expand_interval()
+odtwarza pojedyncze obserwacje dla odbiorców, którzy ich potrzebują.
+
+Migracja istniejącego pliku JSON odbywa się automatycznie przy pierwszym
+otwarciu bazy lub ręcznie; istniejące pliki można też skompaktować:
+    python history_store.py migrate ip_history.json ip_history.db
+    python history_store.py compact ip_history.db
+    python history_store.py compact ip_history.db ip_history_compact.db
+    python history_store.py compact ip_history.json ip_history_compact.json
+"""
+import json
+import os
+import sqlite3
+import string
+import sys
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+HISTORY_FIELDS = ["city", "country", "region", "postal", "timezone", "org", "loc"]
+COLUMNS = ["timestamp", "ip"] + HISTORY_FIELDS
+INTERVAL_COLUMNS = ["last_seen", "count"]
+STORED_COLUMNS = COLUMNS + INTERVAL_COLUMNS
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_COMPACT_MAX_GAP = 6 * 3600  # s; dłuższa przerwa (np. wyłączony komputer) zaczyna nowy przedział
+SEARCH_COLUMNS = ["ip", "city", "country", "region", "org"]
+# LIKE w SQLite ignoruje wielkość liter tylko dla ASCII - matches_search robi to samo
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    {", ".join(f"{column} TEXT" for column in COLUMNS)},
+    last_seen TEXT,
+    count INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+CREATE INDEX IF NOT EXISTS history_ip ON history (ip, timestamp);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _row_to_entry(row):
+    """Zamienia wiersz bazy na słownik w formacie dotychczasowej historii (+ last_seen, count)"""
+    return {column: value for column, value in zip(STORED_COLUMNS, row) if value is not None}
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def like_pattern(search):
+    """Wzorzec LIKE (z ESCAPE '\\') dopasowujący `search` jako zwykły fragment tekstu"""
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def matches_search(entry, search):
+    """Czy wpis pasuje do filtra `search` - tak samo jak warunek SQL z HistoryStore"""
+    if not search:
+        return True
+    needle = search.translate(ASCII_LOWER)
+    return any(needle in str(entry.get(column) or "").translate(ASCII_LOWER) for column in SEARCH_COLUMNS)
+
+
+def same_observation(a, b):
+    """Czy dwa wpisy opisują ten sam wynik (różnią się co najwyżej czasem)"""
+    return all(a.get(field) == b.get(field) for field in ["ip"] + HISTORY_FIELDS)
+
+
+def can_extend(interval, entry, max_gap=DEFAULT_COMPACT_MAX_GAP):
+    """Czy wpis (lub przedział) `entry` można dołączyć do przedziału `interval`"""
+    if not same_observation(interval, entry):
+        return False
+    last_seen = _parse_timestamp(interval.get("last_seen") or interval.get("timestamp"))
+    seen = _parse_timestamp(entry.get("timestamp"))
+    if last_seen is None or seen is None:
+        return False
+    return timedelta(0) <= seen - last_seen <= timedelta(seconds=max_gap)
+
+
+def compact_entries(entries, max_gap=DEFAULT_COMPACT_MAX_GAP):
+    """Łączy kolejne identyczne wpisy w przedziały (przyjmuje też już skompaktowane)"""
+    current = None
+    for entry in entries:
+        if current is not None and can_extend(current, entry, max_gap):
+            current["last_seen"] = entry.get("last_seen") or entry["timestamp"]
+            current["count"] += entry.get("count", 1)
+            continue
+        if current is not None:
+            yield current
+        current = dict(entry)
+        current["last_seen"] = entry.get("last_seen") or entry.get("timestamp")
+        current["count"] = entry.get("count", 1)
+    if current is not None:
+        yield current
+
+
+def expand_interval(entry):
+    """Rozwija przedział na `count` pojedynczych obserwacji (bez last_seen i count).
+
+    Znane są tylko czasy pierwszej i ostatniej obserwacji - pośrednie są
+    rozłożone równomiernie między nimi.
+    """
+    count = entry.get("count", 1)
+    observation = {key: value for key, value in entry.items() if key not in INTERVAL_COLUMNS}
+    first = _parse_timestamp(entry.get("timestamp"))
+    last = _parse_timestamp(entry.get("last_seen")) or first
+    for i in range(count):
+        if first is not None and count > 1:
+            at = first + (last - first) * i / (count - 1)
+            observation = dict(observation, timestamp=at.strftime(TIMESTAMP_FORMAT))
+        yield dict(observation)
+
+
+class HistoryStore:
+    def __init__(self, path="ip_history.db", legacy_json=None, compact_max_gap=DEFAULT_COMPACT_MAX_GAP):
+        self.path = Path(path)
+        self.compact_max_gap = compact_max_gap
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # W trybie WAL 'NORMAL' nie psuje bazy przy awarii, najwyżej gubi ostatnią transakcję
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._add_interval_columns()
+        self._last = self._latest_interval()
+        if legacy_json:
+            self.migrate_from_json(legacy_json)
+
+    def _add_interval_columns(self):
+        """Bazy sprzed kompakcji nie mają kolumn last_seen/count"""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(history)")}
+        with self._conn:
+            if "last_seen" not in existing:
+                self._conn.execute("ALTER TABLE history ADD COLUMN last_seen TEXT")
+            if "count" not in existing:
+                self._conn.execute("ALTER TABLE history ADD COLUMN count INTEGER NOT NULL DEFAULT 1")
+
+    def _select(self):
+        # last_seen jest puste dla wpisów sprzed kompakcji - wtedy równe timestamp
+        return f"SELECT {', '.join(COLUMNS)}, COALESCE(last_seen, timestamp), count FROM history"
+
+    def _latest_interval(self):
+        """Ostatni zapisany przedział (id, wpis) - kandydat do wydłużenia przez append()"""
+        row = self._conn.execute(self._select().replace("SELECT ", "SELECT id, ", 1)
+                                 + " ORDER BY id DESC LIMIT 1").fetchone()
+        return (row[0], _row_to_entry(row[1:])) if row else None
+
+    def _insert_intervals(self, intervals):
+        self._conn.executemany(
+            f"INSERT INTO history ({', '.join(STORED_COLUMNS)}) VALUES ({', '.join('?' * len(STORED_COLUMNS))})",
+            ([interval.get(column) for column in STORED_COLUMNS] for interval in intervals),
+        )
+
+    def migrate_from_json(self, json_path):
+        """Jednorazowo importuje historię z pliku JSON; zwraca liczbę wpisów"""
+        json_path = Path(json_path)
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_json'"
+            ).fetchone()
+            if done or not json_path.exists():
+                return 0
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except Exception as e:
+                print(f"Błąd migracji historii z {json_path}: {e}")
+                return 0
+            intervals = list(compact_entries(entries, self.compact_max_gap))
+            with self._conn:
+                self._insert_intervals(intervals)
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (str(json_path),)
+                )
+            self._last = self._latest_interval()
+            print(f"Zmigrowano {len(entries)} wpisów historii z {json_path} ({len(intervals)} przedziałów)")
+            return len(entries)
+
+    def append(self, entry):
+        """Dopisuje sprawdzenie (zatwierdzone od razu); zwraca przedział, do którego trafiło.
+
+        Gdy wynik jest taki sam jak w ostatnim przedziale, przedział jest
+        wydłużany (count > 1 w zwróconym wpisie) zamiast dodawania wiersza.
+        """
+        with self._lock, self._conn:
+            if self._last is not None and can_extend(self._last[1], entry, self.compact_max_gap):
+                row_id, interval = self._last
+                interval = dict(interval, last_seen=entry["timestamp"], count=interval.get("count", 1) + 1)
+                self._conn.execute(
+                    "UPDATE history SET last_seen = ?, count = ? WHERE id = ?",
+                    (interval["last_seen"], interval["count"], row_id),
+                )
+            else:
+                interval = {key: entry[key] for key in COLUMNS if entry.get(key) is not None}
+                interval.update(last_seen=entry.get("timestamp"), count=1)
+                row_id = self._conn.execute(
+                    f"INSERT INTO history ({', '.join(STORED_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(STORED_COLUMNS))})",
+                    [interval.get(column) for column in STORED_COLUMNS],
+                ).lastrowid
+            self._last = (row_id, interval)
+            return dict(interval)
+
+    @staticmethod
+    def _where(start=None, end=None, ip=None, search=None):
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            params.append(end)
+        if ip is not None:
+            conditions.append("ip = ?")
+            params.append(ip)
+        if search:
+            conditions.append("(" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in SEARCH_COLUMNS) + ")")
+            params += [like_pattern(search)] * len(SEARCH_COLUMNS)
+        sql = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return sql, params
+
+    def count(self, start=None, end=None, ip=None, search=None):
+        """Liczba przedziałów (wierszy tabeli historii)"""
+        where, params = self._where(start, end, ip, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def observations(self, start=None, end=None, ip=None, search=None):
+        """Liczba sprawdzeń (suma count wszystkich przedziałów)"""
+        where, params = self._where(start, end, ip, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COALESCE(SUM(count), 0) FROM history{where}", params).fetchone()[0]
+
+    def query(self, start=None, end=None, ip=None, search=None, offset=0, limit=None,
+              newest_first=False, order_by="timestamp"):
+        """Zwraca wpisy z zakresu czasu [start, end] i/lub dla danego IP.
+
+        start/end to napisy w formacie "%Y-%m-%d %H:%M:%S" (jak w timestamp).
+        `search` filtruje po fragmencie IP, miasta, kraju, regionu lub dostawcy,
+        `order_by` to nazwa kolumny sortowania (z STORED_COLUMNS). Wpisy są
+        przedziałami (z last_seen i count) - patrz expand_interval().
+        """
+        return [_row_to_entry(row) for row in self.query_raw(
+            start, end, ip, search, offset, limit, newest_first, order_by)]
+
+    def query_raw(self, start=None, end=None, ip=None, search=None, offset=0, limit=None,
+                  newest_first=False, order_by="timestamp"):
+        """Jak query(), ale zwraca krotki w kolejności STORED_COLUMNS (np. dla HistoryRows)"""
+        if order_by not in STORED_COLUMNS:
+            raise ValueError(f"Nieznana kolumna sortowania: {order_by}")
+        where, params = self._where(start, end, ip, search)
+        direction = "DESC" if newest_first else "ASC"
+        sql = self._select() + where
+        sql += f" ORDER BY {order_by} {direction}, id {direction} LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def page(self, page, page_size=100, newest_first=True):
+        """Stronicowany odczyt dla UI (strony numerowane od 0)"""
+        return self.query(offset=page * page_size, limit=page_size, newest_first=newest_first)
+
+    def all(self, expand=False):
+        """Cała historia; expand=True - pojedyncze obserwacje zamiast przedziałów"""
+        entries = self.query()
+        if expand:
+            return [observation for entry in entries for observation in expand_interval(entry)]
+        return entries
+
+    def count_through(self, last_id):
+        """Liczba wpisów o id <= last_id (np. do sprawdzenia, czy zapisany wcześniej odczyt jest aktualny)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history WHERE id <= ?", (last_id,)).fetchone()[0]
+
+    def rows_since(self, after_id=0, columns=STORED_COLUMNS):
+        """Surowe krotki (id, *columns) wpisów dodanych po `after_id`, w kolejności dodania.
+
+        Do przyrostowego czytania całej historii (history_analytics.py) bez
+        budowania słownika dla każdego wpisu.
+        """
+        unknown = set(columns) - set(STORED_COLUMNS)
+        if unknown:
+            raise ValueError(f"Nieznane kolumny: {sorted(unknown)}")
+        selected = ["COALESCE(last_seen, timestamp)" if column == "last_seen" else column for column in columns]
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT id, {', '.join(selected)} FROM history WHERE id > ? ORDER BY id", (after_id,)
+            ).fetchall()
+
+    def compact(self):
+        """Łączy istniejące kolejne identyczne wpisy w przedziały; zwraca (wiersze przed, po)"""
+        with self._lock:
+            rows = self._conn.execute(self._select() + " ORDER BY id").fetchall()
+            intervals = list(compact_entries((_row_to_entry(row) for row in rows), self.compact_max_gap))
+            if len(intervals) < len(rows):
+                with self._conn:
+                    self._conn.execute("DELETE FROM history")
+                    self._insert_intervals(intervals)
+                self._conn.execute("VACUUM")
+                self._last = self._latest_interval()
+            return len(rows), len(intervals)
+
+    def interrupt(self):
+        """Przerywa zapytanie trwające w innym wątku (rzuca tam sqlite3.OperationalError)"""
+        try:
+            self._conn.interrupt()  # Bez blokady - trzyma ją właśnie przerywany wątek
+        except sqlite3.ProgrammingError:
+            pass  # Połączenie już zamknięte - nie ma czego przerywać
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def compact_db_file(source, target=None, max_gap=DEFAULT_COMPACT_MAX_GAP):
+    """Kompaktuje bazę historii w miejscu albo do kopii `target` (źródło bez zmian); zwraca (wiersze przed, po)"""
+    source = Path(source)
+    if not source.exists():  # HistoryStore utworzyłby pustą bazę pod błędną nazwą
+        raise FileNotFoundError(f"Brak bazy historii: {source}")
+    if target is None or Path(target).resolve() == source.resolve():
+        store = HistoryStore(source, compact_max_gap=max_gap)
+        try:
+            return store.compact()
+        finally:
+            store.close()
+    target = Path(target)
+    tmp_path = target.with_name(target.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)  # VACUUM INTO nie nadpisuje istniejącego pliku
+    # Połączenie tylko do odczytu - bez migracji schematu i przełączania źródła w tryb WAL
+    conn = sqlite3.connect(f"{source.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        conn.execute("VACUUM INTO ?", (str(tmp_path),))
+    finally:
+        conn.close()
+    copy = HistoryStore(tmp_path, compact_max_gap=max_gap)  # Kolumny przedziałów dodawane tylko w kopii
+    try:
+        counts = copy.compact()
+    finally:
+        copy.close()
+    os.replace(tmp_path, target)
+    return counts
+
+
+def compact_json_file(source, target=None, max_gap=DEFAULT_COMPACT_MAX_GAP):
+    """Kompaktuje plik historii JSON (domyślnie w miejscu); zwraca (wpisy przed, po)"""
+    source = Path(source)
+    target = Path(target) if target else source
+    with open(source, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    intervals = list(compact_entries(entries, max_gap))
+    tmp_path = target.with_name(target.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(intervals, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, target)
+    return len(entries), len(intervals)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) in (2, 3) and argv[0] == "compact":
+        if argv[1].endswith(".json"):
+            before, after = compact_json_file(*argv[1:])
+        else:
+            try:
+                before, after = compact_db_file(*argv[1:])
+            except FileNotFoundError as e:
+                print(e)
+                return 1
+        print(f"Skompaktowano {argv[1]}{f' do {argv[2]}' if len(argv) == 3 else ''}: {before} -> {after} wpisów")
+        return 0
+    if len(argv) == 3 and argv[0] == "migrate":
+        store = HistoryStore(argv[2])
+        try:
+            count = store.migrate_from_json(argv[1])
+            print(f"Baza {argv[2]}: {store.count()} przedziałów, {store.observations()} sprawdzeń "
+                  f"(zaimportowano {count})")
+        finally:
+            store.close()
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import socket
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Adres źródłowy "dowolny" danej rodziny: gniazdo innej rodziny nie da się z nim
+# związać, więc urllib3 pomija adresy docelowe tej rodziny (np. A przy IPv6)
+FAMILY_SOURCE_ADDRESSES = {
+    socket.AF_INET: ("0.0.0.0", 0),
+    socket.AF_INET6: ("::", 0),
+}
+
+
+class FamilyBoundAdapter(HTTPAdapter):
+    """Adapter, którego połączenia używają wyłącznie jednej rodziny adresów (IPv4/IPv6)"""
+
+    def __init__(self, family, **kwargs):
+        self.family = family
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["source_address"] = FAMILY_SOURCE_ADDRESSES[self.family]
+        super().init_poolmanager(*args, **kwargs)
+
+
+class SessionPool:
+    """Sesje HTTP keep-alive współdzielone przez całą aplikację.
+
+    Każdy host dostawcy ma własną sesję z pulą połączeń, więc kolejne próby
+    i kolejne sprawdzenia używają już zestawionych połączeń TCP/TLS zamiast
+    wykonywać handshake od nowa. Sesja z `family` (socket.AF_INET/AF_INET6)
+    łączy się tylko przez daną rodzinę adresów - do wykrywania adresu IPv4
+    i IPv6 tym samym serwisem.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=8):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host_key(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def session_for(self, url, family=None):
+        """Zwraca (tworząc przy pierwszym użyciu) sesję dla hosta z URL (i rodziny adresów)"""
+        key = (self._host_key(url), family)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                # Ponowienia obsługuje validate_and_fetch, adapter ich nie dubluje
+                options = dict(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=0,
+                )
+                adapter = HTTPAdapter(**options) if family is None else FamilyBoundAdapter(family, **options)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def get(self, url, family=None, **kwargs):
+        """Odpowiednik requests.get korzystający z sesji hosta"""
+        return self.session_for(url, family).get(url, **kwargs)
+
+    def stats(self):
+        """Liczba nowych połączeń i zapytań per host (reszta to połączenia ponownie użyte)"""
+        result = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for (key, family), session in sessions:
+            adapter = session.get_adapter(key)
+            connections = requests_count = 0
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_count += pool.num_requests
+            if family is not None:
+                key = f"{key} ({'IPv6' if family == socket.AF_INET6 else 'IPv4'})"
+            result[key] = {
+                "new_connections": connections,
+                "requests": requests_count,
+                "reused": max(0, requests_count - connections),
+            }
+        return result
+
+    def close(self):
+        """Zamyka wszystkie sesje i ich połączenia"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
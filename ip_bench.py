@@ -0,0 +1,468 @@
+"""Powtarzalne benchmarki offline (lokalny serwer stub_provider zamiast dostawców).
+
+Scenariusze:
+    checker - czas pełnego sprawdzenia IPCheckerThread.run() (percentyle, zimny i ciepły cache)
+    bulk    - przepustowość trybu wsadowego (ip_bulk.run_bulk)
+    history - koszt load_history / save_history / display_history dla 1k, 100k i 1M wpisów
+    clusters - warstwa historii mapy (history_clusters.py): wczytanie, widok, przyrost po sprawdzeniu
+    startup - czas do pierwszego odświeżenia okna i do interaktywności (GUI z QT_QPA_PLATFORM=offscreen)
+    server  - przepustowość ip_server.py na loopback i liczba zapytań do dostawców przy równoczesnych klientach
+
+Wyniki trafiają do pliku JSON (z wersją kodu i ustawieniami), który można
+porównać z wcześniejszym przebiegiem:
+    python ip_bench.py -o bench_results.json
+    python ip_bench.py --scenarios checker --latency 0.05 --error-rate 0.2 -o slow.json
+    python ip_bench.py -o nowe.json --compare bench_results.json
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import ip_lookup
+from history_rows import HistoryRows
+from history_store import COLUMNS, SCHEMA, HistoryStore
+from ip_bulk import run_bulk
+from ip_lookup import CONFIG, CONNECTIVITY, PROVIDER_BUDGET, PROVIDER_HEALTH, PROVIDER_HEALTH_V6
+from lookup_cache import LookupCache
+from stub_provider import CITIES, StubProviderServer
+
+RESULTS_VERSION = 1
+
+
+def summarize(samples):
+    """Statystyki czasów (s) w milisekundach: średnia i percentyle (metoda najbliższej rangi)"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def traced_mb(func):
+    """Pamięć (MB) zajęta przez wynik func() według tracemalloc"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size / 2 ** 20
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def point_config_at(server):
+    """Przełącza CONFIG i stan współdzielony na serwer stub (bez sieci i plików użytkownika)"""
+    CONFIG.update(server.service_config())
+    CONFIG['geoip_db'] = None  # Offline baza skróciłaby wyszukiwanie do odczytu z pliku
+    ip_lookup._offline_db = None
+    for health in (PROVIDER_HEALTH, PROVIDER_HEALTH_V6):
+        health.path = None  # Nie nadpisuj provider_health*.json użytkownika
+        health.reset()
+    PROVIDER_BUDGET.path = None  # ... ani provider_budget.json
+    PROVIDER_BUDGET.reset()
+    CONNECTIVITY.route_targets = [server.address]
+    CONNECTIVITY.dns_hosts = ["localhost"]
+    CONNECTIVITY.invalidate()
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Wycisza komunikaty print() kodu aplikacji na czas pomiaru"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_checker(checks, quiet_output=True):
+    """Czas IPCheckerThread.run() wykonywanego synchronicznie (bez pętli zdarzeń GUI)"""
+    try:
+        import ip_checker_gui  # Przed QCoreApplication (wymóg QtWebEngine)
+        from PyQt6.QtCore import QCoreApplication
+    except ImportError as e:
+        return {"skipped": f"PyQt6 niedostępne: {e}"}
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841 - sygnały wymagają instancji
+
+    results = {}
+    for mode in ("cold", "warm"):
+        shared_cache = LookupCache(None, ttl=CONFIG['cache_timeout'])
+        samples, errors, partial = [], 0, 0
+        for _ in range(checks):
+            thread = ip_checker_gui.IPCheckerThread()
+            # Zimny cache: każde sprawdzenie pyta info_services; ciepły: jak kolejne kliknięcia w GUI
+            thread.cache = LookupCache(None) if mode == "cold" else shared_cache
+            outcome = {}
+            thread.finished.connect(lambda data, outcome=outcome: outcome.setdefault("data", data))
+            thread.error.connect(lambda message, outcome=outcome: outcome.setdefault("error", message))
+            with quiet(quiet_output):
+                elapsed, _ = timed(thread.run)
+            samples.append(elapsed)
+            if "error" in outcome:
+                errors += 1
+            elif "error_loc" in outcome.get("data", {}):
+                partial += 1
+        results[mode] = dict(summarize(samples), errors=errors, partial=partial)
+    return results
+
+
+def bench_bulk(count, workers, quiet_output=True):
+    """Przepustowość run_bulk dla `count` adresów (ok. 20% powtórzeń, jak w logach)"""
+    rng = random.Random(42)
+    unique = [f"198.51.{rng.randrange(256)}.{rng.randrange(1, 255)}" for _ in range(max(1, count * 4 // 5))]
+    ips = unique + [rng.choice(unique) for _ in range(count - len(unique))]
+    rng.shuffle(ips)
+
+    class CountingWriter:
+        def __init__(self):
+            self.records = 0
+            self.errors = 0
+
+        def write(self, offset, record):
+            self.records += 1
+            self.errors += "error" in record
+
+    writer = CountingWriter()
+    cache = LookupCache(None, ttl=CONFIG['cache_timeout'], max_entries=count * 2, autosave=False)
+    with quiet(quiet_output):
+        elapsed, _ = timed(run_bulk, io.StringIO("\n".join(ips) + "\n"), writer, cache, workers,
+                           progress_interval=3600, log=io.StringIO())
+    return {
+        "lines": count,
+        "workers": workers,
+        "seconds": elapsed,
+        "lines_per_s": count / elapsed if elapsed else None,
+        "records": writer.records,
+        "errors": writer.errors,
+    }
+
+
+def _fill_history(path, size, scatter=0.0):
+    """Wypełnia bazę historii `size` wpisami jednym zapytaniem wsadowym
+
+    `scatter` (stopnie) rozrzuca lokalizacje wokół miast - przy > 0 niemal
+    każdy wpis ma inną lokalizację (najgorszy przypadek dla klastrów mapy).
+    """
+    rng = random.Random(size)
+    start = datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    def rows():
+        for i in range(size):
+            city, region, country, lat, lon = rng.choice(CITIES)
+            if scatter:
+                lat = round(lat + rng.uniform(-scatter, scatter), 4)
+                lon = round(lon + rng.uniform(-scatter, scatter), 4)
+            yield [
+                (start + timedelta(seconds=i * 60)).strftime("%Y-%m-%d %H:%M:%S"),
+                f"203.0.{rng.randrange(4)}.{rng.randrange(1, 255)}",
+                city, country, region, "00-001", "Europe/Warsaw", "AS64512 Stub Net", f"{lat},{lon}",
+            ]
+
+    with conn:
+        conn.executemany(
+            f"INSERT INTO history ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows()
+        )
+    conn.close()
+
+
+def bench_history(sizes, appends=200, full_load=True):
+    """load_history (odczyt całości), save_history (dopisanie), display_history (pierwsza strona)"""
+    try:
+        from ip_checker_gui import HistoryTableModel
+    except ImportError:
+        HistoryTableModel = None
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "history.db"
+            fill_seconds, _ = timed(_fill_history, path, size)
+            open_seconds, store = timed(HistoryStore, path)
+            try:
+                result = {"fill_seconds": fill_seconds, "open_ms": open_seconds * 1000}
+                if full_load:
+                    load_seconds, entries = timed(store.all)
+                    result["load_history_ms"] = load_seconds * 1000
+                    del entries
+                    load_seconds, rows = timed(HistoryRows.from_store, store)
+                    result["load_history_rows_ms"] = load_seconds * 1000
+                    del rows
+                    # Pamięć zajęta przez wczytaną historię: lista słowników vs kolumny HistoryRows
+                    result["history_dicts_mb"] = traced_mb(store.all)
+                    result["history_rows_mb"] = traced_mb(lambda: HistoryRows.from_store(store))
+
+                entry = {column: "x" for column in COLUMNS}
+                samples = []
+                for i in range(appends):
+                    entry["timestamp"] = f"2030-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}"
+                    samples.append(timed(store.append, entry)[0])
+                result["save_history"] = summarize(samples)
+
+                if HistoryTableModel is not None:
+                    model = HistoryTableModel(store)
+                    result["display_history_ms"] = timed(model.reload)[0] * 1000
+                    model.search = "Kraków"
+                    result["display_history_filtered_ms"] = timed(model.reload)[0] * 1000
+                else:
+                    # Te same zapytania, które wykonuje HistoryTableModel.reload()
+                    result["display_history_ms"] = timed(
+                        lambda: (store.count(), HistoryRows.from_store(store, limit=200, newest_first=True)))[0] * 1000
+                    result["display_history_filtered_ms"] = timed(
+                        lambda: (store.count(search="Kraków"),
+                                 HistoryRows.from_store(store, search="Kraków", limit=200, newest_first=True)))[0] * 1000
+                    result["display_history_model"] = False
+            finally:
+                store.close()
+        results[str(size)] = result
+    return results
+
+
+def bench_clusters(sizes, scatter=5.0, updates=50):
+    """Warstwa historii mapy: wczytanie klastrów, odpowiedź dla widoku i przyrost po sprawdzeniu"""
+    from history_clusters import HistoryClusters
+
+    views = {
+        "world": (2, (-180.0, -85.0, 180.0, 85.0)),
+        "country": (6, (10.0, 46.0, 28.0, 56.0)),
+        "city": (13, (20.95, 52.2, 21.07, 52.26)),
+    }
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "history.db"
+            _fill_history(path, size, scatter)
+            store = HistoryStore(path)
+            try:
+                load_seconds, clusters = timed(HistoryClusters.from_store, store)
+                result = {
+                    "load_ms": load_seconds * 1000,
+                    "locations": clusters.stats()["locations"],
+                    "arrays_mb": clusters.nbytes() / 2 ** 20,
+                }
+                for name, (zoom, bbox) in views.items():
+                    seconds, body = timed(clusters.geojson, zoom, bbox)
+                    result[f"view_{name}_ms"] = seconds * 1000
+                    result[f"view_{name}_kb"] = len(body) / 1024
+                # Kolejne sprawdzenia: nowa lokalizacja (wstawienie komórek) i ta sama (aktualizacja)
+                for label, moves in (("new_location", True), ("same_location", False)):
+                    samples = []
+                    for i in range(updates):
+                        lat, lon = (52.0 + i / 1000, 21.0 + i / 1000) if moves else (52.0, 21.0)
+                        store.append({"timestamp": f"2031-01-01 00:{i // 60:02d}:{i % 60:02d}",
+                                      "ip": f"198.51.100.{i}", "loc": f"{lat},{lon}"})
+                        samples.append(timed(clusters.update_from_store, store)[0])
+                    result[f"update_{label}"] = summarize(samples)
+            finally:
+                store.close()
+        results[str(size)] = result
+    return results
+
+
+def bench_server(stub, clients, requests_per_client, quiet_output=True):
+    """Zapytania /ip od `clients` klientów keep-alive naraz: najpierw zimny cache, potem ciągły ruch"""
+    from ip_server import CoalescingCache, IPLookupServer
+
+    def upstream_requests():
+        return sum(counters["requests"] for counters in stub.counters.values())
+
+    def run_clients(count, path="/ip"):
+        samples, errors = [], []
+        start = threading.Barrier(clients)
+
+        def client():
+            connection = http.client.HTTPConnection(*server.address)
+            start.wait()
+            for _ in range(count):
+                started = time.perf_counter()
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                samples.append(time.perf_counter() - started)
+                if response.status != 200:
+                    errors.append(response.status)
+            connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, samples, errors
+
+    results = {}
+    with quiet(quiet_output), IPLookupServer(cache=CoalescingCache(fresh_ttl=1, stale_ttl=600)) as server:
+        before = upstream_requests()
+        elapsed, samples, errors = run_clients(1)
+        results["cold"] = dict(summarize(samples), errors=len(errors), upstream_requests=upstream_requests() - before)
+        before = upstream_requests()
+        elapsed, samples, errors = run_clients(requests_per_client)
+        results["steady"] = dict(
+            summarize(samples), errors=len(errors), upstream_requests=upstream_requests() - before,
+            requests_per_second=len(samples) / elapsed,
+        )
+        results["cache"] = server.cache.stats()
+    return results
+
+
+def bench_startup(runs):
+    """Uruchamia GUI z --startup-report i zbiera czasy etapów startu (ms)"""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    script = Path(__file__).resolve().parent / "ip_checker_gui.py"
+    stages = {}
+    for _ in range(runs):
+        try:
+            output = subprocess.run(
+                [sys.executable, str(script), "--startup-report"], capture_output=True, text=True,
+                timeout=120, env=env, cwd=script.parent,
+            ).stdout
+        except subprocess.TimeoutExpired:
+            return {"skipped": "Przekroczono limit czasu uruchomienia GUI"}
+        report = next((line[len("STARTUP "):] for line in output.splitlines() if line.startswith("STARTUP ")), None)
+        if report is None:
+            return {"skipped": "GUI nie zgłosiło czasów startu (brak PyQt6/WebEngine?)"}
+        for stage, ms in json.loads(report).items():
+            stages.setdefault(stage, []).append(ms / 1000)
+    return {stage: summarize(samples) for stage, samples in stages.items()}
+
+
+def flatten(data, prefix=""):
+    """Płaska mapa 'ścieżka.do.metryki' -> liczba (do porównań między wersjami)"""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    print(f"Porównanie z {baseline_path} ({baseline.get('git_commit')} -> {current.get('git_commit')}):")
+    for name in sorted(old.keys() & new.keys()):
+        if old[name]:
+            print(f"  {name}: {old[name]:.3f} -> {new[name]:.3f} ({(new[name] / old[name] - 1) * 100:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarki offline z lokalnym serwerem dostawców")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Plik wynikowy JSON")
+    parser.add_argument("--scenarios", default="checker,bulk,history,clusters,startup,server", help="Lista scenariuszy po przecinku")
+    parser.add_argument("--checks", type=int, default=50, help="Liczba sprawdzeń w scenariuszu checker")
+    parser.add_argument("--bulk-lines", type=int, default=5000)
+    parser.add_argument("--bulk-workers", type=int, default=16)
+    parser.add_argument("--history-sizes", default="1000,100000,1000000")
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--server-clients", type=int, default=16)
+    parser.add_argument("--server-requests", type=int, default=1000, help="Zapytań na klienta w scenariuszu server")
+    parser.add_argument("--no-full-load", action="store_true", help="Pomija odczyt całej historii (pamięć przy 1M)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Opóźnienie odpowiedzi serwera stub (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=0, help="Limit zapytań/s na trasę (0 - bez limitu)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true", help="Nie wyciszaj komunikatów aplikacji")
+    parser.add_argument("--compare", metavar="BASELINE", help="Porównaj z wcześniejszym plikiem wyników")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    report = {
+        "version": RESULTS_VERSION,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "config": {key: CONFIG[key] for key in ("hedge_mode", "hedge_delay", "max_retries", "check_deadline")},
+        "results": {},
+    }
+
+    server = StubProviderServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                rate_limit=args.rate_limit, seed=args.seed)
+    with server:
+        point_config_at(server)
+        if "checker" in scenarios:
+            print(f"checker: {args.checks} sprawdzeń...", file=sys.stderr)
+            report["results"]["checker"] = bench_checker(args.checks, not args.verbose)
+        if "bulk" in scenarios:
+            print(f"bulk: {args.bulk_lines} adresów...", file=sys.stderr)
+            PROVIDER_HEALTH.reset()
+            report["results"]["bulk"] = bench_bulk(args.bulk_lines, args.bulk_workers, not args.verbose)
+        if "server" in scenarios:
+            print(f"server: {args.server_clients} klientów x {args.server_requests} zapytań...", file=sys.stderr)
+            PROVIDER_HEALTH.reset()
+            report["results"]["server"] = bench_server(
+                server, args.server_clients, args.server_requests, not args.verbose)
+        report["stub_counters"] = server.counters
+    if "history" in scenarios:
+        sizes = [int(size) for size in args.history_sizes.split(",") if size.strip()]
+        print(f"history: {sizes}...", file=sys.stderr)
+        report["results"]["history"] = bench_history(sizes, full_load=not args.no_full_load)
+
+    if "clusters" in scenarios:
+        sizes = [int(size) for size in args.history_sizes.split(",") if size.strip()]
+        print(f"clusters: {sizes}...", file=sys.stderr)
+        report["results"]["clusters"] = bench_clusters(sizes)
+
+    if "startup" in scenarios:
+        print(f"startup: {args.startup_runs} uruchomień...", file=sys.stderr)
+        report["results"]["startup"] = bench_startup(args.startup_runs)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report["results"], indent=2, ensure_ascii=False))
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Tryb wsadowy: geolokalizacja adresów IP z pliku lub stdin (bez GUI).
+
+Każda linia wejścia to adres IP (lub linia logu zaczynająca się od adresu IP,
+np. w formacie Common Log Format). Wyniki w postaci znormalizowanych rekordów
+(normalize_ip_data) są zapisywane strumieniowo jako JSONL lub CSV, w kolejności
+wejścia, więc przerwane przetwarzanie można wznowić od podanego offsetu.
+
+Przykłady:
+    python ip_bulk.py access_ips.txt -o wynik.jsonl
+    cat ips.txt | python ip_bulk.py - --format csv --workers 16 > wynik.csv
+    python ip_bulk.py ips.txt -o wynik.jsonl --resume-from 250000
+"""
+import argparse
+import contextlib
+import csv
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ip_lookup import CONFIG, DNS_CACHE, HTTP_POOL, PROVIDER_BUDGET, lookup_ip_info, validate_ip
+from lookup_cache import LookupCache
+
+CSV_FIELDS = ["offset", "ip", "country", "region", "city", "postal", "timezone", "org", "loc", "lat", "lon", "error"]
+
+
+def iter_ips(stream, start_offset=0):
+    """Zwraca pary (offset linii, adres) bez wczytywania całego wejścia do pamięci"""
+    for offset, line in enumerate(stream):
+        if offset < start_offset:
+            continue
+        line = line.strip()
+        if not line or line.startswith("#"):
+            yield offset, None
+            continue
+        yield offset, line.split()[0]
+
+
+class BulkLookup:
+    """Równoległe wyszukiwanie z ograniczoną liczbą wątków i łączeniem duplikatów.
+
+    Duplikaty już pobranych adresów obsługuje cache, a duplikaty adresów,
+    których wyszukiwanie właśnie trwa, czekają na ten sam Future. Błędy są
+    pamiętane przez `failure_ttl` sekund (bez zapisu do trwałego cache), więc
+    powtórzenia nieudanego adresu nie uruchamiają za każdym razem nowego wyścigu.
+    """
+
+    MAX_FAILURES = 10000  # Limit zapamiętanych błędów - najstarsze są zapominane
+
+    def __init__(self, cache, workers=8, failure_ttl=60):
+        self.cache = cache
+        self.failure_ttl = failure_ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._in_flight = {}
+        self._failures = {}  # ip -> (rekord z błędem, czas wygaśnięcia wg time.monotonic)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.errors = 0
+        self.failure_hits = 0
+
+    def _lookup(self, ip):
+        try:
+            return lookup_ip_info(ip, cache=self.cache)
+        except Exception as e:
+            record = {"ip": ip, "error": str(e) or type(e).__name__}
+            with self._lock:
+                self.errors += 1
+                if self.failure_ttl > 0:
+                    self._failures.pop(ip, None)
+                    self._failures[ip] = (record, time.monotonic() + self.failure_ttl)
+                    if len(self._failures) > self.MAX_FAILURES:
+                        del self._failures[next(iter(self._failures))]
+            return record
+
+    def _cached_failure(self, ip):
+        """Zapamiętany błąd adresu albo None (pod blokadą)"""
+        failure = self._failures.get(ip)
+        if failure is None:
+            return None
+        record, expires = failure
+        if expires <= time.monotonic():
+            del self._failures[ip]
+            return None
+        return record
+
+    def _forget(self, ip):
+        with self._lock:
+            self._in_flight.pop(ip, None)
+
+    def submit(self, ip):
+        """Zwraca Future z rekordem dla adresu (współdzielony dla duplikatów)"""
+        with self._lock:
+            future = self._in_flight.get(ip)
+            failure = self._cached_failure(ip) if future is None else None
+            if failure is not None:
+                self.failure_hits += 1
+                future = Future()
+                future.set_result(dict(failure))
+            elif future is None:
+                self.lookups += 1
+                future = self.executor.submit(self._lookup, ip)
+                self._in_flight[ip] = future
+                future.add_done_callback(lambda _, ip=ip: self._forget(ip))
+            return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, offset, record):
+        self.stream.write(json.dumps(dict(record, offset=offset), ensure_ascii=False) + "\n")
+
+
+class CsvWriter:
+    def __init__(self, stream, write_header=True):
+        self.writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        if write_header:
+            self.writer.writeheader()
+
+    def write(self, offset, record):
+        self.writer.writerow(dict(record, offset=offset))
+
+
+def run_bulk(source, writer, cache, workers=8, start_offset=0, progress_interval=5.0, log=sys.stderr,
+             failure_ttl=60):
+    """Przetwarza wejście i zwraca offset następnej nieprzetworzonej linii"""
+    bulk = BulkLookup(cache, workers, failure_ttl)
+    window = deque()
+    max_window = workers * 4  # Ograniczenie liczby rekordów w pamięci
+    processed = 0
+    next_offset = start_offset
+    started = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        label = "Zakończono" if final else "Postęp"
+        print(
+            f"{label}: {processed} linii, offset wznowienia={next_offset}, "
+            f"{processed / elapsed:.1f} linii/s, zapytań={bulk.lookups}, błędów={bulk.errors}, "
+            f"powtórzonych błędów={bulk.failure_hits}, "
+            f"cache={cache.stats()}, limity={PROVIDER_BUDGET.stats()}",
+            file=log,
+        )
+
+    def flush_one():
+        nonlocal processed, next_offset, last_report
+        offset, ip, future = window.popleft()
+        if future is not None:
+            writer.write(offset, future.result())
+        elif ip is not None:
+            writer.write(offset, {"ip": ip, "error": "Nieprawidłowy adres IP"})
+        processed += 1
+        next_offset = offset + 1
+        if time.monotonic() - last_report >= progress_interval:
+            last_report = time.monotonic()
+            cache.save()
+            PROVIDER_BUDGET.save()
+            report()
+
+    try:
+        for offset, ip in iter_ips(source, start_offset):
+            future = bulk.submit(ip) if ip is not None and validate_ip(ip) else None
+            window.append((offset, ip, future))
+            if len(window) >= max_window:
+                flush_one()
+        while window:
+            flush_one()
+    except KeyboardInterrupt:
+        print("Przerwano przez użytkownika.", file=log)
+    finally:
+        bulk.shutdown()
+        cache.save()
+        PROVIDER_BUDGET.save()
+        report(final=True)
+    return next_offset
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wsadowa geolokalizacja adresów IP")
+    parser.add_argument("input", help="Plik z adresami IP lub '-' dla stdin")
+    parser.add_argument("-o", "--output", default="-", help="Plik wynikowy lub '-' dla stdout")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--workers", type=int, default=8, help="Maks. liczba równoległych wyszukiwań")
+    parser.add_argument("--resume-from", type=int, default=0, metavar="OFFSET",
+                        help="Pomija linie wejścia przed podanym offsetem (dopisuje do pliku wynikowego)")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Co ile sekund raportować postęp")
+    parser.add_argument("--cache-file", default=CONFIG['cache_file'])
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--failure-ttl", type=float, default=60,
+                        help="Przez ile sekund powtórzenia nieudanego adresu dostają ten sam błąd")
+    parser.add_argument("--max-wait", type=float, default=CONFIG['check_deadline'],
+                        help="Maks. oczekiwanie (s) na limit zapytań dostawcy zamiast błędu linii")
+    args = parser.parse_args(argv)
+    # Przy przetwarzaniu wsadowym lepiej poczekać na token niż zapisać błąd
+    CONFIG['rate_limit_max_wait'] = args.max_wait
+    DNS_CACHE.install()
+
+    cache = LookupCache(args.cache_file, ttl=CONFIG['cache_timeout'], max_entries=args.cache_size, autosave=False)
+    appending = args.resume_from > 0
+
+    with contextlib.ExitStack() as stack:
+        if args.input == "-":
+            source = sys.stdin
+        else:
+            source = stack.enter_context(open(args.input, "r", encoding="utf-8", errors="replace"))
+        if args.output == "-":
+            output = sys.stdout
+        else:
+            output = stack.enter_context(open(args.output, "a" if appending else "w", encoding="utf-8", newline=""))
+
+        if args.format == "csv":
+            # Przy wznowieniu nagłówek jest już w pliku (o ile plik nie był pusty)
+            write_header = not appending or (output is not sys.stdout and output.tell() == 0)
+            writer = CsvWriter(output, write_header=write_header)
+        else:
+            writer = JsonlWriter(output)
+
+        # Komunikaty diagnostyczne z ip_lookup nie mogą trafić do strumienia wynikowego
+        with contextlib.redirect_stdout(sys.stderr):
+            next_offset = run_bulk(source, writer, cache, args.workers, args.resume_from, args.progress_interval,
+                                   failure_ttl=args.failure_ttl)
+        HTTP_POOL.close()
+
+    print(f"Aby wznowić: --resume-from {next_offset}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,25 @@
+import html
 import json
 import sys
 import os
-import socket
 import re
+import sqlite3
+import threading
 import time
+
+# Punkt odniesienia dla pomiarów startu (przed importem PyQt6/Chromium)
+PROCESS_START = time.perf_counter()
+
 from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
-from urllib.parse import urlparse
 
-import requests
-from PyQt6.QtCore import Qt, QThread, QUrl, pyqtSignal
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt, QThread, QTimer, QUrl, pyqtSignal
 from PyQt6.QtGui import QColor, QFont, QPalette, QSyntaxHighlighter, QTextCharFormat
 from PyQt6.QtWidgets import (
-    QApplication, QFrame, QHBoxLayout, QLabel, QMainWindow, QPushButton,
-    QSplitter, QProgressBar, QTextBrowser, QTextEdit, QVBoxLayout, QWidget
+    QAbstractItemView, QApplication, QCheckBox, QDialog, QFileDialog, QFrame, QHBoxLayout, QHeaderView,
+    QLabel, QLineEdit, QMainWindow, QPushButton, QSplitter, QProgressBar, QTableView, QTextBrowser, QTextEdit,
+    QVBoxLayout, QWidget
 )
 
 try:
@@ -25,57 +30,46 @@ except ImportError:
     print("Zainstaluj go za pomocą: pip install PyQt6-WebEngine")
     sys.exit(1)
 
-# Konfiguracja serwisów
-CONFIG = {
-    'ip_services': [
-        ("http://1.1.1.1/cdn-cgi/trace", "cloudflare_trace"),  # Domyślny: Cloudflare po IP (niezawodny)
-        ("https://ifconfig.me/ip", "text"),
-        ("https://icanhazip.com", "text")
-    ],
-    'info_services': [
-        "https://ipinfo.io/{ip}/json",
-        "https://ipapi.co/{ip}/json/",
-        "https://ip-api.com/json/{ip}"
-    ],
-    'timeout': 5,
-    'max_retries': 3,
-    'cache_timeout': 3600,  # 1 godzina
-    'proxy': None  # Możliwe do konfiguracji
-}
-
-def validate_url(url):
-    """Walidacja URL"""
-    try:
-        # Sprawdzenie podstawowej struktury URL
-        result = urlparse(url)
-        if not all([result.scheme, result.netloc]):
-            return False
-
-        # Sprawdzenie poprawności schematu
-        if result.scheme not in ['http', 'https']:
-            return False
-
-        # Sprawdzenie poprawności hosta
-        if not re.match(r'^[a-zA-Z0-9.-]+$', result.netloc):
-            return False
-
-        return True
-    except:
-        return False
+from async_engine import AsyncIPChecker
+from history_rows import HistoryRows
+from history_store import HISTORY_FIELDS, HistoryStore, matches_search
+from ip_lookup import (
+    CONFIG, DNS_CACHE, HTTP_POOL, LOOKUP_CACHE, METRICS, PROVIDER_BUDGET, PROVIDER_HEALTH, PROVIDER_HEALTH_V6,
+    CheckCancelledError, IPDetectionError, NoConnectivityError,
+    check_error_message, check_public_ip, fetch_info, fetch_ip, fetch_url, normalize_ip_data, result_changes, validate_ip,
+)
+from ip_monitor import IPMonitor
+from map_scheme import MAP_PAGE_URL, MAP_SCHEME, MapSchemeHandler, register_map_scheme
+from tile_cache import TileFetcher, TileStore
+
+# Kandydaci na adresy IPv4/IPv6 w tekście. Granice (?<![...]) / (?![...]) sprawiają,
+# że "1.2.3.4" nie pasuje wewnątrz "11.2.3.45" - dopasowywany jest cały token.
+# Po adresie może stać kropka kończąca zdanie, a po IPv4 także port ("1.2.3.4:8080");
+# przed IPv4 może stać dwukropek ("IP:1.2.3.4", "::ffff:1.2.3.4").
+IP_TOKEN_RE = re.compile(
+    r"(?<![\w.])\d{1,3}(?:\.\d{1,3}){3}(?=(?::\d{1,5})?\.?(?![\w.:]))"
+    r"|(?<![\w.:])[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7}(?:%\w+)?(?=\.?(?![\w.:]))"
+)
 
-def validate_ip(ip):
-    """Walidacja adresu IP"""
-    try:
-        socket.inet_aton(ip)
-        return True
-    except socket.error:
-        return False
+# Nazwy pól w sekcji zmian (result_changes)
+RESULT_FIELD_LABELS = {
+    "ip": "Adres IP",
+    "country": "Kraj",
+    "region": "Region",
+    "city": "Miasto",
+    "postal": "Kod pocztowy",
+    "timezone": "Strefa czasowa",
+    "org": "Dostawca",
+    "IPv4": "Adres IPv4",
+    "IPv6": "Adres IPv6",
+}
 
 
 class IPHighlighter(QSyntaxHighlighter):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.ip_colors = defaultdict(lambda: QColor(255, 255, 255))
+        self.formats = {}
         self.color_index = 0
         # Paleta kolorów z większą różnorodnością
         self.colors = [
@@ -113,73 +107,213 @@ class IPHighlighter(QSyntaxHighlighter):
         if ip not in self.ip_colors:
             self.ip_colors[ip] = self.colors[self.color_index]
             self.color_index = (self.color_index + 1) % len(self.colors)
-
-    def highlightBlock(self, text):
-        for ip, color in self.ip_colors.items():
+            # Format budowany raz na IP, a nie przy każdym bloku tekstu
             format = QTextCharFormat()
-            format.setBackground(color)
+            format.setBackground(self.ip_colors[ip])
             format.setForeground(QColor(0, 0, 0))
-            index = text.find(ip)
-            while index >= 0:
-                self.setFormat(index, len(ip), format)
-                index = text.find(ip, index + 1)
+            self.formats[ip] = format
+
+    def color_for(self, ip):
+        """Kolor przypisany do IP (przydzielany przy pierwszym użyciu)"""
+        self.set_ip_color(ip)
+        return self.ip_colors[ip]
+
+    def highlightBlock(self, text):
+        # Jedno przejście wyrażenia regularnego po bloku + słownik formatów:
+        # koszt nie zależy od liczby znanych adresów IP
+        for match in IP_TOKEN_RE.finditer(text):
+            format = self.formats.get(match.group())
+            if format is not None:
+                self.setFormat(match.start(), match.end() - match.start(), format)
+
+
+class HistoryTableModel(QAbstractTableModel):
+    """Model historii czytający wpisy stronami z HistoryStore.
+
+    Widok (QTableView) pobiera kolejne strony przez canFetchMore/fetchMore
+    dopiero przy przewijaniu, a nowe sprawdzenia są wstawiane pojedynczo
+    (albo wydłużają najnowszy wiersz, gdy wynik się nie zmienił - update_latest).
+    Filtrowanie i sortowanie wykonuje baza, więc nie wymaga ładowania całej historii.
+    """
+
+    COLUMNS = [
+        ("timestamp", "Czas"),
+        ("ip", "Adres IP"),
+        ("city", "Miasto"),
+        ("country", "Kraj"),
+        ("org", "Dostawca"),
+        ("last_seen", "Ostatnio"),
+        ("count", "Razy"),
+    ]
+    PAGE_SIZE = 200
+
+    def __init__(self, store, color_for=None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.color_for = color_for
+        self.search = ""
+        self.order_by = "timestamp"
+        self.newest_first = True
+        self._rows = HistoryRows()
+        self._total = 0
+
+    def set_loaded(self, store, total, rows):
+        """Przyjmuje bazę i pierwszą stronę wczytane w tle (HistoryLoaderThread)"""
+        self.beginResetModel()
+        self.store = store
+        self._total = total
+        self._rows = rows
+        self.endResetModel()
+
+    def reload(self):
+        """Wczytuje pierwszą stronę od nowa (po zmianie filtra lub sortowania)"""
+        if self.store is None:
+            return  # Historia jeszcze się wczytuje
+        self.beginResetModel()
+        self._total = self.store.count(search=self.search)
+        self._rows = self._query_page(0)
+        self.endResetModel()
+
+    def _query_page(self, offset):
+        return HistoryRows.from_store(
+            self.store, search=self.search, offset=offset, limit=self.PAGE_SIZE,
+            newest_first=self.newest_first, order_by=self.order_by,
+        )
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self._rows) < self._total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        rows = self._query_page(len(self._rows))
+        if not len(rows):
+            self._total = len(self._rows)
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        key = self.COLUMNS[index.column()][0]
+        if role == Qt.ItemDataRole.DisplayRole:
+            # Jedno pole z kolumn HistoryRows - bez budowania słownika wpisu
+            value = self._rows.value(index.row(), key)
+            return "N/A" if value is None else value
+        if key == "ip" and self.color_for is not None:
+            if role == Qt.ItemDataRole.BackgroundRole:
+                return self.color_for(self._rows.value(index.row(), "ip"))
+            if role == Qt.ItemDataRole.ForegroundRole:
+                return QColor(0, 0, 0)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.COLUMNS[section][1]
+        return None
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        order_by = self.COLUMNS[column][0]
+        newest_first = order == Qt.SortOrder.DescendingOrder
+        if (order_by, newest_first) == (self.order_by, self.newest_first) and self._rows:
+            return  # Np. włączenie sortowania w widoku - strona jest już w tej kolejności
+        self.order_by = order_by
+        self.newest_first = newest_first
+        self.reload()
+
+    def set_filter(self, text):
+        self.search = text.strip()
+        self.reload()
+
+    def _matches_filter(self, entry):
+        return matches_search(entry, self.search)
+
+    def add_entry(self, entry):
+        """Dodaje nowy wpis bez przeładowania modelu (zapisany już w bazie)"""
+        if not self._matches_filter(entry):
+            return
+        self._total += 1
+        if self.order_by != "timestamp":
+            self.reload()  # Pozycja zależy od sortowania - najprościej przeczytać stronę od nowa
+        elif self.newest_first:
+            self.beginInsertRows(QModelIndex(), 0, 0)
+            self._rows.insert(0, entry)
+            self.endInsertRows()
+        elif len(self._rows) == self._total - 1:
+            # Wpis trafia na koniec tylko, gdy wszystkie wcześniejsze są już wczytane
+            row = len(self._rows)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._rows.append(entry)
+            self.endInsertRows()
+
+    def update_latest(self, interval):
+        """Odświeża najnowszy wpis wydłużony przez kolejne identyczne sprawdzenie"""
+        if not self._matches_filter(interval):
+            return
+        if self.order_by == "timestamp" and self._rows:
+            row = 0 if self.newest_first else len(self._rows) - 1
+            current = (self._rows.value(row, "timestamp"), self._rows.value(row, "ip"))
+            if (row == 0 or len(self._rows) == self._total) and \
+                    current == (interval.get("timestamp"), interval.get("ip")):
+                self._rows[row] = interval
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+                return
+        self.reload()  # Wiersz poza wczytaną stroną lub sortowanie po last_seen/count
 
 
 class IPCheckerThread(QThread):
     finished = pyqtSignal(dict)
     error = pyqtSignal(str)
     progress = pyqtSignal(int)
+    cancelled = pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.cache = {}
-        self.cache_timestamps = {}
+        self.cache = LOOKUP_CACHE
         self.parent = parent
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Przerywa sprawdzenie: wyścigi serwisów kończą się, a zapytania nie są ponawiane"""
+        self.cancel_event.set()
 
     def is_cached(self, key):
         """Sprawdza, czy dane są w cache i czy są aktualne"""
-        if key not in self.cache:
-            return False
-        timestamp = self.cache_timestamps[key]
-        return (datetime.now() - timestamp).total_seconds() < CONFIG['cache_timeout']
+        return key in self.cache
 
     def get_from_cache(self, key):
-        """Pobiera dane z cache"""
-        return self.cache[key]
+        """Pobiera dane z cache (None, gdy brak lub nieaktualne)"""
+        return self.cache.get(key)
 
     def add_to_cache(self, key, data):
         """Dodaje dane do cache"""
-        self.cache[key] = data
-        self.cache_timestamps[key] = datetime.now()
+        self.cache.put(key, data)
 
-    def validate_and_fetch(self, url, timeout=CONFIG['timeout']):
-        """Waliduje URL i wykonuje zapytanie"""
-        if not validate_url(url):
-            raise ValueError(f"Nieprawidłowy URL: {url}")
+    def validate_and_fetch(self, url, timeout=CONFIG['timeout'], deadline=None, stop_event=None):
+        """Waliduje URL i wykonuje zapytanie (z raportowaniem postępu)"""
+        return fetch_url(url, timeout, deadline, stop_event, on_attempt=self._emit_attempt)
 
-        for attempt in range(CONFIG['max_retries']):
-            try:
-                # Aktualizacja postępu
-                self.progress.emit(int((attempt + 1) / CONFIG['max_retries'] * 33))
-
-                response = requests.get(
-                    url,
-                    timeout=timeout,
-                    proxies=CONFIG['proxy']
-                )
-                response.raise_for_status()
-                return response
-            except requests.exceptions.RequestException as e:
-                # Jeśli to błąd DNS, nie ma sensu ponawiać prób dla tego samego hosta
-                if "NameResolutionError" in str(e) or "getaddrinfo failed" in str(e):
-                    print(f"Błąd DNS dla {url}: {e}. Przerywam retries dla tego serwisu.")
-                    raise
-                
-                if attempt == CONFIG['max_retries'] - 1:
-                    raise
-                print(f"Próba {attempt + 1} nie powiodła się: {e}")
-                time.sleep(1)  # Krótkie opóźnienie przed kolejną próbą
-                continue
+    def _emit_attempt(self, attempt):
+        # Aktualizacja postępu
+        self.progress.emit(int((attempt + 1) / CONFIG['max_retries'] * 33))
+
+    def fetch_ip(self, service, response_type, deadline, timeout, stop_event, version=4):
+        """Pobiera i waliduje adres IP z jednego serwisu"""
+        print(f"Próbuję serwisu: {service}")
+        return fetch_ip(service, response_type, deadline, timeout, stop_event, self._emit_attempt, version)
+
+    def fetch_info(self, service, ip, deadline, timeout, stop_event):
+        """Pobiera i normalizuje dane lokalizacyjne z jednego serwisu"""
+        return fetch_info(service, ip, deadline, timeout, stop_event, self._emit_attempt)
 
     def validate_ip_data(self, data):
         """Walidacja danych IP"""
@@ -198,164 +332,319 @@ class IPCheckerThread(QThread):
 
         return data
 
-    def check_connectivity(self):
-        """Sprawdza połączenie z internetem i DNS"""
-        try:
-            # 1. Sprawdzenie routingu IP (Google DNS)
-            socket.create_connection(("8.8.8.8", 53), timeout=2)
-            
-            # 2. Sprawdzenie DNS (rozwiązywanie nazwy)
+    def run(self):
+        with METRICS.span("check", engine="thread") as labels:
             try:
-                socket.gethostbyname("google.com")
-                return True
-            except socket.error:
-                print("Połączenie IP działa, ale DNS nie odpowiada.")
-                return "DNS_ERROR"
-                
-        except OSError:
-            return False
+                self._check()
+            except CheckCancelledError:
+                labels["outcome"] = "cancelled"
+                self.cancelled.emit()
+
+    def _check(self):
+        # W trybie sekwencyjnym zostaje limit pojedynczego zapytania,
+        # w trybach równoległych limitem jest pozostały budżet sprawdzenia
+        request_timeout = CONFIG['timeout'] if CONFIG['hedge_mode'] == 'sequential' else None
+        try:
+            result = check_public_ip(timeout=request_timeout, on_attempt=self._emit_attempt, cache=self.cache,
+                                     cancel_event=self.cancel_event)
+        except CheckCancelledError:
+            raise
+        except (NoConnectivityError, IPDetectionError) as e:
+            self.error.emit(check_error_message(e))
+            return
+        except Exception as e:
+            print(f"Nieoczekiwany błąd wątku: {e}")
+            self.error.emit(f"Nieoczekiwany błąd wątku: {str(e)}")
+            return
+
+        if "error_loc" in result:
+            # Udało się pobrać IP, ale nie dane lokalizacyjne
+            print(f"Nie udało się pobrać danych lokalizacyjnych dla IP: {result['ip']}, ale wysyłam IP.")
+        else:
+            print(f"Połączenia HTTP: {HTTP_POOL.stats()}, cache: {self.cache.stats()}")
+        # Niepełnych danych nie zapisujemy w trwałym cache - kolejne sprawdzenie spróbuje ponownie
+        self.finished.emit(result)
+
+    def normalize_ip_data(self, data, ip):
+        """Normalizuje dane z różnych serwisów IP"""
+        return normalize_ip_data(data, ip)
+
+
+class HistoryLoaderThread(QThread):
+    """Otwiera bazę historii (z ewentualną migracją JSON) i czyta pierwszą stronę poza wątkiem GUI"""
+    loaded = pyqtSignal(object, int, object)
+    error = pyqtSignal(str)
+
+    def __init__(self, path, legacy_json=None, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.legacy_json = legacy_json
 
     def run(self):
         try:
-            # Szybkie sprawdzenie połączenia
-            conn_status = self.check_connectivity()
-            if conn_status is False:
-                self.error.emit("Brak połączenia z internetem. Sprawdź kabel/WiFi.")
-                return
-            
-            services_to_try = CONFIG['ip_services']
-            dns_error_mode = False
-
-            if conn_status == "DNS_ERROR":
-                print("⚠️ Tryb awaryjny DNS: Priorytetyzacja serwisów IP.")
-                dns_error_mode = True
-                # Przesuń serwisy z "1.1.1.1" na początek listy
-                ip_services = [s for s in services_to_try if "1.1.1.1" in s[0]]
-                other_services = [s for s in services_to_try if "1.1.1.1" not in s[0]]
-                services_to_try = ip_services + other_services
-
-            ip = None
-            last_error = None
-            
-            for service, response_type in services_to_try:
-                try:
-                    print(f"Próbuję serwisu: {service}")
-                    if self.is_cached('ip'):
-                        ip = self.get_from_cache('ip')
-                        print(f"Użyto cache dla IP: {ip}")
-                        break
-
-                    response = self.validate_and_fetch(service)
-                    
-                    if response_type == "json":
-                        ip = response.json().get("ip")
-                    elif response_type == "cloudflare_trace":
-                        # Parsowanie formatu key=value
-                        for line in response.text.splitlines():
-                            if line.startswith("ip="):
-                                ip = line.split("=")[1].strip()
-                                break
-                    else:
-                        ip = response.text.strip()
-
-                    if ip and validate_ip(ip):
-                        self.add_to_cache('ip', ip)
-                        print(f"Pobrano i zwalidowano IP: {ip}")
-                        break
-                except Exception as e:
-                    print(f"Błąd pobierania IP z {service}: {e}")
-                    last_error = e
-
-            if not ip:
-                error_msg = "Nie udało się pobrać adresu IP."
-                if isinstance(last_error, requests.exceptions.ConnectionError) or dns_error_mode:
-                    error_msg += " (Problem z połączeniem/DNS)"
-                self.error.emit(error_msg)
-                return
+            store = HistoryStore(self.path, legacy_json=self.legacy_json,
+                                 compact_max_gap=CONFIG['history_compact_max_gap'])
+            total = store.count()
+            rows = HistoryRows.from_store(store, limit=HistoryTableModel.PAGE_SIZE, newest_first=True)
+            self.loaded.emit(store, total, rows)
+        except Exception as e:
+            print(f"Błąd wczytywania historii: {e}")
+            self.error.emit(str(e))
 
-            # Jeśli mamy tryb awaryjny DNS, nie próbujemy pobierać lokalizacji (bo to wymaga DNS)
-            if dns_error_mode:
-                print("Pominięto pobieranie lokalizacji z powodu awarii DNS.")
-                partial_data = self.normalize_ip_data({}, ip)
-                partial_data["error_loc"] = "Niedostępne (Awaria DNS)"
-                self.finished.emit(partial_data)
-                return
 
-            info_cache_key = f"info_{ip}"
-            if self.is_cached(info_cache_key):
-                data = self.get_from_cache(info_cache_key)
-                self.finished.emit(data)
-                return
+class HistoryReaderThread(QThread):
+    """Wątek czytający całą historię przez własne połączenie; cancel() przerywa trwające zapytanie"""
+    loaded = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.store = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        store = self.store
+        if store is not None:
+            store.interrupt()
+
+    def read_store(self, build):
+        """Zwraca build(store) dla świeżo otwartej bazy albo None, gdy wczytywanie anulowano"""
+        self.store = HistoryStore(self.path)
+        try:
+            if self.cancelled:
+                return None
+            return build(self.store)
+        except sqlite3.OperationalError:
+            if self.cancelled:
+                return None  # Zapytanie przerwane przez cancel()
+            raise
+        finally:
+            store, self.store = self.store, None
+            store.close()
 
-            for service in CONFIG['info_services']:
-                try:
-                    service_url = service.format(ip=ip)
-                    response = self.validate_and_fetch(service_url)
-                    data = response.json()
-                    normalized_data = self.normalize_ip_data(data, ip)
-
-                    if "loc" in normalized_data:  # Kluczowe jest 'loc'
-                        self.add_to_cache(info_cache_key, normalized_data)
-                        print(f"Pobrano dane lokalizacyjne dla {ip}")
-                        self.finished.emit(normalized_data)
-                        return
-                except Exception as e:
-                    print(f"Błąd pobrania info z {service}: {e}")
-
-            # Jeśli doszliśmy tutaj, to znaczy, że udało się pobrać IP, ale nie dane lokalizacyjne
-            print(
-                f"Nie udało się pobrać danych lokalizacyjnych dla IP: {ip}, ale wysyłam IP."
-            )
-            partial_data = self.normalize_ip_data({}, ip)
-            partial_data["error_loc"] = "Nie udało się pobrać danych lokalizacyjnych."
-            self.add_to_cache(info_cache_key, partial_data)
-            self.finished.emit(partial_data)
 
+class ClusterLoaderThread(HistoryReaderThread):
+    """Liczy klastry lokalizacji z historii (history_clusters.py) dla warstwy mapy poza wątkiem GUI"""
+
+    def run(self):
+        try:
+            from history_clusters import HistoryClusters
+        except ImportError as e:
+            self.error.emit(f"Warstwa historii na mapie wymaga pakietu numpy (pip install numpy): {e}")
+            return
+        try:
+            clusters = self.read_store(HistoryClusters.from_store)
+            if clusters is not None and not self.cancelled:
+                self.loaded.emit(clusters)
         except Exception as e:
-            print(f"Nieoczekiwany błąd wątku: {e}")
-            self.error.emit(f"Nieoczekiwany błąd wątku: {str(e)}")
+            print(f"Błąd wczytywania klastrów historii: {e}")
+            self.error.emit(str(e))
 
-    def normalize_ip_data(self, data, ip):
-        """Normalizuje dane z różnych serwisów IP"""
-        normalized = {"ip": ip}
-        field_mappings = {
-            "country": ["country", "country_name", "countryCode"],
-            "region": ["region", "region_name", "regionName"],
-            "city": ["city", "city_name"],
-            "postal": ["postal", "zip"],
-            "timezone": ["timezone", "time_zone"],
-            "org": ["org", "isp", "as"],
-            "loc": ["loc"],
-            "lat": ["lat", "latitude"],
-            "lon": ["lon", "longitude"],
-        }
 
-        for std_f, pos_f in field_mappings.items():
-            for f in pos_f:
-                if f in data and data[f]:
-                    normalized[std_f] = data[f]
-                    break
+class AnalyticsLoaderThread(HistoryReaderThread):
+    """Wczytuje historię do tablic NumPy (history_analytics.py) poza wątkiem GUI"""
+
+    def run(self):
+        try:
+            from history_analytics import HistoryAnalytics, snapshot_path
+        except ImportError as e:
+            self.error.emit(f"Statystyki wymagają pakietu numpy (pip install numpy): {e}")
+            return
+        try:
+            analytics = self.read_store(lambda store: HistoryAnalytics.from_store(store, snapshot_path(self.path)))
+            if analytics is not None and not self.cancelled:
+                self.loaded.emit(analytics)
+        except Exception as e:
+            print(f"Błąd wczytywania statystyk: {e}")
+            self.error.emit(str(e))
+
+
+class StatsDialog(QDialog):
+    """Statystyki historii: zmiany IP, czas przebywania per IP/dostawca/miasto, przerwy"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Statystyki historii")
+        self.resize(800, 650)
+        layout = QVBoxLayout(self)
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.text.setPlainText("Wczytywanie historii...")
+        layout.addWidget(self.text)
+        self.analytics = None
+
+    def set_analytics(self, analytics):
+        self.analytics = analytics
+        self.refresh()
+
+    def show_error(self, error_msg):
+        self.text.setPlainText(f"❌ {error_msg}")
+
+    def refresh(self):
+        if self.analytics is None:
+            return
+        from history_analytics import format_report
+        self.text.setPlainText(format_report(self.analytics.report()))
+
+
+class IPMonitorThread(QThread):
+    """Monitor zmian IP (ip_monitor.IPMonitor) działający w tle dla GUI"""
+    ip_changed = pyqtSignal(dict)
+    STOP_WAIT_MS = 500  # Tyle GUI czeka na zatrzymanie; dłużej trwające sprawdzenie kończy się w tle
+    _stopping = set()  # Zatrzymane wątki, które jeszcze kończą bieżące zapytanie
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.monitor = IPMonitor(
+            CONFIG['monitor_min_interval'], CONFIG['monitor_max_interval'],
+            log_path=CONFIG['monitor_log'], hook=CONFIG['monitor_hook'],
+        )
+        self.monitor.add_callback(self.ip_changed.emit)
+
+    def run(self):
+        try:
+            self.monitor.run()
+        except Exception as e:
+            print(f"Błąd monitora IP: {e}")
 
-        if "loc" not in normalized and "lat" in normalized and "lon" in normalized:
-            normalized["loc"] = f"{normalized['lat']},{normalized['lon']}"
+    def stop(self):
+        """Zatrzymuje monitor bez blokowania GUI na czas trwającego zapytania lub hooka"""
+        self.monitor.stop()
+        if self.wait(self.STOP_WAIT_MS):
+            return
+        # Referencja w _stopping - wątek nie może zniknąć, zanim się zakończy
+        IPMonitorThread._stopping.add(self)
+        self.finished.connect(self._on_stopped)
+        if self.isFinished():  # Zakończył się między wait() a podłączeniem sygnału
+            self._on_stopped()
 
-        return normalized
+    def _on_stopped(self):
+        IPMonitorThread._stopping.discard(self)
+        self.deleteLater()
+
+    @classmethod
+    def wait_stopping(cls, msecs):
+        """Przy zamykaniu aplikacji: czeka (ograniczenie czasu na wątek) na zatrzymywane monitory"""
+        for thread in list(cls._stopping):
+            thread.wait(msecs)
+
+
+class DiagnosticsDialog(QDialog):
+    """Panel diagnostyki: czasy faz sprawdzenia, liczniki i stan cache/dostawców"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Diagnostyka")
+        self.resize(900, 600)
+        layout = QVBoxLayout(self)
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        layout.addWidget(self.text)
+
+        buttons = QHBoxLayout()
+        for label, slot in (
+            ("Eksport JSON", self.export_json),
+            ("Eksport Prometheus", self.export_prometheus),
+            ("Wyzeruj", self.reset),
+        ):
+            button = QPushButton(label)
+            button.clicked.connect(slot)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        # Odświeżanie tylko, gdy panel jest widoczny
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    @staticmethod
+    def _format_labels(labels):
+        return ", ".join(f"{key}={value}" for key, value in labels.items())
+
+    def refresh(self):
+        snapshot = METRICS.snapshot()
+        lines = [f"{'Faza':<18} {'Etykiety':<44} {'n':>6} {'śr. ms':>9} {'ost. ms':>9} {'maks. ms':>9}"]
+        for span in snapshot["spans"]:
+            lines.append(
+                f"{span['name']:<18} {self._format_labels(span['labels']):<44} {span['count']:>6} "
+                f"{span['avg'] * 1000:>9.1f} {span['last'] * 1000:>9.1f} {span['max'] * 1000:>9.1f}"
+            )
+        lines += ["", "Liczniki:"]
+        for counter in snapshot["counters"]:
+            lines.append(f"  {counter['name']} {{{self._format_labels(counter['labels'])}}} = {counter['value']}")
+        lines += [
+            "",
+            f"Cache wyszukiwań: {LOOKUP_CACHE.stats()}",
+            f"Cache DNS: {DNS_CACHE.stats()}",
+            f"Połączenia HTTP: {HTTP_POOL.stats()}",
+            f"Limity dostawców: {PROVIDER_BUDGET.stats()}",
+            "",
+            "Ostatnie fazy:",
+        ]
+        for span in reversed(snapshot["recent"][-30:]):
+            at = datetime.fromtimestamp(span["time"]).strftime("%H:%M:%S")
+            lines.append(
+                f"  {at} {span['name']:<18} {span['seconds'] * 1000:>9.1f} ms  {self._format_labels(span['labels'])}"
+            )
+        scroll = self.text.verticalScrollBar().value()
+        self.text.setPlainText("\n".join(lines))
+        self.text.verticalScrollBar().setValue(scroll)
+
+    def export_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Eksport metryk (JSON)", CONFIG['metrics_json'] or "metrics.json")
+        if path:
+            METRICS.export(json_path=path)
+
+    def export_prometheus(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Eksport metryk (Prometheus)", CONFIG['metrics_prometheus'] or "metrics.prom"
+        )
+        if path:
+            METRICS.export(prometheus_path=path)
+
+    def reset(self):
+        METRICS.reset()
+        self.refresh()
 
 
 class MainWindow(QMainWindow):
+    LOADER_WAIT_MS = 5000  # Limit czekania na każdy wątek wczytujący historię przy zamykaniu
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Sprawdzacz IP")
         self.setMinimumSize(1200, 800)
-        self.history = []
-        self.history_file = Path("ip_history.json")
-        self.load_history()
+        self.history_file = Path("ip_history.json")  # Stary format - migrowany do bazy
+        # Baza historii jest otwierana w tle (load_history); do tego czasu wpisy czekają tutaj
+        self.history_store = None
+        self._pending_history = []
         self.checking_in_progress = False
+        self.ip_checker = None
+        # Wynik na ekranie (także ostatni z historii, pokazany przed zakończeniem sprawdzenia)
+        self.displayed_result = None
+        self._stale_since = None  # Czas wpisu historii, gdy wyświetlany wynik czeka na potwierdzenie
+        self._startup_times = {}
+        self._startup_steps_left = {"history", "map"}
+        self.exit_after_startup = False  # --startup-report: wypisz czasy startu i zakończ
 
         self.setStyleSheet(
             """
             QMainWindow { background-color: #2b2b2b; }
             QLabel { color: #ffffff; font-size: 14px; }
+            QCheckBox { color: #ffffff; font-size: 13px; }
             QPushButton {
                 background-color: #0d47a1;
                 color: white;
@@ -383,6 +672,30 @@ class MainWindow(QMainWindow):
                 font-size: 13px;
                 font-family: Consolas, 'Courier New', monospace;
             }
+            QTableView {
+                background-color: #1e1e1e;
+                alternate-background-color: #252525;
+                color: #ffffff;
+                gridline-color: #3d3d3d;
+                border: 1px solid #3d3d3d;
+                border-radius: 5px;
+                font-size: 13px;
+                font-family: Consolas, 'Courier New', monospace;
+            }
+            QHeaderView::section {
+                background-color: #2b2b2b;
+                color: #ffffff;
+                border: 1px solid #3d3d3d;
+                padding: 4px;
+            }
+            QLineEdit {
+                background-color: #1e1e1e;
+                color: #ffffff;
+                border: 1px solid #3d3d3d;
+                border-radius: 5px;
+                padding: 5px;
+                font-size: 13px;
+            }
             QSplitter::handle {
                 background-color: #3d3d3d;
                 width: 5px;
@@ -427,6 +740,46 @@ class MainWindow(QMainWindow):
         self.check_button.clicked.connect(self.check_ip)
         left_layout.addWidget(self.check_button)
 
+        self.cancel_button = QPushButton("Anuluj sprawdzanie")
+        self.cancel_button.setToolTip("Przerywa trwające sprawdzenie; wyświetlony wynik zostaje")
+        self.cancel_button.clicked.connect(lambda: self.cancel_check("⏹️ Sprawdzanie anulowane."))
+        self.cancel_button.setVisible(False)
+        left_layout.addWidget(self.cancel_button)
+
+        # Sprawdzenie, które przekroczyło termin (np. zawieszone połączenie), jest przerywane
+        self.check_watchdog = QTimer(self)
+        self.check_watchdog.setSingleShot(True)
+        self.check_watchdog.timeout.connect(self._on_check_timeout)
+
+        self.monitor_checkbox = QCheckBox("Monitoruj zmiany IP w tle")
+        self.monitor_checkbox.setToolTip(
+            "Reaguje na zmiany sieci i okresowo sprawdza IP; lokalizacja jest pobierana tylko po zmianie"
+        )
+        self.monitor_checkbox.toggled.connect(self.set_monitoring)
+        left_layout.addWidget(self.monitor_checkbox)
+        self.ip_monitor = None
+
+        self.diagnostics_button = QPushButton("Diagnostyka")
+        self.diagnostics_button.setToolTip("Czasy faz sprawdzenia, liczniki i eksport metryk")
+        self.diagnostics_button.clicked.connect(self.show_diagnostics)
+        left_layout.addWidget(self.diagnostics_button)
+        self.diagnostics_dialog = None
+
+        self.stats_button = QPushButton("Statystyki historii")
+        self.stats_button.setToolTip("Zmiany IP, czas przebywania per IP/dostawca/miasto, przerwy między sprawdzeniami")
+        self.stats_button.clicked.connect(self.show_stats)
+        left_layout.addWidget(self.stats_button)
+        self.stats_dialog = None
+        self.history_analytics = None  # Wczytywane przy pierwszym otwarciu panelu, potem przyrostowo
+        self.history_clusters = None  # Warstwa historii na mapie - wczytywana po bazie historii, potem przyrostowo
+
+        # Okresowy zapis plików metryk (np. dla kolektora textfile Prometheusa)
+        self.metrics_export_timer = QTimer(self)
+        self.metrics_export_timer.setInterval(CONFIG['metrics_export_interval'] * 1000)
+        self.metrics_export_timer.timeout.connect(self.export_metrics)
+        if CONFIG['metrics_json'] or CONFIG['metrics_prometheus']:
+            self.metrics_export_timer.start()
+
         # Progress bar
         self.progress_bar = QProgressBar()
         self.progress_bar.setRange(0, 100)
@@ -453,11 +806,39 @@ class MainWindow(QMainWindow):
             "font-size: 18px; font-weight: bold; margin: 5px 0;"
         )
         history_layout.addWidget(history_title)
-        self.history_text = QTextEdit()
-        self.history_text.setReadOnly(True)
-        history_layout.addWidget(self.history_text)
-
-        self.highlighter = IPHighlighter(self.history_text.document())
+        self.history_filter = QLineEdit()
+        self.history_filter.setPlaceholderText("Filtruj (IP, miasto, kraj, region, dostawca)...")
+        history_layout.addWidget(self.history_filter)
+        self.history_placeholder = QLabel("Wczytywanie historii...")
+        self.history_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        history_layout.addWidget(self.history_placeholder)
+
+        # Kolory IP wspólne dla panelu wyników i tabeli historii
+        self.highlighter = IPHighlighter(self.result_text.document())
+        self.history_model = HistoryTableModel(
+            None, color_for=self.highlighter.color_for, parent=self
+        )
+        self.history_view = QTableView()
+        self.history_view.setModel(self.history_model)
+        # Sortowanie jest włączane po wczytaniu historii (_on_history_loaded)
+        self.history_view.horizontalHeader().setSortIndicator(0, Qt.SortOrder.DescendingOrder)
+        self.history_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.history_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.history_view.verticalHeader().setVisible(False)
+        # Stała wysokość wierszy - widok nie musi mierzyć zawartości każdego wiersza
+        self.history_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.history_view.horizontalHeader().setStretchLastSection(True)
+        self.history_view.setVisible(False)
+        history_layout.addWidget(self.history_view)
+
+        # Filtr z krótkim opóźnieniem, żeby nie odpytywać bazy przy każdym znaku
+        self.history_filter_timer = QTimer(self)
+        self.history_filter_timer.setSingleShot(True)
+        self.history_filter_timer.setInterval(250)
+        self.history_filter_timer.timeout.connect(
+            lambda: self.history_model.set_filter(self.history_filter.text())
+        )
+        self.history_filter.textChanged.connect(self.history_filter_timer.start)
         splitter.addWidget(results_widget)
         splitter.addWidget(history_widget)
         splitter.setSizes([350, 250])  # Dostosowane rozmiary
@@ -478,6 +859,68 @@ class MainWindow(QMainWindow):
         )
         right_layout.addWidget(map_title_label)
 
+        self.tiles_offline_checkbox = QCheckBox("Mapa offline (tylko kafelki z cache)")
+        self.tiles_offline_checkbox.setChecked(CONFIG['tiles_offline'])
+        self.tiles_offline_checkbox.toggled.connect(self.set_tiles_offline)
+        right_layout.addWidget(self.tiles_offline_checkbox)
+
+        # QWebEngineView (start Chromium) powstaje dopiero po pierwszym odświeżeniu okna
+        self.map_view = None
+        self.map_layout = right_layout
+        self.map_placeholder = QLabel("Ładowanie mapy...")
+        self.map_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        right_layout.addWidget(self.map_placeholder, stretch=1)
+        self._map_ready = False
+        self._pending_map_js = []
+
+        self.tile_store = TileStore(
+            CONFIG['tile_cache_file'], max_bytes=CONFIG['tile_cache_max_mb'] * 1024 * 1024
+        )
+        self.tile_fetcher = TileFetcher(
+            self.tile_store, CONFIG['tile_upstream'], offline=CONFIG['tiles_offline'], parent=self
+        )
+
+        main_layout.addWidget(
+            right_widget, stretch=2
+        )  # Prawa strona, większy stretch, aby była szersza
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if "first_paint" not in self._startup_times:
+            self._mark_startup("first_paint")
+            # Ciężkie kroki dopiero po narysowaniu okna (kolejna iteracja pętli zdarzeń)
+            QTimer.singleShot(0, self._deferred_startup)
+
+    def _deferred_startup(self):
+        if CONFIG['check_on_startup'] and not self.exit_after_startup:
+            # Sprawdzenie równolegle z wczytywaniem historii, której ostatni wpis pokazujemy od razu
+            self.check_ip()
+        self.load_history()
+        self._init_map_view()
+
+    def _mark_startup(self, stage):
+        """Zapisuje czas etapu startu liczony od uruchomienia procesu"""
+        elapsed = time.perf_counter() - PROCESS_START
+        self._startup_times[stage] = elapsed
+        METRICS.observe("startup", elapsed, stage=stage)
+        print(f"Start: {stage} po {elapsed * 1000:.0f} ms")
+
+    def _startup_step_done(self, step):
+        if step not in self._startup_steps_left:
+            return
+        self._startup_steps_left.discard(step)
+        if not self._startup_steps_left:
+            # Historia wczytana i mapa gotowa na wywołania - aplikacja w pełni interaktywna
+            self._mark_startup("interactive")
+            if self.exit_after_startup:
+                print("STARTUP " + json.dumps(self.startup_report()))
+                QApplication.quit()
+
+    def startup_report(self):
+        """Czasy etapów startu w ms (first_paint, history_loaded, map_view, map_ready, first_result, interactive)"""
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self._startup_times.items()}
+
+    def _init_map_view(self):
         self.map_view = QWebEngineView()
         settings = self.map_view.settings()
         settings.setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
@@ -491,127 +934,150 @@ class MainWindow(QMainWindow):
         # QWebEngineProfile.defaultProfile().setHttpCacheType(QWebEngineProfile.HttpCacheType.DiskCache) # Można potestować
         # self.map_view.page().profile().setPersistentCookiesPolicy(QWebEngineProfile.PersistentCookiesPolicy.AllowPersistentCookies)
 
-        # self.map_view.setMinimumSize(300, 300) # Minimum, ale powinna się rozciągnąć
-        right_layout.addWidget(
-            self.map_view, stretch=1
-        )  # Stretch = 1, aby wypełniła dostępną przestrzeń w QVBoxLayout
+        self.map_scheme_handler = MapSchemeHandler(self.tile_fetcher, self.history_clusters, parent=self)
+        self.map_view.page().profile().installUrlSchemeHandler(MAP_SCHEME, self.map_scheme_handler)
+        self.map_view.loadFinished.connect(self._on_map_loaded)
 
-        main_layout.addWidget(
-            right_widget, stretch=2
-        )  # Prawa strona, większy stretch, aby była szersza
+        # Mapa zastępuje napis zastępczy i wypełnia dostępną przestrzeń
+        self.map_layout.replaceWidget(self.map_placeholder, self.map_view)
+        self.map_placeholder.deleteLater()
+        self.map_layout.setStretchFactor(self.map_view, 1)
+        self._mark_startup("map_view")
 
-        self.init_default_map()
-        self.display_history()
+        self._load_map_page()
 
     def load_history(self):
+        """Wczytuje historię w tle; tabela pokazuje napis zastępczy do czasu _on_history_loaded"""
+        self.history_loader = HistoryLoaderThread(CONFIG['history_db'], self.history_file, self)
+        self.history_loader.loaded.connect(self._on_history_loaded)
+        self.history_loader.error.connect(self._on_history_error)
+        self.history_loader.start()
+
+    def _on_history_loaded(self, store, total, rows):
+        self.history_store = store
+        # Wpisy ze sprawdzeń zakończonych w trakcie wczytywania - w kolejności zakończenia
+        # (najstarsze na początku); save_history musi je dopisać właśnie w tej kolejności
+        pending, self._pending_history = self._pending_history, []
+        for entry in pending:
+            self.save_history(entry)
+        if pending:
+            # Zapisane wpisy mogły wydłużyć ostatni przedział zamiast dodać wiersze
+            total = store.count()
+            rows = HistoryRows.from_store(store, limit=HistoryTableModel.PAGE_SIZE, newest_first=True)
+        self.history_model.set_loaded(store, total, rows)
+        self.history_placeholder.setVisible(False)
+        self.history_view.setVisible(True)
+        self.history_view.setSortingEnabled(True)
+        self._mark_startup("history_loaded")
+        self._startup_step_done("history")
+        if self.displayed_result is None and len(rows):
+            self.show_stale_result(rows[0])
+        # Klastry mapy czytają całą historię - osobny wątek, już po ewentualnej migracji bazy
+        self.cluster_loader = ClusterLoaderThread(CONFIG['history_db'], self)
+        self.cluster_loader.loaded.connect(self._on_clusters_loaded)
+        self.cluster_loader.error.connect(lambda error_msg: print(f"Warstwa historii niedostępna: {error_msg}"))
+        self.cluster_loader.start()
+
+    def _on_clusters_loaded(self, clusters):
+        # Sprawdzenia zapisane w trakcie liczenia klastrów
+        clusters.update_from_store(self.history_store)
+        self.history_clusters = clusters
+        if self.map_view is not None:
+            self.map_scheme_handler.history_provider = clusters
+        self._map_call("refreshHistory")
+
+    def _on_history_error(self, error_msg):
+        self.history_placeholder.setText(f"Nie udało się wczytać historii: {error_msg}")
+        self._startup_step_done("history")
+
+    def close_history(self):
+        """Zamyka bazę historii; wątki czytające całą historię są przerywane, na wszystkie czekamy z limitem"""
+        loaders = {
+            name: getattr(self, name, None) for name in ("history_loader", "cluster_loader", "analytics_loader")
+        }
+        for loader in loaders.values():
+            if isinstance(loader, HistoryReaderThread):
+                loader.cancel()
+        for name, loader in loaders.items():
+            if loader is not None and not loader.wait(self.LOADER_WAIT_MS):
+                print(f"Wątek {name} nie zakończył się w {self.LOADER_WAIT_MS} ms")
+        if self.history_store is not None:
+            self.history_store.close()
+
+    def save_history(self, entry):
+        """Dopisuje sprawdzenie do bazy historii; zwraca przedział, do którego trafiło.
+
+        Identyczny wynik jak poprzedni wydłuża ostatni wpis (count > 1) zamiast
+        dodawać nowy. None - baza jeszcze się wczytuje albo błąd zapisu.
+        """
+        if self.history_store is None:
+            self._pending_history.append(entry)
+            return None
         try:
-            if self.history_file.exists():
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    self.history = json.load(f)
-        except Exception as e:
-            print(f"Błąd wczytywania historii: {e}")
-            self.history = []
-
-    def save_history(self):
-        try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            with METRICS.span("history_save") as labels:
+                interval = self.history_store.append(entry)
+                labels["compacted"] = interval["count"] > 1
+                return interval
         except Exception as e:
             print(f"Błąd zapisywania historii: {e}")
+            return None
 
     def display_history(self):
-        self.history_text.clear()
-        for entry in self.history:
-            self.history_text.append(
-                f"[{entry['timestamp']}] {entry['ip']} - {entry.get('city', 'N/A')}, {entry.get('country', 'N/A')}\n"
-            )
-            self.highlighter.set_ip_color(entry["ip"])
-        self.history_text.moveCursor(self.history_text.textCursor().MoveOperation.End)
-        self.highlighter.rehighlight()
-
-    def _get_map_html(self, lat=None, lon=None):
-        if lat is not None and lon is not None:
-            center = f"[{lat}, {lon}]"
-            zoom = 13
-            marker_js = f"L.marker([{lat}, {lon}]).addTo(mymap).bindPopup('<b>Lokalizacja IP</b><br>{lat}, {lon}').openPopup();"
+        """Odświeża tabelę historii (widok renderuje tylko widoczne wiersze)"""
+        self.history_model.reload()
+        self.history_view.scrollToTop()
+
+    def _load_map_page(self):
+        """Ładuje stronę mapy jeden raz; kolejne zmiany idą przez runJavaScript"""
+        self._map_ready = False
+        self.map_view.load(MAP_PAGE_URL)
+
+    def _on_map_loaded(self, ok):
+        if not ok:
+            print("Błąd ładowania strony mapy.")
+            self._startup_step_done("map")
+            return
+        self._map_ready = True
+        if "map_ready" not in self._startup_times:
+            self._mark_startup("map_ready")
+            self._startup_step_done("map")
+        pending, self._pending_map_js = self._pending_map_js, []
+        for name, script in pending:
+            self._run_map_script(name, script)
+
+    def _run_map_script(self, name, script):
+        """Wykonuje skrypt mapy; czas do zakończenia po stronie JS trafia do metryki map_render"""
+        started = time.perf_counter()
+        self.map_view.page().runJavaScript(
+            script,
+            lambda result, name=name: METRICS.observe("map_render", time.perf_counter() - started, call=name),
+        )
+
+    def _map_call(self, name, *args):
+        """Wywołuje funkcję API mapy (ipMap) na załadowanej stronie"""
+        script = f"ipMap.call({json.dumps(name)}, {json.dumps(list(args))});"
+        if self._map_ready:
+            self._run_map_script(name, script)
         else:
-            center = "[52.2297, 21.0122]"  # Warszawa
-            zoom = 6
-            marker_js = ""
-
-        return f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8" />
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Mapa IP</title>
-            <!-- Używamy cdnjs jako głównego źródła, jest często bardziej stabilny -->
-            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/leaflet.css" />
-            <script src="https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/leaflet.js"></script>
-            <style>
-                body {{ margin: 0; padding: 0; background-color: #2b2b2b; font-family: Arial, sans-serif; }}
-                #mapid {{ height: 100vh; width: 100%; }}
-                .loading {{ display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100vh; color: #ffffff; text-align: center; }}
-                .retry-btn {{ margin-top: 10px; padding: 5px 10px; background: #0d47a1; color: white; border: none; cursor: pointer; display: none; }}
-            </style>
-        </head>
-        <body>
-            <div id="loading" class="loading">
-                <span id="loading-text">Ładowanie mapy...</span>
-                <button id="retry-btn" class="retry-btn" onclick="location.reload()">Spróbuj ponownie</button>
-            </div>
-            <div id="mapid" style="display:none;"></div>
-            <script>
-                function initMap() {{
-                    document.getElementById('loading').style.display = 'none';
-                    document.getElementById('mapid').style.display = 'block';
-                    
-                    var mymap = L.map('mapid').setView({center}, {zoom});
-                    
-                    L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
-                        attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-                        maxZoom: 19
-                    }}).addTo(mymap);
-                    
-                    {marker_js}
-                    
-                    setTimeout(function() {{ mymap.invalidateSize(); }}, 500);
-                }}
-
-                function checkLeaflet(attempts) {{
-                    if (typeof L !== 'undefined') {{
-                        initMap();
-                    }} else if (attempts > 0) {{
-                        // Próbuj dalej
-                        document.getElementById('loading-text').innerText = 'Ładowanie biblioteki mapy... (' + attempts + ')';
-                        setTimeout(function() {{ checkLeaflet(attempts - 1); }}, 500);
-                    }} else {{
-                        // Poddaj się po wielu próbach
-                        document.getElementById('loading-text').innerText = 'Błąd: Nie udało się załadować biblioteki Leaflet (timeout). Sprawdź połączenie internetowe.';
-                        document.getElementById('retry-btn').style.display = 'inline-block';
-                    }}
-                }}
-                
-                // Rozpocznij sprawdzanie z limitem 20 prób co 500ms (czyli 10 sekund na załadowanie)
-                if (document.readyState === 'loading') {{
-                    document.addEventListener('DOMContentLoaded', function() {{ checkLeaflet(20); }});
-                }} else {{
-                    checkLeaflet(20);
-                }}
-            </script>
-        </body>
-        </html>
-        """
+            self._pending_map_js.append((name, script))
 
     def init_default_map(self):
-        self.map_view.setHtml(self._get_map_html())
+        self._map_call("showDefault")
+
+    def set_tiles_offline(self, offline):
+        self.tile_fetcher.offline = offline
+
+    def prefetch_tiles(self, lat, lon):
+        """Pobiera z wyprzedzeniem kafelki wokół wyniku (zoom mapy 13 i sąsiednie)"""
+        for zoom in (12, 13, 14):
+            self.tile_fetcher.prefetch(lat, lon, zoom, CONFIG['tile_prefetch_radius'])
 
-    def update_map(self, lat, lon):
+    def update_map(self, lat, lon, label=None):
         try:
             lat_f = float(lat)
             lon_f = float(lon)
-            self.map_view.setHtml(self._get_map_html(lat_f, lon_f))
+            self._map_call("showLocation", lat_f, lon_f, label)
+            self.prefetch_tiles(lat_f, lon_f)
         except ValueError:
             print(f"Błąd współrzędnych: {lat}, {lon}")
             self.init_default_map()
@@ -623,14 +1089,106 @@ class MainWindow(QMainWindow):
 
         self.checking_in_progress = True
         self.check_button.setEnabled(False)
+        self.cancel_button.setVisible(True)
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
 
-        self.ip_checker = IPCheckerThread(self)
-        self.ip_checker.finished.connect(self.show_results)
-        self.ip_checker.error.connect(self.show_error)
-        self.ip_checker.progress.connect(self.update_progress)
-        self.ip_checker.start()
+        # 'async' - korutyna na wspólnej pętli asyncio zamiast osobnego QThread
+        if CONFIG['engine'] == 'async':
+            checker = AsyncIPChecker(self)
+        else:
+            checker = IPCheckerThread(self)
+        self.ip_checker = checker
+        # Sygnały anulowanego sprawdzenia, które dotrą później, są pomijane
+        checker.finished.connect(lambda data: self._on_check_finished(checker, data))
+        checker.error.connect(lambda error_msg: self._on_check_failed(checker, error_msg))
+        checker.progress.connect(self.update_progress)
+        checker.start()
+        self.check_watchdog.start(int((CONFIG['check_deadline'] + CONFIG['check_watchdog_grace']) * 1000))
+
+    def _on_check_finished(self, checker, data):
+        if checker is self.ip_checker:
+            self.show_results(data)
+
+    def _on_check_failed(self, checker, error_msg):
+        if checker is self.ip_checker:
+            self.show_error(error_msg)
+
+    def _finish_check(self):
+        """Przywraca przyciski i pasek postępu po zakończeniu, błędzie lub anulowaniu sprawdzenia"""
+        self.check_watchdog.stop()
+        self.ip_checker = None
+        self.checking_in_progress = False
+        self.check_button.setEnabled(True)
+        self.cancel_button.setVisible(False)
+        self.progress_bar.setVisible(False)
+
+    def cancel_check(self, message):
+        """Przerywa trwające sprawdzenie; wyświetlony wynik zostaje, a pod nim pojawia się komunikat"""
+        checker = self.ip_checker
+        if checker is None:
+            return
+        checker.cancel()
+        self._finish_check()
+        if self.displayed_result is not None:
+            self.result_text.append(f"\n{message}")
+        else:
+            self.result_text.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.result_text.setText(message)
+
+    def _on_check_timeout(self):
+        print("Sprawdzenie przekroczyło termin - przerywam")
+        self.cancel_check("⏱️ Sprawdzanie przerwane - przekroczono limit czasu.")
+
+    def stop_checks(self):
+        """Przerywa sprawdzenie przy zamykaniu aplikacji (wątek dostaje chwilę na zakończenie)"""
+        checker = self.ip_checker
+        if checker is None:
+            return
+        self.cancel_check("⏹️ Sprawdzanie anulowane.")
+        if isinstance(checker, QThread):
+            checker.wait(2000)
+
+    def show_diagnostics(self):
+        if self.diagnostics_dialog is None:
+            self.diagnostics_dialog = DiagnosticsDialog(self)
+        self.diagnostics_dialog.show()
+        self.diagnostics_dialog.raise_()
+
+    def show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self)
+            self.analytics_loader = AnalyticsLoaderThread(CONFIG['history_db'], self)
+            self.analytics_loader.loaded.connect(self._on_analytics_loaded)
+            self.analytics_loader.error.connect(self.stats_dialog.show_error)
+            self.analytics_loader.start()
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
+
+    def _on_analytics_loaded(self, analytics):
+        self.history_analytics = analytics
+        # Sprawdzenia zapisane w trakcie wczytywania mogły nie zdążyć trafić do odczytu
+        if self.history_store is not None:
+            analytics.update_from_store(self.history_store)
+        self.stats_dialog.set_analytics(analytics)
+
+    def export_metrics(self):
+        METRICS.export(CONFIG['metrics_json'], CONFIG['metrics_prometheus'])
+
+    def set_monitoring(self, enabled):
+        """Włącza/wyłącza monitor zmian IP"""
+        if enabled and self.ip_monitor is None:
+            self.ip_monitor = IPMonitorThread(self)
+            self.ip_monitor.ip_changed.connect(self.on_ip_changed)
+            self.ip_monitor.start()
+        elif not enabled and self.ip_monitor is not None:
+            self.ip_monitor.stop()
+            self.ip_monitor = None
+
+    def on_ip_changed(self, event):
+        print(f"Wykryto zmianę IP: {event['old_ip']} -> {event['new_ip']}")
+        if not self.checking_in_progress:
+            self.show_results(event["data"])
 
     def update_progress(self, value):
         """Aktualizuje wartość progress bar"""
@@ -638,10 +1196,66 @@ class MainWindow(QMainWindow):
 
     def show_results(self, data):
         """Metoda wyświetlająca wyniki"""
-        self.check_button.setEnabled(True)
-        self.progress_bar.setVisible(False)
-        self.checking_in_progress = False
-        self.result_text.setAlignment(Qt.AlignmentFlag.AlignLeft)
+        self._finish_check()
+        # Porównanie z poprzednio wyświetlonym wynikiem (także z historii pokazanej przy starcie)
+        changes = result_changes(self.displayed_result, data) if self.displayed_result is not None else None
+        previous_stale = self._stale_since
+        ip = data.get("ip", "Nieznany")
+
+        text_parts = self._result_text_parts(data)
+        if changes:
+            text_parts.append("\n🔄 Zmiany od poprzedniego wyniku:")
+            text_parts.extend(
+                f"   {RESULT_FIELD_LABELS.get(field, field)}: {old or 'brak'} → {new or 'brak'}"
+                for field, old, new in changes
+            )
+        elif previous_stale is not None:
+            text_parts.append(f"\n✅ Bez zmian od ostatniego wyniku ({previous_stale})")
+        located = self._render_result(data, text_parts)
+        if located and self.history_clusters is None:
+            # Klastry jeszcze się liczą (po wczytaniu zawierają też ten punkt) lub brak numpy
+            lat, lon = data["loc"].split(",")
+            self._map_call("addHistoryMarker", float(lat), float(lon), html.escape(f"{ip} ({data.get('city', 'N/A')})"))
+        self.displayed_result = data
+        self._stale_since = None
+        if "first_result" not in self._startup_times:
+            self._mark_startup("first_result")
+
+        # Historia
+        entry_data = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "ip": ip,
+        }
+        for key in HISTORY_FIELDS:
+            if key in data:
+                entry_data[key] = data[key]
+        interval = self.save_history(entry_data)
+        if interval is not None and interval["count"] > 1:
+            self.history_model.update_latest(interval)
+        else:
+            self.history_model.add_entry(interval or entry_data)
+        # Klastry mapy dostają tylko nowe sprawdzenie (jedna komórka na poziom przybliżenia)
+        if self.history_clusters is not None and self.history_clusters.update_from_store(self.history_store):
+            self._map_call("refreshHistory")
+        # Statystyki doczytują tylko nowe wiersze (wpis czekający na bazę trafi tam przy następnym odczycie)
+        if self.history_analytics is not None and self.history_store is not None:
+            self.history_analytics.update_from_store(self.history_store)
+            if self.stats_dialog.isVisible():
+                self.stats_dialog.refresh()
+
+    def show_stale_result(self, entry):
+        """Pokazuje ostatni wynik z historii, zanim sprawdzenie w tle go potwierdzi (stale-while-revalidate)"""
+        seen = entry.get("last_seen") or entry.get("timestamp")
+        header = f"🕘 Ostatni znany wynik ({seen})"
+        if self.checking_in_progress:
+            header += " - odświeżanie w tle..."
+        self._render_result(entry, [header] + self._result_text_parts(entry))
+        self.displayed_result = entry
+        self._stale_since = seen
+        self._mark_startup("first_result")
+
+    def _result_text_parts(self, data):
+        """Linie panelu wyników dla rekordu (wynik sprawdzenia lub wpis historii)"""
         ip = data.get("ip", "Nieznany")
         loc_error = data.get(
             "error_loc"
@@ -652,6 +1266,13 @@ class MainWindow(QMainWindow):
             f"Adres IP: {ip}",
             f"================================",
         ]
+        # Drugi adres z wykrywania dual-stack (IPv6 obok IPv4 lub odwrotnie)
+        for family, info in data.get("addresses", {}).items():
+            if info.get("ip") != ip:
+                place = info.get("error_loc") or ", ".join(
+                    value for value in (info.get("city"), info.get("country")) if value) or "N/A"
+                text_parts.append(f"Adres {family}: {info.get('ip')} ({place})")
+                self.highlighter.set_ip_color(info.get("ip"))
         if loc_error:
             text_parts.append(f"\n⚠️ Lokalizacja: {loc_error}")
         else:
@@ -666,46 +1287,40 @@ class MainWindow(QMainWindow):
                     f"\n🌐 Dostawca (ISP/ORG): {data.get('org', 'N/A')}",
                 ]
             )
+        return text_parts
 
+    def _render_result(self, data, text_parts):
+        """Wypełnia panel wyników i pokazuje lokalizację na mapie; zwraca True, gdy ją pokazano"""
+        ip = data.get("ip", "Nieznany")
+        self.result_text.setAlignment(Qt.AlignmentFlag.AlignLeft)
+        self.highlighter.set_ip_color(ip)
         self.result_text.setText("\n".join(text_parts))
 
-        if "loc" in data and not loc_error:
+        if "loc" in data and not data.get("error_loc"):
             try:
                 lat, lon = data["loc"].split(",")
-                self.update_map(lat, lon)
+                place = html.escape(f"{data.get('city', '')} {data.get('country', '')}")
+                self.update_map(lat, lon, f"<b>{html.escape(ip)}</b><br>{place}")
+                return True
             except ValueError:
                 self.result_text.append("\n\n⚠️ Błąd formatu współrzędnych lokalizacji.")
                 self.init_default_map()  # Pokaż domyślną mapę
         else:  # Jeśli nie ma 'loc' lub był błąd lokalizacji
             self.init_default_map()
-
-        self.check_button.setEnabled(True)
-        # Historia
-        entry_data = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "ip": ip,
-        }
-        for key in ["city", "country", "region", "postal", "timezone", "org", "loc"]:
-            if key in data:
-                entry_data[key] = data[key]
-        self.history.append(entry_data)
-        self.save_history()
-        self.display_history()
-        # self.highlighter.set_ip_color(ip); self.highlighter.rehighlight() # Już w display_history
+        return False
 
     def show_error(self, error_msg):
+        self._finish_check()
+        if self.displayed_result is not None:
+            # Poprzedni wynik (np. z historii przy starcie) zostaje na ekranie i na mapie
+            self.result_text.append(f"\n❌ Nie udało się odświeżyć wyniku: {error_msg}")
+            return
         self.result_text.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.result_text.setText(f"❌ Błąd wątku: {error_msg}")
-        self.check_button.setEnabled(True)
         self.init_default_map()
 
     def show_fallback_map_message(self, message="Mapa tymczasowo niedostępna."):
-        fallback_html = f"""<!DOCTYPE html><html><head><meta charset="utf-8">
-        <style>html,body{{height:100%;margin:0;padding:0;display:flex;justify-content:center;align-items:center;background-color:#2b2b2b;color:#fff;font-family:Arial,sans-serif;text-align:center;}}
-        .container{{background-color:#1e1e1e;padding:20px 30px;border-radius:8px;border:1px solid #3d3d3d;}}</style></head><body>
-        <div class="container"><h3>🗺️ Informacja o mapie</h3><p>{message}</p></div></body></html>"""
-        self.map_view.setHtml(fallback_html, QUrl("about:blank"))
-
+        self._map_call("showMessage", message)
 
 if __name__ == "__main__":
     debug_port = "8081"
@@ -714,7 +1329,24 @@ if __name__ == "__main__":
     print(f"Otwórz w przeglądarce Chrome/Edge: http://localhost:{debug_port}")
     print(f"--- Koniec instrukcji debugowania ---\n")
 
+    register_map_scheme()  # Musi nastąpić przed utworzeniem QApplication
+    DNS_CACHE.install()
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(HTTP_POOL.close)
+    app.aboutToQuit.connect(PROVIDER_HEALTH.save)
+    app.aboutToQuit.connect(PROVIDER_HEALTH_V6.save)
+    app.aboutToQuit.connect(PROVIDER_BUDGET.save)
+    app.aboutToQuit.connect(LOOKUP_CACHE.save)
     window = MainWindow()
+    if "--startup-report" in sys.argv:
+        # Pomiar startu (np. ip_bench.py): koniec po osiągnięciu interaktywności, najpóźniej po minucie
+        window.exit_after_startup = True
+        QTimer.singleShot(60000, app.quit)
+    app.aboutToQuit.connect(window.stop_checks)
+    app.aboutToQuit.connect(window.close_history)
+    app.aboutToQuit.connect(window.tile_store.close)
+    app.aboutToQuit.connect(lambda: window.set_monitoring(False))
+    app.aboutToQuit.connect(lambda: IPMonitorThread.wait_stopping(5000))
+    app.aboutToQuit.connect(window.export_metrics)
     window.show()
     sys.exit(app.exec())
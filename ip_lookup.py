@@ -0,0 +1,733 @@
+"""Logika wyszukiwania IP niezależna od GUI (używana przez okno i tryb wsadowy)."""
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+from connectivity import DNS_ERROR, ConnectivityProbe, DNSCache
+from geoip_db import GeoIPDatabase
+from http_pool import SessionPool
+from lookup_cache import LookupCache
+from metrics import Metrics
+from provider_health import ProviderHealth, backoff_delay, is_dns_error, needs_dns, provider_key
+from rate_limit import ProviderBudget
+
+# Konfiguracja serwisów
+CONFIG = {
+    'ip_services': [
+        ("http://1.1.1.1/cdn-cgi/trace", "cloudflare_trace"),  # Domyślny: Cloudflare po IP (niezawodny)
+        ("https://ifconfig.me/ip", "text"),
+        ("https://icanhazip.com", "text")
+    ],
+    # Serwisy dla adresu IPv6 (połączenia wymuszane przez IPv6, patrz detect_public_ips)
+    'ip6_services': [
+        ("http://[2606:4700:4700::1111]/cdn-cgi/trace", "cloudflare_trace"),
+        ("https://ifconfig.me/ip", "text"),
+        ("https://icanhazip.com", "text")
+    ],
+    'info_services': [
+        "https://ipinfo.io/{ip}/json",
+        "https://ipapi.co/{ip}/json/",
+        "https://ip-api.com/json/{ip}"
+    ],
+    'engine': 'thread',  # 'thread' - IPCheckerThread, 'async' - AsyncIPChecker (async_engine.py)
+    'timeout': 5,
+    'max_retries': 3,
+    'hedge_mode': 'stagger',  # 'race' - wszystkie naraz, 'stagger' - z opóźnieniem, 'sequential' - po kolei
+    'hedge_delay': 0.3,  # Opóźnienie (s) przed uruchomieniem kolejnego serwisu w trybie 'stagger'
+    'check_deadline': 10,  # Łączny budżet czasu (s) na jedno sprawdzenie
+    'check_watchdog_grace': 5,  # GUI anuluje sprawdzenie trwające dłużej niż check_deadline + tyle sekund
+    'check_on_startup': True,  # Po starcie pokaż ostatni wynik z historii i odśwież go w tle
+    'dual_stack': True,  # Równolegle z IPv4 wykrywaj publiczny adres IPv6
+    'ip6_timeout': 3,  # Budżet (s) ścieżki IPv6 - sieć bez IPv6 nie wydłuża sprawdzenia
+    'cache_timeout': 3600,  # 1 godzina
+    'cache_file': 'ip_cache.json',  # Trwały cache IP -> lokalizacja
+    'cache_max_entries': 1024,
+    'http_pool_connections': 4,  # Liczba pul połączeń per sesja hosta
+    'http_pool_maxsize': 8,  # Maks. połączeń keep-alive w puli (>= liczba równoległych zapytań)
+    'history_db': 'ip_history.db',  # Historia sprawdzeń (history_store.py)
+    'history_compact_max_gap': 6 * 3600,  # Maks. przerwa (s), przy której identyczny wynik wydłuża ostatni wpis
+    'tile_cache_file': 'tiles.mbtiles',  # Cache kafelków mapy (tile_cache.py)
+    'tile_cache_max_mb': 200,
+    'tile_upstream': 'https://tile.openstreetmap.org/{z}/{x}/{y}.png',  # Można wskazać lokalny serwer testowy
+    'tiles_offline': False,  # True - mapa korzysta wyłącznie z kafelków w cache
+    'tile_prefetch_radius': 1,  # Ile kafelków wokół wyniku pobrać z wyprzedzeniem
+    'monitor_min_interval': 30,  # Monitor zmian IP: interwał odpytywania (s) po zmianie
+    'monitor_max_interval': 900,  # ... i maksymalny, gdy adres się nie zmienia
+    'monitor_log': 'ip_changes.jsonl',  # Log zdarzeń zmian IP (None - wyłączony)
+    'monitor_hook': None,  # Komenda uruchamiana przy zmianie IP (zmienne IP_OLD, IP_NEW)
+    'provider_health_file': 'provider_health.json',  # Stan dostawców (provider_health.py)
+    'provider_health_v6_file': 'provider_health_v6.json',  # ... osobno dla zapytań przez IPv6
+    # Limity dostawców (rate_limit.py): zapytań/s, maks. seria i dzienna kwota per host
+    'provider_limits': {
+        'ipinfo.io': {'rate': 1, 'burst': 5, 'daily': 1600},  # 50 tys. miesięcznie
+        'ipapi.co': {'rate': 1, 'burst': 3, 'daily': 1000},
+        'ip-api.com': {'rate': 0.75, 'burst': 45},  # 45 zapytań na minutę
+    },
+    'provider_budget_file': 'provider_budget.json',  # Dzienne liczniki kwot
+    'rate_limit_max_wait': 1.0,  # Maks. oczekiwanie (s) na token - dłużej: następny dostawca
+    'rate_limit_backoff': 60,  # Wstrzymanie (s) dostawcy po 429 bez nagłówka Retry-After
+    'connectivity_ttl': 30,  # Jak długo (s) pamiętać pozytywny wynik sprawdzenia łączności
+    'connectivity_failure_ttl': 5,  # ... i negatywny
+    'dns_cache_ttl': 300,  # Czas (s) przechowywania adresów hostów dostawców
+    'metrics_json': 'metrics.json',  # Eksport metryk (metrics.py); None - wyłączony
+    'metrics_prometheus': 'metrics.prom',  # ... w formacie tekstowym Prometheusa
+    'metrics_export_interval': 60,  # Co ile sekund GUI zapisuje pliki metryk
+    'server_host': '127.0.0.1',  # Tryb serwera (ip_server.py)
+    'server_port': 8780,
+    'server_socket': None,  # Ścieżka gniazda Unix zamiast TCP
+    'server_fresh_ttl': 30,  # Wiek (s) wyniku zwracanego bez odświeżania
+    'server_stale_ttl': 600,  # ... i zwracanego, gdy odświeżenie trwa w tle lub się nie udało
+    'server_error_ttl': 5,  # Jak długo pamiętać błąd wyszukiwania
+    'server_workers': 8,  # Wątki wyszukiwań (zapytania klientów tylko czekają na wynik)
+    'geoip_db': 'geoip.bin',  # Offline baza zakresów (geoip_db.py), używana przed info_services
+    'proxy': None  # Możliwe do konfiguracji
+}
+
+def validate_url(url):
+    """Walidacja URL"""
+    try:
+        # Sprawdzenie podstawowej struktury URL
+        result = urlparse(url)
+        if not all([result.scheme, result.netloc]):
+            return False
+
+        # Sprawdzenie poprawności schematu
+        if result.scheme not in ['http', 'https']:
+            return False
+
+        # Sprawdzenie poprawności hosta lub literału IPv6 w nawiasach (z opcjonalnym portem)
+        if not re.match(r'^(\[[0-9a-fA-F:.]+\]|[a-zA-Z0-9.-]+)(:[0-9]{1,5})?$', result.netloc):
+            return False
+
+        return True
+    except:
+        return False
+
+def validate_ip(ip, version=None):
+    """Walidacja adresu IPv4/IPv6 (version=4 lub 6 - tylko adres tej rodziny)"""
+    if not isinstance(ip, str):
+        return False
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return version is None or address.version == version
+
+
+# Rodzina gniazd dla wersji IP (None - dowolna, jak zwykłe zapytania)
+FAMILIES = {4: socket.AF_INET, 6: socket.AF_INET6}
+
+
+def provider_health(version=None):
+    """Stan dostawców dla zapytań danej wersji IP - brak IPv6 nie otwiera bezpieczników IPv4"""
+    return PROVIDER_HEALTH_V6 if version == 6 else PROVIDER_HEALTH
+
+
+def order_ip_services(dns_error_mode=False, version=4):
+    """Serwisy IP (ip_services lub ip6_services) w kolejności oczekiwanego opóźnienia.
+
+    Przy awarii DNS najpierw idą serwisy adresowane literałem IP.
+    """
+    services = CONFIG['ip6_services'] if version == 6 else CONFIG['ip_services']
+    services = provider_health(version).order(services, url_of=lambda service: service[0])
+    services = PROVIDER_BUDGET.order(services, url_of=lambda service: service[0])
+    if dns_error_mode:
+        services = sorted(services, key=lambda service: needs_dns(service[0]))
+    return services
+
+
+def order_info_services():
+    """info_services wg stanu dostawców, a potem dostępnego limitu (wyczerpane kwoty na końcu)"""
+    return PROVIDER_BUDGET.order(PROVIDER_HEALTH.order(CONFIG['info_services']))
+
+
+def hedge_stagger():
+    """Zwraca opóźnienie między uruchomieniami serwisów dla bieżącego trybu hedgingu"""
+    mode = CONFIG['hedge_mode']
+    if mode == 'race':
+        return 0.0
+    if mode == 'stagger':
+        return CONFIG['hedge_delay']
+    return float('inf')  # 'sequential' - kolejny serwis dopiero po błędzie poprzedniego
+
+
+class CheckCancelledError(Exception):
+    """Sprawdzenie przerwane przez użytkownika (cancel_event)"""
+
+
+class NoConnectivityError(ConnectionError):
+    """Brak połączenia z internetem - check_public_ip nie wysyła zapytań"""
+
+
+class IPDetectionError(Exception):
+    """Nie udało się ustalić publicznego adresu IP (przyczyna w __cause__)"""
+
+    def __init__(self, message, dns_error_mode=False):
+        super().__init__(message)
+        self.dns_error_mode = dns_error_mode  # Sprawdzenie w trybie awaryjnym DNS
+
+
+CANCEL_POLL_INTERVAL = 0.1  # Jak często (s) race_first sprawdza cancel_event
+
+
+def race_first(tasks, deadline, stagger=0.0, cancel_event=None):
+    """Uruchamia zadania równolegle i zwraca pierwszy poprawny wynik.
+
+    tasks to lista par (nazwa, funkcja(stop_event)). Funkcja zwraca wynik albo
+    rzuca wyjątek, gdy odpowiedź jest nieprawidłowa. Kolejne zadanie startuje po
+    `stagger` sekundach lub od razu po błędzie poprzedniego. Po wyłonieniu
+    zwycięzcy ustawiany jest stop_event, a niewystartowane zadania są anulowane.
+    Zwraca (nazwa, wynik); gdy żadne zadanie nie powiedzie się przed `deadline`
+    (time.monotonic), rzuca ostatni błąd lub TimeoutError. Ustawienie
+    `cancel_event` przerywa wyścig (CheckCancelledError) - trwające zapytania
+    dostają stop_event i nie są ponawiane.
+    """
+    queue = list(tasks)
+    if not queue:
+        raise ValueError("Brak serwisów do sprawdzenia")
+
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(queue))
+    names = {}
+    pending = set()
+    last_error = None
+    next_launch = time.monotonic()
+    try:
+        while queue or pending:
+            if cancel_event is not None and cancel_event.is_set():
+                raise CheckCancelledError("Sprawdzanie anulowane")
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            if queue and now >= next_launch:
+                name, func = queue.pop(0)
+                future = executor.submit(func, stop_event)
+                names[future] = name
+                pending.add(future)
+                next_launch = now + stagger
+                if stagger <= 0:
+                    continue  # Tryb 'race' - uruchom od razu wszystkie
+
+            wait_time = deadline - now
+            if queue:
+                wait_time = min(wait_time, max(0.0, next_launch - now))
+            if not pending:
+                continue
+            if cancel_event is not None:
+                wait_time = min(wait_time, CANCEL_POLL_INTERVAL)
+
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return names[future], future.result()
+                except Exception as e:
+                    print(f"Błąd serwisu {names[future]}: {e}")
+                    last_error = e
+            if done and queue:
+                next_launch = time.monotonic()  # Błąd - od razu uruchom kolejny serwis
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if last_error is not None and not pending:
+        raise last_error
+    raise TimeoutError("Przekroczono budżet czasu sprawdzenia")
+
+
+# Jeden cache dla całego procesu - nowy IPCheckerThread powstaje przy każdym sprawdzeniu
+LOOKUP_CACHE = LookupCache(
+    CONFIG['cache_file'],
+    ttl=CONFIG['cache_timeout'],
+    max_entries=CONFIG['cache_max_entries'],
+)
+
+# Czasy faz sprawdzenia i liczniki zdarzeń (panel diagnostyki, eksport)
+METRICS = Metrics()
+
+# Opóźnienia, błędy i bezpieczniki dostawców (zapisywane między uruchomieniami)
+PROVIDER_HEALTH = ProviderHealth(CONFIG['provider_health_file'])
+PROVIDER_HEALTH_V6 = ProviderHealth(CONFIG['provider_health_v6_file'])
+
+# Limity zapytań i dzienne kwoty dostawców (wspólne dla IPv4 i IPv6 - liczy je host)
+PROVIDER_BUDGET = ProviderBudget(
+    CONFIG['provider_limits'],
+    CONFIG['provider_budget_file'],
+    default_backoff=CONFIG['rate_limit_backoff'],
+)
+
+def provider_hosts():
+    """Nazwy hostów dostawców wymagające DNS (serwisy adresowane po IP są pomijane)"""
+    urls = [service for service, _ in CONFIG['ip_services'] + CONFIG['ip6_services']] + CONFIG['info_services']
+    return sorted({urlparse(url).hostname for url in urls if needs_dns(url)})
+
+# Adresy hostów dostawców rozwiązywane raz na dns_cache_ttl (dla requests i silnika async).
+# install() podmienia socket.getaddrinfo w całym procesie, więc wywołują go
+# programy (main), a nie import modułu.
+DNS_CACHE = DNSCache(CONFIG['dns_cache_ttl'], provider_hosts())
+
+# Sondy DNS rozwiązują hosty dostawców, więc przy okazji rozgrzewają DNS_CACHE
+CONNECTIVITY = ConnectivityProbe(
+    DNS_CACHE,
+    dns_hosts=provider_hosts(),
+    ttl=CONFIG['connectivity_ttl'],
+    failure_ttl=CONFIG['connectivity_failure_ttl'],
+)
+
+# Sesje keep-alive per host dostawcy, wspólne dla wszystkich sprawdzeń
+HTTP_POOL = SessionPool(
+    pool_connections=CONFIG['http_pool_connections'],
+    pool_maxsize=CONFIG['http_pool_maxsize'],
+)
+
+_offline_db = None
+_offline_db_lock = threading.Lock()
+
+
+def get_offline_db():
+    """Zwraca otwartą offline bazę GeoIP (lub None, gdy nie skonfigurowano/nie istnieje)"""
+    global _offline_db
+    path = CONFIG['geoip_db']
+    if not path:
+        return None
+    with _offline_db_lock:
+        if _offline_db is None and os.path.exists(path):
+            try:
+                _offline_db = GeoIPDatabase(path)
+            except Exception as e:
+                print(f"Błąd otwierania bazy GeoIP {path}: {e}")
+                CONFIG['geoip_db'] = None  # Nie próbuj ponownie przy każdym wyszukiwaniu
+        return _offline_db
+
+
+class ProviderUnavailableError(Exception):
+    """Dostawca pominięty, bo jego bezpiecznik jest otwarty"""
+
+
+class ProviderRateLimitedError(ProviderUnavailableError):
+    """Dostawca pominięty, bo wyczerpał kwotę albo na token trzeba czekać zbyt długo"""
+
+
+def _retry_after(response):
+    """Wartość nagłówka Retry-After w sekundach (liczba sekund lub data HTTP)"""
+    if response is None:
+        return None
+    value = response.headers.get("retry-after", "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def reserve_request(url, deadline=None, version=None):
+    """Rezerwuje zapytanie w PROVIDER_BUDGET; zwraca czas (s), jaki trzeba odczekać przed jego wysłaniem.
+
+    Rzuca ProviderRateLimitedError, gdy kwota dostawcy jest wyczerpana albo
+    token będzie dostępny później niż za rate_limit_max_wait (lub po `deadline`)
+    - wtedy wyścig przechodzi do kolejnego dostawcy.
+    """
+    family = family_label(version)
+    wait = PROVIDER_BUDGET.reserve(url)
+    if wait is None:
+        METRICS.incr("rate_limit_skips", provider=provider_key(url), family=family, reason="quota")
+        raise ProviderRateLimitedError(f"Dostawca {provider_key(url)} wyczerpał dzienną kwotę zapytań")
+    too_late = deadline is not None and time.monotonic() + wait >= deadline
+    if wait > CONFIG['rate_limit_max_wait'] or too_late:
+        PROVIDER_BUDGET.release(url)
+        METRICS.incr("rate_limit_skips", provider=provider_key(url), family=family, reason="rate")
+        raise ProviderRateLimitedError(f"Limit zapytań dostawcy {provider_key(url)} (token za {wait:.1f} s)")
+    if wait > 0:
+        METRICS.incr("rate_limit_waits", provider=provider_key(url), family=family)
+    return wait
+
+
+def family_label(version=None):
+    """Etykieta metryk dla wersji IP zapytania"""
+    return f"ipv{version}" if version in FAMILIES else "any"
+
+
+def fetch_url(url, timeout=CONFIG['timeout'], deadline=None, stop_event=None, on_attempt=None, version=None):
+    """Waliduje URL i wykonuje zapytanie
+
+    timeout=None oznacza, że limitem pojedynczej próby jest pozostały budżet
+    `deadline`. Ustawienie `stop_event` przerywa kolejne próby. `on_attempt`
+    jest wywoływane z numerem próby (np. do raportowania postępu). `version`
+    (4 lub 6) wymusza połączenie przez daną rodzinę adresów. Wyniki prób
+    trafiają do provider_health(version), a każda próba rezerwuje zapytanie
+    w limitach dostawcy (reserve_request).
+    """
+    if not validate_url(url):
+        raise ValueError(f"Nieprawidłowy URL: {url}")
+
+    health = provider_health(version)
+    family = family_label(version)
+    for attempt in range(CONFIG['max_retries']):
+        if stop_event is not None and stop_event.is_set():
+            raise TimeoutError(f"Anulowano zapytanie do {url}")
+        if not health.allow(url):
+            METRICS.incr("circuit_open_skips", provider=provider_key(url), family=family)
+            raise ProviderUnavailableError(f"Dostawca {provider_key(url)} chwilowo wyłączony (bezpiecznik)")
+
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Przekroczono budżet czasu dla {url}")
+            attempt_timeout = remaining if timeout is None else min(timeout, remaining)
+
+        wait_for_token = reserve_request(url, deadline, version)
+        if wait_for_token > 0:
+            if stop_event is not None:
+                if stop_event.wait(wait_for_token):
+                    PROVIDER_BUDGET.release(url)
+                    raise TimeoutError(f"Anulowano zapytanie do {url}")
+            else:
+                time.sleep(wait_for_token)
+            if attempt_timeout is not None and deadline is not None:
+                attempt_timeout = min(attempt_timeout, max(0.001, deadline - time.monotonic()))
+
+        started = time.monotonic()
+        try:
+            if on_attempt is not None:
+                on_attempt(attempt)
+
+            with METRICS.span("provider_attempt", provider=provider_key(url), family=family) as span:
+                response = HTTP_POOL.get(
+                    url,
+                    family=FAMILIES.get(version),
+                    timeout=attempt_timeout,
+                    proxies=CONFIG['proxy']
+                )
+                response.raise_for_status()
+                span["outcome"] = "ok"
+            health.record_success(url, time.monotonic() - started)
+            return response
+        except requests.exceptions.RequestException as e:
+            failed_response = getattr(e, "response", None)
+            rate_limited = failed_response is not None and failed_response.status_code == 429
+            METRICS.incr("provider_failures", provider=provider_key(url), family=family,
+                         kind="dns" if is_dns_error(e) else "rate_limited" if rate_limited else "error")
+            retry_after = _retry_after(failed_response) if rate_limited else None
+            health.record_failure(url, rate_limited=rate_limited, retry_after=retry_after)
+            if rate_limited:
+                PROVIDER_BUDGET.record_rate_limited(url, retry_after)
+            # Zapamiętany adres mógł się zdezaktualizować - następna próba rozwiąże nazwę od nowa
+            DNS_CACHE.invalidate(urlparse(url).hostname)
+            # Jeśli to błąd DNS, nie ma sensu ponawiać prób dla tego samego hosta
+            if is_dns_error(e):
+                print(f"Błąd DNS dla {url}: {e}. Przerywam retries dla tego serwisu.")
+                raise
+            if rate_limited:
+                print(f"Limit zapytań (429) dla {url}. Przerywam retries dla tego serwisu.")
+                raise
+
+            if attempt == CONFIG['max_retries'] - 1:
+                raise
+            delay = backoff_delay(attempt)
+            METRICS.incr("retries", provider=provider_key(url), family=family)
+            print(f"Próba {attempt + 1} nie powiodła się: {e} (ponowienie za {delay:.2f} s)")
+            # Opóźnienie przed kolejną próbą (przerywane anulowaniem)
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+            continue
+
+
+def parse_ip_response(response, response_type):
+    """Wyciąga adres IP z odpowiedzi serwisu w danym formacie"""
+    if response_type == "json":
+        return response.json().get("ip")
+    if response_type == "cloudflare_trace":
+        # Parsowanie formatu key=value
+        for line in response.text.splitlines():
+            if line.startswith("ip="):
+                return line.split("=")[1].strip()
+        return None
+    return response.text.strip()
+
+
+def fetch_ip(service, response_type, deadline, timeout=None, stop_event=None, on_attempt=None, version=4):
+    """Pobiera i waliduje własny adres IP danej wersji z jednego serwisu"""
+    response = fetch_url(service, timeout, deadline, stop_event, on_attempt, version=version)
+    ip = parse_ip_response(response, response_type)
+    if not ip or not validate_ip(ip, version):
+        raise ValueError(f"Nieprawidłowa odpowiedź IPv{version} z {service}: {ip!r}")
+    return ip
+
+
+def detect_public_ips(dns_error_mode=False, deadline=None, timeout=None, on_attempt=None, cancel_event=None):
+    """Wykrywa naraz publiczny adres IPv4 i IPv6; zwraca {4: ip, 6: ip} (tylko znalezione).
+
+    Każda rodzina ma własny wyścig serwisów (race_first) na połączeniach
+    związanych z tą rodziną, więc całość trwa tyle, co dłuższy z wyścigów.
+    Ścieżka IPv6 ma krótszy budżet (ip6_timeout), żeby sieć bez IPv6 nie
+    wydłużała sprawdzenia. Gdy nie znaleziono żadnego adresu, rzuca błąd IPv4.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + CONFIG['check_deadline']
+    stagger = hedge_stagger()
+
+    def race(version):
+        family_deadline = deadline if version == 4 else min(deadline, time.monotonic() + CONFIG['ip6_timeout'])
+        tasks = [
+            (service, lambda stop, s=service, t=response_type: fetch_ip(
+                s, t, family_deadline, timeout, stop, on_attempt, version))
+            for service, response_type in order_ip_services(dns_error_mode, version)
+        ]
+        with METRICS.span("ip_fetch", family=family_label(version)) as span:
+            service, ip = race_first(tasks, family_deadline, stagger, cancel_event)
+            span["provider"] = provider_key(service)
+        print(f"Pobrano i zwalidowano IPv{version}: {ip} ({service})")
+        return ip
+
+    versions = [4, 6] if CONFIG['dual_stack'] else [4]
+    addresses = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(versions), thread_name_prefix="ip-family") as executor:
+        futures = {version: executor.submit(race, version) for version in versions}
+        for version, future in futures.items():
+            try:
+                addresses[version] = future.result()
+            except Exception as e:
+                print(f"Błąd pobierania IPv{version}: {e}")
+                errors[version] = e
+    if cancel_event is not None and cancel_event.is_set():
+        raise CheckCancelledError("Sprawdzanie anulowane")
+    if not addresses:
+        raise errors[4]
+    return addresses
+
+
+def primary_ip(addresses):
+    """Adres główny sprawdzenia: IPv4, a w sieci tylko z IPv6 - IPv6"""
+    return addresses.get(4) or addresses[6]
+
+
+def normalize_ip_data(data, ip):
+    """Normalizuje dane z różnych serwisów IP"""
+    normalized = {"ip": ip}
+    field_mappings = {
+        "country": ["country", "country_name", "countryCode"],
+        "region": ["region", "region_name", "regionName"],
+        "city": ["city", "city_name"],
+        "postal": ["postal", "zip"],
+        "timezone": ["timezone", "time_zone"],
+        "org": ["org", "isp", "as"],
+        "loc": ["loc"],
+        "lat": ["lat", "latitude"],
+        "lon": ["lon", "longitude"],
+    }
+
+    for std_f, pos_f in field_mappings.items():
+        for f in pos_f:
+            if f in data and data[f]:
+                normalized[std_f] = data[f]
+                break
+
+    if "loc" not in normalized and "lat" in normalized and "lon" in normalized:
+        normalized["loc"] = f"{normalized['lat']},{normalized['lon']}"
+
+    return normalized
+
+
+def fetch_info(service, ip, deadline, timeout=None, stop_event=None, on_attempt=None):
+    """Pobiera i normalizuje dane lokalizacyjne z jednego serwisu"""
+    service_url = service.format(ip=ip)
+    response = fetch_url(service_url, timeout, deadline, stop_event, on_attempt)
+    with METRICS.span("normalization"):
+        normalized_data = normalize_ip_data(response.json(), ip)
+    if "loc" not in normalized_data:  # Kluczowe jest 'loc'
+        raise ValueError(f"Brak lokalizacji w odpowiedzi z {service}")
+    return normalized_data
+
+
+def lookup_ip_info(ip, deadline=None, timeout=None, on_attempt=None, cache=LOOKUP_CACHE, cancel_event=None):
+    """Zwraca znormalizowane dane lokalizacyjne dla IP.
+
+    Kolejność źródeł: offline baza GeoIP, cache, info_services. Serwisy są
+    odpytywane zgodnie z trybem hedgingu z CONFIG. Rzuca wyjątek, gdy żaden
+    serwis nie zwrócił lokalizacji przed `deadline`.
+    """
+    offline_db = get_offline_db()
+    if offline_db is not None:
+        data = offline_db.lookup(ip)
+        if data is not None and "loc" in data:
+            METRICS.incr("info_lookups", source="offline_db")
+            return data
+
+    info_cache_key = f"info_{ip}"
+    data = cache.get(info_cache_key)
+    if data is not None:
+        METRICS.incr("info_lookups", source="cache")
+        return data
+    METRICS.incr("info_lookups", source="network")
+
+    if deadline is None:
+        deadline = time.monotonic() + CONFIG['check_deadline']
+    info_tasks = [
+        (service, lambda stop, s=service: fetch_info(
+            s, ip, deadline, timeout, stop, on_attempt))
+        for service in order_info_services()
+    ]
+    with METRICS.span("info_fetch") as span:
+        service, normalized_data = race_first(info_tasks, deadline, hedge_stagger(), cancel_event)
+        span["provider"] = provider_key(service)
+    cache.put(info_cache_key, normalized_data)
+    print(f"Pobrano dane lokalizacyjne dla {ip} ({service})")
+    return normalized_data
+
+
+def lookup_addresses(addresses, deadline=None, timeout=None, on_attempt=None, cache=LOOKUP_CACHE, cancel_event=None):
+    """lookup_ip_info dla adresów z detect_public_ips naraz; zwraca {ip: dane lub wyjątek}"""
+    ips = list(dict.fromkeys(addresses.values()))
+    with ThreadPoolExecutor(max_workers=len(ips), thread_name_prefix="ip-info") as executor:
+        futures = {ip: executor.submit(lookup_ip_info, ip, deadline, timeout, on_attempt, cache, cancel_event)
+                   for ip in ips}
+    results = {}
+    for ip, future in futures.items():
+        try:
+            results[ip] = future.result()
+        except Exception as e:
+            print(f"Błąd pobrania info dla {ip}: {e}")
+            results[ip] = e
+    return results
+
+
+def dual_stack_result(addresses, infos, error_loc="Nie udało się pobrać danych lokalizacyjnych."):
+    """Wynik sprawdzenia: dane adresu głównego (primary_ip) z polem "addresses".
+
+    `infos` mapuje IP na dane lokalizacyjne (wyjątek lub brak - wpis z
+    `error_loc`). "addresses" to {"IPv4": dane, "IPv6": dane} dla znalezionych
+    adresów - kopie, więc wpisy cache pozostają niezmienione.
+    """
+    per_family = {}
+    for version, ip in sorted(addresses.items()):
+        info = infos.get(ip)
+        if isinstance(info, dict):
+            data = dict(info)
+        else:
+            data = normalize_ip_data({}, ip)
+            data["error_loc"] = error_loc
+        per_family[f"IPv{version}"] = data
+    result = dict(per_family[f"IPv{4 if 4 in addresses else 6}"])
+    result["addresses"] = per_family
+    return result
+
+
+# Pola porównywane między kolejnymi wynikami (result_changes)
+RESULT_DIFF_FIELDS = ["ip", "country", "region", "city", "postal", "timezone", "org"]
+
+
+def result_changes(old, new):
+    """Różnice między dwoma wynikami sprawdzenia: [(pole, stara wartość, nowa wartość)].
+
+    Poza polami RESULT_DIFF_FIELDS porównywane są adresy z "addresses"
+    (pole "IPv4"/"IPv6"), o ile oba wyniki pochodzą z wykrywania dual-stack -
+    wpis historii ich nie ma, więc nie jest traktowany jak utrata IPv6.
+    Gdy któryś wynik nie ma lokalizacji (error_loc), porównywany jest tylko adres.
+    """
+    fields = ["ip"] if old.get("error_loc") or new.get("error_loc") else RESULT_DIFF_FIELDS
+    changes = [(field, old.get(field), new.get(field)) for field in fields if old.get(field) != new.get(field)]
+    if "addresses" in old and "addresses" in new:
+        for family in sorted(old["addresses"].keys() | new["addresses"].keys()):
+            before = old["addresses"].get(family, {}).get("ip")
+            after = new["addresses"].get(family, {}).get("ip")
+            if before != after:
+                changes.append((family, before, after))
+    return changes
+
+
+def offline_infos(addresses):
+    """Lokalizacja adresów z offline bazy GeoIP (tryb awaryjny DNS); {ip: dane} tylko dla znalezionych"""
+    offline_db = get_offline_db()
+    infos = {}
+    for ip in addresses.values():
+        data = offline_db.lookup(ip) if offline_db is not None else None
+        if data is not None and "loc" in data:
+            infos[ip] = data
+    return infos
+
+
+def begin_check():
+    """Pierwszy krok sprawdzenia (obu silników): stan łączności; zwraca dns_error_mode.
+
+    Rzuca NoConnectivityError przy braku sieci.
+    """
+    with METRICS.span("connectivity"):
+        status = CONNECTIVITY.status()
+    if status is False:
+        raise NoConnectivityError("Brak połączenia z internetem")
+    dns_error_mode = status == DNS_ERROR
+    if dns_error_mode:
+        print("⚠️ Tryb awaryjny DNS: Priorytetyzacja serwisów IP.")
+    return dns_error_mode
+
+
+def detection_failed(error, dns_error_mode):
+    """IPDetectionError dla błędu wykrywania adresu (do `raise ... from error`)"""
+    print(f"Błąd pobierania IP: {error}")
+    # Zapamiętany stan łączności mógł być nieaktualny
+    CONNECTIVITY.invalidate("nieudane sprawdzenie")
+    return IPDetectionError(str(error) or type(error).__name__, dns_error_mode)
+
+
+def dns_error_result(addresses):
+    """Wynik sprawdzenia przy awarii DNS - lokalizacja z serwisów wymaga DNS, zostaje offline baza GeoIP"""
+    infos = offline_infos(addresses)
+    if primary_ip(addresses) not in infos:
+        print("Pominięto pobieranie lokalizacji z powodu awarii DNS.")
+    return dual_stack_result(addresses, infos, "Niedostępne (Awaria DNS)")
+
+
+def check_error_message(error):
+    """Komunikat dla użytkownika o nieudanym sprawdzeniu (NoConnectivityError, IPDetectionError)"""
+    if isinstance(error, NoConnectivityError):
+        return "Brak połączenia z internetem. Sprawdź kabel/WiFi."
+    message = "Nie udało się pobrać adresu IP."
+    cause = error.__cause__
+    # TimeoutError dziedziczy po OSError, a wyjątki requests po IOError - limit czasu sprawdzany najpierw
+    if isinstance(cause, (TimeoutError, requests.exceptions.Timeout)):
+        return message + " (Przekroczono limit czasu)"
+    if isinstance(cause, OSError) or getattr(error, "dns_error_mode", False):
+        return message + " (Problem z połączeniem/DNS)"
+    return message
+
+
+def check_public_ip(deadline=None, timeout=None, on_attempt=None, cache=LOOKUP_CACHE, cancel_event=None):
+    """Pełne sprawdzenie: łączność, adresy IPv4/IPv6 i ich lokalizacja (dual_stack_result).
+
+    Rzuca NoConnectivityError przy braku sieci, IPDetectionError, gdy nie
+    udało się ustalić adresu, i CheckCancelledError po ustawieniu cancel_event.
+    Silnik asynchroniczny (AsyncIPChecker) przechodzi te same kroki.
+    """
+    dns_error_mode = begin_check()
+    if deadline is None:
+        deadline = time.monotonic() + CONFIG['check_deadline']
+    # Własny adres IP pobieramy zawsze - celem sprawdzenia jest wykrycie jego zmiany
+    try:
+        addresses = detect_public_ips(dns_error_mode, deadline, timeout, on_attempt, cancel_event)
+    except CheckCancelledError:
+        raise
+    except Exception as e:
+        raise detection_failed(e, dns_error_mode) from e
+    if dns_error_mode:
+        return dns_error_result(addresses)
+    infos = lookup_addresses(addresses, deadline, timeout, on_attempt, cache, cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        raise CheckCancelledError("Sprawdzanie anulowane")
+    return dual_stack_result(addresses, infos)
@@ -0,0 +1,246 @@
+"""Monitorowanie zmian publicznego adresu IP.
+
+Monitor nasłuchuje zdarzeń zmian adresów/tras z jądra Linuksa (netlink),
+a gdy nie są dostępne - odpytuje z adaptacyjnym interwałem (wydłużanym,
+dopóki adres się nie zmienia). Publiczny IP jest sprawdzany tanim zapytaniem
+cloudflare_trace, a info_services są odpytywane tylko po wykryciu zmiany.
+
+Zdarzenia zmiany trafiają do callbacków (np. GUI), pliku logu (JSONL)
+i opcjonalnej komendy-hooka:
+    python ip_monitor.py --log ip_changes.jsonl --hook "notify-send 'Nowy IP' \"$IP_NEW\""
+"""
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from ip_lookup import (
+    CONFIG, CONNECTIVITY, DNS_CACHE, LOOKUP_CACHE, CheckCancelledError, fetch_url, lookup_ip_info, parse_ip_response,
+    validate_ip,
+)
+
+# Grupy multicast rtnetlink (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+HOOK_TIMEOUT = 30  # Po tylu sekundach komenda hook jest zabijana
+
+
+class NetlinkWatcher:
+    """Zdarzenia zmian adresów i tras z rtnetlink (tylko Linux)"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE
+                        | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+        self.sock.setblocking(False)
+
+    @classmethod
+    def create(cls):
+        """Zwraca watcher albo None, gdy netlink nie jest dostępny"""
+        if not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            return cls()
+        except OSError as e:
+            print(f"Netlink niedostępny ({e}), używam odpytywania.")
+            return None
+
+    def wait(self, timeout):
+        """Czeka na zdarzenie; zwraca True, gdy jakieś nadeszło (kolejka jest opróżniana)"""
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while self.sock.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+def resolve_public_ip(timeout=3, stop_event=None):
+    """Tanie sprawdzenie publicznego IP (cloudflare_trace, potem pozostałe serwisy)"""
+    services = sorted(CONFIG['ip_services'], key=lambda service: service[1] != "cloudflare_trace")
+    for service, response_type in services:
+        if stop_event is not None and stop_event.is_set():
+            return None
+        try:
+            deadline = time.monotonic() + timeout
+            ip = parse_ip_response(fetch_url(service, timeout, deadline, stop_event), response_type)
+            if ip and validate_ip(ip):
+                return ip
+        except Exception as e:
+            print(f"Monitor: błąd {service}: {e}")
+    return None
+
+
+class IPMonitor:
+    """Pętla monitorująca; run() działa do wywołania stop()"""
+
+    def __init__(self, min_interval=30, max_interval=900, debounce=2.0,
+                 log_path=None, hook=None, use_netlink=True):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.debounce = debounce
+        self.log_path = log_path
+        self.hook = hook
+        self.use_netlink = use_netlink
+        self.callbacks = []
+        self.current_ip = None
+        self._stop = threading.Event()
+
+    def add_callback(self, callback):
+        """callback(event) dostaje słownik: old_ip, new_ip, data, timestamp, reason"""
+        self.callbacks.append(callback)
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self, reason):
+        """Sprawdza IP; zwraca True, gdy się zmienił. stop() przerywa sprawdzenie bez zdarzenia."""
+        ip = resolve_public_ip(stop_event=self._stop)
+        if ip is None or ip == self.current_ip or self._stop.is_set():
+            return False
+        old_ip, self.current_ip = self.current_ip, ip
+        try:
+            data = lookup_ip_info(ip, cancel_event=self._stop)
+        except CheckCancelledError:
+            return False
+        except Exception as e:
+            print(f"Monitor: brak danych lokalizacyjnych dla {ip}: {e}")
+            data = {"ip": ip, "error_loc": "Nie udało się pobrać danych lokalizacyjnych."}
+        self._emit({
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "old_ip": old_ip,
+            "new_ip": ip,
+            "reason": reason,
+            "data": data,
+        })
+        return True
+
+    def _emit(self, event):
+        print(f"Monitor: zmiana IP {event['old_ip']} -> {event['new_ip']} ({event['reason']})")
+        for callback in self.callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Monitor: błąd callbacku: {e}")
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Monitor: błąd zapisu logu: {e}")
+        if self.hook:
+            env = dict(os.environ, IP_OLD=event["old_ip"] or "", IP_NEW=event["new_ip"])
+            try:
+                self._run_hook(env, json.dumps(event, ensure_ascii=False).encode("utf-8"))
+            except Exception as e:
+                print(f"Monitor: błąd komendy hook: {e}")
+
+    def _run_hook(self, env, payload):
+        """Uruchamia hook i czeka na niego najwyżej HOOK_TIMEOUT s (po stop() - już nie czeka)"""
+        # Własna grupa procesów - przy przekroczeniu czasu zabijamy też procesy uruchomione przez powłokę
+        process = subprocess.Popen(self.hook, shell=True, env=env, stdin=subprocess.PIPE,
+                                   start_new_session=hasattr(os, "killpg"))
+        deadline = time.monotonic() + HOOK_TIMEOUT
+        while True:
+            try:
+                process.communicate(payload, timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+                return
+            except subprocess.TimeoutExpired:
+                payload = None  # Kolejne communicate kontynuuje rozpoczęte przekazywanie wejścia
+                if time.monotonic() >= deadline:
+                    print(f"Monitor: komenda hook przekroczyła {HOOK_TIMEOUT} s - przerywam")
+                    if hasattr(os, "killpg"):
+                        os.killpg(process.pid, signal.SIGKILL)
+                    else:
+                        process.kill()
+                    process.communicate()  # Zbiera zakończony proces (bez procesu zombie)
+                    return
+                if self._stop.is_set():
+                    print("Monitor: zatrzymany - komenda hook kończy się bez nadzoru")
+                    return
+
+    def run(self):
+        watcher = NetlinkWatcher.create() if self.use_netlink else None
+        interval = self.min_interval
+        try:
+            self.check("start")
+            last_check = time.monotonic()
+            while not self._stop.is_set():
+                next_poll = last_check + interval
+                reason = "poll"
+                # Czekanie w krótkich odcinkach, żeby stop() działał szybko
+                while not self._stop.is_set() and time.monotonic() < next_poll:
+                    step = min(1.0, next_poll - time.monotonic())
+                    if watcher is not None and watcher.wait(step):
+                        # Zmiany sieci przychodzą seriami - odczekaj, aż się ustabilizuje
+                        # (najwyżej min_interval, żeby ciągłe zmiany nie wstrzymały sprawdzeń)
+                        settle_until = time.monotonic() + self.min_interval
+                        while (not self._stop.is_set() and time.monotonic() < settle_until
+                               and watcher.wait(self.debounce)):
+                            pass
+                        reason = "netlink"
+                        # Nowa sieć - stan łączności i adresy z DNS trzeba ustalić od nowa
+                        CONNECTIVITY.invalidate("zmiana sieci")
+                        # Sprawdzenie po zmianie sieci nie częściej niż co min_interval - hosty
+                        # z ciągłymi zmianami tras (mosty dockera, RA IPv6, roaming Wi-Fi)
+                        # odpytywałyby dostawców co kilka sekund
+                        next_poll = min(next_poll, last_check + self.min_interval)
+                        continue
+                    if watcher is None:
+                        self._stop.wait(step)
+                if self._stop.is_set():
+                    break
+
+                changed = self.check(reason)
+                last_check = time.monotonic()
+                if changed:
+                    interval = self.min_interval
+                elif reason == "poll":
+                    # Adres stabilny - sprawdzaj coraz rzadziej
+                    interval = min(interval * 2, self.max_interval)
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitorowanie zmian publicznego adresu IP")
+    parser.add_argument("--log", default=CONFIG['monitor_log'], help="Plik JSONL ze zdarzeniami zmian")
+    parser.add_argument("--hook", default=CONFIG['monitor_hook'],
+                        help="Komenda uruchamiana przy zmianie (zmienne IP_OLD, IP_NEW, JSON na stdin)")
+    parser.add_argument("--min-interval", type=float, default=CONFIG['monitor_min_interval'])
+    parser.add_argument("--max-interval", type=float, default=CONFIG['monitor_max_interval'])
+    parser.add_argument("--no-netlink", action="store_true", help="Tylko odpytywanie")
+    args = parser.parse_args(argv)
+    DNS_CACHE.install()
+
+    monitor = IPMonitor(args.min_interval, args.max_interval, log_path=args.log,
+                        hook=args.hook, use_netlink=not args.no_netlink)
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
+    finally:
+        LOOKUP_CACHE.save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""Tryb serwera: lokalne API z bieżącym adresem IP i geolokalizacją (bez GUI).
+
+Wiele hostów i skryptów może pytać o ten sam wynik bez mnożenia zapytań do
+dostawców:
+    - równoczesne zapytania o ten sam klucz czekają na jedno wyszukiwanie
+      (singleflight),
+    - odpowiedzi idą z cache; po upływie `fresh_ttl` zwracany jest zapamiętany
+      wynik, a odświeżenie działa w tle (stale-while-revalidate),
+    - błąd odświeżenia nie usuwa zapamiętanego wyniku do czasu `stale_ttl`,
+      a sam błąd jest pamiętany przez `error_ttl` (ochrona dostawców).
+
+Trasy (GET, odpowiedzi JSON z rekordem jak z normalize_ip_data):
+    /ip             bieżący adres (IPv4 i IPv6 w polu "addresses")
+    /lookup/<ip>    geolokalizacja dowolnego adresu
+    /health         stan cache i liczniki serwera
+    /metrics        metryki w formacie Prometheusa
+
+    python ip_server.py --port 8780
+    python ip_server.py --unix /run/ipchecker.sock
+    curl -s http://127.0.0.1:8780/ip
+    curl -s --unix-socket /run/ipchecker.sock http://localhost/lookup/8.8.8.8
+"""
+import argparse
+import ipaddress
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ip_lookup import (
+    CONFIG, DNS_CACHE, HTTP_POOL, LOOKUP_CACHE, METRICS, PROVIDER_BUDGET, PROVIDER_HEALTH, PROVIDER_HEALTH_V6,
+    check_public_ip, lookup_ip_info, validate_ip,
+)
+
+
+class CoalescingCache:
+    """Cache wyników z łączeniem równoczesnych wyszukiwań i odświeżaniem w tle.
+
+    get(key, loader) zwraca (wynik, stan), gdzie stan to "fresh", "stale",
+    "miss" (wynik nowego wyszukiwania) albo "coalesced" (wynik wyszukiwania
+    rozpoczętego przez inne zapytanie). Wynik to gotowa do wysłania treść
+    (bytes) - serializacja odbywa się raz na wyszukiwanie, nie na zapytanie.
+    """
+
+    def __init__(self, fresh_ttl=30, stale_ttl=600, error_ttl=5, workers=8, max_entries=10000):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self._entries = {}  # klucz -> (czas pobrania, treść, błąd, czas ostatniego błędu)
+        self._flights = {}  # klucz -> Future trwającego wyszukiwania
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lookup")
+        self.lookups = 0
+        self.coalesced = 0
+
+    def _start_flight(self, key, loader):
+        """Uruchamia wyszukiwanie w tle (wywoływane pod blokadą)"""
+        future = Future()
+        self._flights[key] = future
+        self.lookups += 1
+        self._executor.submit(self._run, key, loader, future)
+        return future
+
+    def _run(self, key, loader, future):
+        try:
+            body = loader()
+        except Exception as e:
+            print(f"Błąd wyszukiwania {key}: {e}")
+            with self._lock:
+                now = time.monotonic()
+                previous = self._entries.get(key)
+                # Zapamiętany wynik zostaje (stale-if-error); bez niego pamiętamy błąd
+                if previous is not None and previous[1] is not None:
+                    self._entries[key] = previous[:3] + (now,)
+                else:
+                    self._entries[key] = (now, None, e, now)
+                del self._flights[key]
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), body, None, None)
+            del self._flights[key]
+            if len(self._entries) > self.max_entries:
+                self._prune()
+        future.set_result(body)
+
+    def _prune(self):
+        """Usuwa przeterminowane wpisy, a gdy to nie wystarczy - najstarsze (pod blokadą)"""
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if now - entry[0] >= self.stale_ttl]:
+            del self._entries[key]
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            for key in sorted(self._entries, key=lambda key: self._entries[key][0])[:excess]:
+                del self._entries[key]
+
+    def get(self, key, loader, timeout=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            flight = self._flights.get(key)
+            if entry is not None:
+                fetched_at, body, error, failed_at = entry
+                now = time.monotonic()
+                age = now - fetched_at
+                if error is not None and age < self.error_ttl:
+                    raise error
+                if body is not None and age < self.fresh_ttl:
+                    return body, "fresh"
+                if body is not None and age < self.stale_ttl:
+                    # Po nieudanym odświeżeniu kolejne najwcześniej po error_ttl
+                    if flight is None and (failed_at is None or now - failed_at >= self.error_ttl):
+                        self._start_flight(key, loader)
+                    return body, "stale"
+            state = "coalesced"
+            if flight is None:
+                flight = self._start_flight(key, loader)
+                state = "miss"
+            else:
+                self.coalesced += 1
+        return flight.result(timeout), state
+
+    def age(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else time.monotonic() - entry[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._flights),
+                "lookups": self.lookups,
+                "coalesced": self.coalesced,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _json_body(record):
+    return json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Domyślna kolejka (5) przepełnia się, gdy wielu klientów łączy się naraz -
+    # odrzucony SYN jest ponawiany dopiero po ~1 s
+    request_queue_size = 128
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class IPLookupServer:
+    """Serwer API w wątku tła (TCP lub gniazdo Unix)"""
+
+    def __init__(self, host="127.0.0.1", port=0, unix_socket=None, cache=None):
+        self.cache = cache or CoalescingCache(
+            CONFIG['server_fresh_ttl'], CONFIG['server_stale_ttl'], CONFIG['server_error_ttl'],
+            CONFIG['server_workers'],
+        )
+        self.unix_socket = unix_socket
+        self.started = time.time()
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)  # Pozostałość po poprzednim uruchomieniu
+            self._server = _UnixHTTPServer(unix_socket, self._handler_class())
+        else:
+            self._server = _TCPHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.unix_socket or self._server.server_address[:2]
+
+    def url(self, path=""):
+        if self.unix_socket:
+            raise ValueError(f"Serwer nasłuchuje na gnieździe Unix {self.unix_socket} - brak adresu URL")
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ip-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.cache.close()
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def current_ip(self):
+        with METRICS.span("server_upstream", route="ip"):
+            return _json_body(check_public_ip())
+
+    def lookup(self, ip):
+        with METRICS.span("server_upstream", route="lookup"):
+            return _json_body(lookup_ip_info(ip))
+
+    def health(self):
+        return {
+            "uptime": time.time() - self.started,
+            "cache": self.cache.stats(),
+            "ip_age": self.cache.age("ip"),
+            "http_pool": HTTP_POOL.stats(),
+            "provider_budget": PROVIDER_BUDGET.stats(),
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive - klienci nie płacą za nowe połączenie
+            # Nagłówki i treść to osobne zapisy - bez TCP_NODELAY druga część czeka
+            # na opóźnione ACK klienta (~40 ms na odpowiedź przy keep-alive)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                path = self.path.split("?")[0].rstrip("/") or "/ip"
+                try:
+                    if path == "/ip":
+                        self._cached("ip", server.current_ip, route="ip")
+                    elif path.startswith("/lookup/"):
+                        ip = path[len("/lookup/"):]
+                        if not validate_ip(ip):
+                            self._send(400, _json_body({"error": f"Nieprawidłowy adres IP: {ip}"}))
+                            return
+                        # Jeden klucz dla różnych zapisów adresu ("2001:DB8::1", "2001:db8:0::1")
+                        ip = ipaddress.ip_address(ip).compressed
+                        self._cached(f"lookup:{ip}", lambda: server.lookup(ip), route="lookup")
+                    elif path == "/health":
+                        self._send(200, _json_body(server.health()))
+                    elif path == "/metrics":
+                        self._send(200, METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+                    else:
+                        self._send(404, _json_body({"error": "Nieznana ścieżka"}))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Klient rozłączył się przed odpowiedzią
+
+            def _cached(self, key, loader, route):
+                try:
+                    body, state = server.cache.get(key, loader, timeout=CONFIG['check_deadline'] + 5)
+                except ConnectionError as e:
+                    METRICS.incr("server_requests", route=route, cache="error")
+                    self._send(503, _json_body({"error": str(e)}))
+                    return
+                except Exception as e:
+                    METRICS.incr("server_requests", route=route, cache="error")
+                    self._send(502, _json_body({"error": str(e) or type(e).__name__}))
+                    return
+                METRICS.incr("server_requests", route=route, cache=state)
+                self._send(200, body, headers={"X-Cache": state})
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Bez logu każdego zapytania (tysiące na sekundę)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokalne API z bieżącym adresem IP i geolokalizacją")
+    parser.add_argument("--host", default=CONFIG['server_host'])
+    parser.add_argument("--port", type=int, default=CONFIG['server_port'])
+    parser.add_argument("--unix", default=CONFIG['server_socket'], help="Ścieżka gniazda Unix zamiast TCP")
+    parser.add_argument("--fresh-ttl", type=float, default=CONFIG['server_fresh_ttl'],
+                        help="Czas (s), przez który wynik jest zwracany bez odświeżania")
+    parser.add_argument("--stale-ttl", type=float, default=CONFIG['server_stale_ttl'],
+                        help="Maks. wiek (s) wyniku zwracanego podczas odświeżania w tle")
+    args = parser.parse_args(argv)
+    DNS_CACHE.install()
+
+    cache = CoalescingCache(args.fresh_ttl, args.stale_ttl, CONFIG['server_error_ttl'], CONFIG['server_workers'])
+    server = IPLookupServer(args.host, args.port, args.unix, cache)
+    print(f"Serwer IP nasłuchuje na {server.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        PROVIDER_HEALTH.save()
+        PROVIDER_HEALTH_V6.save()
+        PROVIDER_BUDGET.save()
+        LOOKUP_CACHE.save()
+        HTTP_POOL.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
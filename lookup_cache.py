@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class LookupCache:
+    """Współdzielony cache TTL + LRU z zapisem na dysk.
+
+    Jedna instancja obsługuje cały proces (wszystkie wątki sprawdzające),
+    dzięki czemu dane IP -> geolokalizacja przeżywają kolejne sprawdzenia,
+    a po zapisie na dysk również restart aplikacji. Przy autosave zapis po
+    put() odbywa się co najwyżej raz na `save_interval` s - resztę zmian
+    utrwala save() przy zamykaniu programu.
+    """
+
+    def __init__(self, path=None, ttl=3600, max_entries=1024, autosave=True, save_interval=10):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Przy masowych zapisach (tryb wsadowy) wyłączamy zapis po każdym put()
+        # i wołamy save() okresowo
+        self.autosave = autosave
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # klucz -> (czas zapisu, dane)
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # Zapis pliku poza self._lock - put() nie czeka na dysk
+        self._loaded = False
+        self._dirty = False
+        self._last_save = 0.0
+
+    def _ensure_loaded(self):
+        """Wczytuje cache z dysku przy pierwszym użyciu"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            now = time.time()
+            # Zapis jest w kolejności LRU (od najdawniej używanych)
+            for key, stored_at, value in stored.get("entries", []):
+                if now - stored_at < self.ttl:
+                    self._entries[key] = (stored_at, value)
+            self._evict()
+        except Exception as e:
+            print(f"Błąd wczytywania cache: {e}")
+            self._entries.clear()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        """Zwraca aktualne dane z cache lub `default`"""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            stored_at, value = entry
+            if time.time() - stored_at >= self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            return entry is not None and time.time() - entry[0] < self.ttl
+
+    def put(self, key, value):
+        """Dodaje dane do cache (i przy autosave zapisuje go na dysk)"""
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+        if self.autosave:
+            self._maybe_save()
+
+    def invalidate(self, key=None):
+        """Usuwa jeden wpis lub (bez argumentu) cały cache"""
+        with self._lock:
+            self._ensure_loaded()
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._dirty = True
+        self.save()
+
+    def save(self):
+        """Zapisuje cache atomowo (plik tymczasowy + podmiana), o ile zmienił się od ostatniego zapisu"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = json.dumps({"entries": [[key, stored_at, value] for key, (stored_at, value)
+                                                   in self._entries.items()]}, ensure_ascii=False)
+                self._dirty = False
+                self._last_save = time.monotonic()
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            try:
+                tmp_path.write_text(snapshot, encoding="utf-8")
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"Błąd zapisywania cache: {e}")
+                with self._lock:
+                    self._dirty = True  # Spróbuj ponownie przy kolejnym zapisie
+
+    def _maybe_save(self):
+        # Jak w ProviderBudget - zapis co najwyżej raz na save_interval s
+        if time.monotonic() - self._last_save > self.save_interval:
+            self.save()
+
+    def stats(self):
+        """Liczniki trafień/chybień do diagnostyki"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,37 @@
+"""Odświeża kopię Leaflet 1.9.4 dołączoną w map_assets/leaflet (używaną przez map.html).
+
+Pliki są w repozytorium - skrypt jest potrzebny tylko przy zmianie wersji
+albo po usunięciu katalogu:
+    python map_assets/fetch_leaflet.py
+"""
+import sys
+import urllib.request
+from pathlib import Path
+
+LEAFLET_VERSION = "1.9.4"
+BASE_URL = f"https://cdnjs.cloudflare.com/ajax/libs/leaflet/{LEAFLET_VERSION}/"
+FILES = [
+    "leaflet.js",
+    "leaflet.css",
+    "images/layers.png",
+    "images/layers-2x.png",
+    "images/marker-icon.png",
+    "images/marker-icon-2x.png",
+    "images/marker-shadow.png",
+]
+TARGET_DIR = Path(__file__).resolve().parent / "leaflet"
+
+
+def main():
+    for name in FILES:
+        target = TARGET_DIR / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Pobieram {BASE_URL + name}")
+        with urllib.request.urlopen(BASE_URL + name, timeout=30) as response:
+            target.write_bytes(response.read())
+    print(f"Leaflet {LEAFLET_VERSION} zapisany w {TARGET_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
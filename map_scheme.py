@@ -0,0 +1,110 @@
+"""Schemat URL ipmap:// serwujący stronę mapy i lokalną kopię Leaflet.
+
+PyQt6 nie zawiera narzędzia pyrcc, więc zamiast skompilowanego zasobu .qrc
+pliki z katalogu map_assets są serwowane przez QWebEngineUrlSchemeHandler.
+Schemat musi zostać zarejestrowany przed utworzeniem QApplication.
+"""
+import mimetypes
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QUrl
+from PyQt6.QtWebEngineCore import (
+    QWebEngineUrlRequestJob, QWebEngineUrlScheme, QWebEngineUrlSchemeHandler
+)
+
+MAP_SCHEME = b"ipmap"
+MAP_HOST = "app"
+MAP_ASSETS_DIR = Path(__file__).resolve().parent / "map_assets"
+MAP_PAGE_URL = QUrl(f"{MAP_SCHEME.decode()}://{MAP_HOST}/map.html")
+
+
+def register_map_scheme():
+    """Rejestruje schemat ipmap:// (wywołać przed utworzeniem QApplication)"""
+    scheme = QWebEngineUrlScheme(MAP_SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    scheme.setFlags(
+        QWebEngineUrlScheme.Flag.SecureScheme
+        | QWebEngineUrlScheme.Flag.LocalAccessAllowed
+        | QWebEngineUrlScheme.Flag.CorsEnabled
+    )
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+class MapSchemeHandler(QWebEngineUrlSchemeHandler):
+    """Serwuje pliki z MAP_ASSETS_DIR pod adresami ipmap://app/<ścieżka>
+
+    Żądania ipmap://app/tiles/<z>/<x>/<y>.png są przekazywane do `tile_provider`
+    (TileFetcher z tile_cache.py), o ile został podany, a żądania
+    ipmap://app/history/<z>.geojson?bbox=... do `history_provider`
+    (HistoryClusters z history_clusters.py). Do czasu wczytania historii
+    (history_provider = None) zwracana jest pusta kolekcja z flagą "pending",
+    przy której strona mapy zostawia punkty dodane przez addHistoryMarker.
+    """
+
+    PENDING_GEOJSON = b'{"type":"FeatureCollection","features":[],"pending":true}'
+
+    def __init__(self, tile_provider=None, history_provider=None, parent=None):
+        super().__init__(parent)
+        self.tile_provider = tile_provider
+        self.history_provider = history_provider
+        self._files = {}  # Pliki są małe i niezmienne - trzymamy je w pamięci
+
+    def _read_asset(self, path):
+        data = self._files.get(path)
+        if data is None:
+            file_path = (MAP_ASSETS_DIR / path).resolve()
+            # Nie wypuszczamy żądań poza katalog map_assets
+            if MAP_ASSETS_DIR not in file_path.parents or not file_path.is_file():
+                return None
+            data = self._files[path] = file_path.read_bytes()
+        return data
+
+    def requestStarted(self, job):
+        path = job.requestUrl().path().lstrip("/")
+        if path.startswith("tiles/") and self.tile_provider is not None:
+            self._handle_tile(job, path)
+            return
+        if path.startswith("history/"):
+            self._handle_history(job, path)
+            return
+        data = self._read_asset(path)
+        if data is None:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        self._reply(job, mimetypes.guess_type(path)[0] or "application/octet-stream", data)
+
+    @staticmethod
+    def _reply(job, mime_type, data):
+        buffer = QBuffer(parent=job)
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        job.reply(mime_type.encode(), buffer)
+
+    def _handle_history(self, job, path):
+        try:
+            zoom = int(path[len("history/"):].removesuffix(".geojson"))
+        except ValueError:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlInvalid)
+            return
+        if self.history_provider is None:
+            self._reply(job, "application/json", self.PENDING_GEOJSON)
+            return
+        # Provider jest ustawiany dopiero po wczytaniu klastrów, więc numpy jest już dostępne
+        from history_clusters import parse_bbox
+
+        bbox = None
+        values = parse_qs(job.requestUrl().query()).get("bbox")
+        if values:
+            bbox = parse_bbox(values[0])
+            if bbox is None:
+                job.fail(QWebEngineUrlRequestJob.Error.UrlInvalid)
+                return
+        self._reply(job, "application/json", self.history_provider.geojson(zoom, bbox))
+
+    def _handle_tile(self, job, path):
+        try:
+            zoom, x, y = path[len("tiles/"):].removesuffix(".png").split("/")
+            self.tile_provider.handle(job, int(zoom), int(x), int(y))
+        except ValueError:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlInvalid)
@@ -0,0 +1,148 @@
+"""Pomiary czasu faz sprawdzenia (spany) i liczniki zdarzeń.
+
+Spany to nazwane odcinki czasu z etykietami, np.
+    with METRICS.span("provider_attempt", provider="ipinfo.io") as labels:
+        ...
+        labels["outcome"] = "ok"
+Dla każdej pary (nazwa, etykiety) zbierana jest liczba, suma, min/max, ostatni
+czas i histogram; liczniki (np. trafienia cache, ponowienia) są zwykłymi sumami.
+Stan można zapisać jako JSON lub w formacie tekstowym Prometheusa (np. dla
+node_exporter --collector.textfile).
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+# Granice koszyków histogramu (s)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+class Metrics:
+    def __init__(self, prefix="ipchecker", recent=200):
+        self.prefix = prefix
+        self._spans = {}  # (nazwa, etykiety) -> statystyki
+        self._counters = {}  # (nazwa, etykiety) -> wartość
+        self._recent = deque(maxlen=recent)  # ostatnie spany do panelu diagnostyki
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        """Rejestruje zmierzony czas fazy"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            series = self._spans.get(key)
+            if series is None:
+                series = self._spans[key] = {
+                    "count": 0, "sum": 0.0, "min": seconds, "max": seconds, "last": seconds,
+                    "buckets": [0] * len(BUCKETS),
+                }
+            series["count"] += 1
+            series["sum"] += seconds
+            series["min"] = min(series["min"], seconds)
+            series["max"] = max(series["max"], seconds)
+            series["last"] = seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+            self._recent.append((time.time(), name, dict(key[1]), seconds))
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """Mierzy czas bloku; etykiety można uzupełnić w środku (np. wynik)"""
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels.setdefault("outcome", "error")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self._recent.clear()
+
+    def snapshot(self):
+        """Kopia stanu w postaci gotowej do serializacji"""
+        with self._lock:
+            spans = [
+                dict(name=name, labels=dict(labels), avg=series["sum"] / series["count"],
+                     **{k: v for k, v in series.items() if k != "buckets"},
+                     buckets=dict(zip(map(str, BUCKETS), series["buckets"])))
+                for (name, labels), series in sorted(self._spans.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            recent = [
+                {"time": at, "name": name, "labels": labels, "seconds": seconds}
+                for at, name, labels, seconds in self._recent
+            ]
+        return {"spans": spans, "counters": counters, "recent": recent}
+
+    def to_prometheus(self):
+        """Stan w formacie tekstowym Prometheusa"""
+        with self._lock:
+            spans = sorted((key, dict(series, buckets=list(series["buckets"])))
+                           for key, series in self._spans.items())
+            counters = sorted(self._counters.items())
+        metric = f"{self.prefix}_span_seconds"
+        lines = [f"# HELP {metric} Czas faz sprawdzenia IP", f"# TYPE {metric} histogram"]
+        for (name, labels), series in spans:
+            labels = (("span", name),) + labels
+            for bound, count in zip(BUCKETS, series["buckets"]):
+                lines.append(f"{metric}_bucket{_prometheus_labels(labels, le=str(bound))} {count}")
+            lines.append(f"{metric}_bucket{_prometheus_labels(labels, le='+Inf')} {series['count']}")
+            lines.append(f"{metric}_sum{_prometheus_labels(labels)} {series['sum']:.6f}")
+            lines.append(f"{metric}_count{_prometheus_labels(labels)} {series['count']}")
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_atomic(path, text):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def export(self, json_path=None, prometheus_path=None):
+        """Zapisuje stan do plików (pominięte ścieżki = brak zapisu)"""
+        try:
+            if json_path:
+                self._write_atomic(json_path, json.dumps(self.snapshot(), indent=2, ensure_ascii=False))
+            if prometheus_path:
+                self._write_atomic(prometheus_path, self.to_prometheus())
+        except OSError as e:
+            print(f"Błąd eksportu metryk: {e}")
@@ -0,0 +1,201 @@
+"""Stan zdrowia dostawców (serwisów IP/info): opóźnienia, błędy i circuit breaker.
+
+Dla każdego hosta dostawcy śledzone są: wykładnicza średnia krocząca (EWMA)
+czasu odpowiedzi, EWMA odsetka błędów, liczba odpowiedzi HTTP 429 oraz stan
+bezpiecznika. Po `failure_threshold` kolejnych błędach bezpiecznik otwiera
+się na `open_seconds` (lub na czas z Retry-After), a po tym czasie dostawca
+dostaje jedną próbę (half-open): allow() przepuszcza tylko pierwsze wywołanie,
+a kolejne czekają na jej wynik (najwyżej `probe_timeout`). Nieudana próba
+ponownie otwiera bezpiecznik. Stan jest zapisywany na dysk między uruchomieniami.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+try:
+    from urllib3.exceptions import NameResolutionError
+except ImportError:  # urllib3 < 2.0
+    NameResolutionError = socket.gaierror
+
+DEFAULT_LATENCY = 1.0  # Zakładany czas odpowiedzi (s) dostawcy bez historii
+
+
+def provider_key(url):
+    """Klucz dostawcy - host z URL (również dla szablonów z {ip})"""
+    return urlparse(url).netloc
+
+
+def needs_dns(url):
+    """Czy host dostawcy trzeba rozwiązywać przez DNS (nie jest literałem IP)"""
+    host = urlparse(url).hostname or ""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return False
+        except OSError:
+            pass
+    return True
+
+
+def is_dns_error(error):
+    """Sprawdza łańcuch wyjątku (requests -> urllib3 -> socket) pod kątem błędu DNS"""
+    seen = set()
+    pending = [error]
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, (socket.gaierror, NameResolutionError)):
+            return True
+        pending.append(getattr(current, "reason", None))
+        pending.append(current.__cause__)
+        pending.append(current.__context__)
+        pending.extend(arg for arg in getattr(current, "args", ()) if isinstance(arg, BaseException))
+    return False
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Wykładnicze opóźnienie z pełnym jitterem przed ponowieniem próby `attempt`"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ProviderHealth:
+    def __init__(self, path=None, alpha=0.3, failure_threshold=3, open_seconds=60, probe_timeout=30):
+        self.path = Path(path) if path else None
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout  # Próba half-open bez wyniku (np. anulowana) wygasa po tym czasie
+        self._stats = {}
+        self._probes = {}  # host -> czas (time.time) wygaśnięcia trwającej próby half-open
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._stats = json.load(f)
+        except Exception as e:
+            print(f"Błąd wczytywania stanu dostawców: {e}")
+            self._stats = {}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = json.dumps(self._stats, indent=2)
+            self._last_save = time.monotonic()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp_path.write_text(snapshot, encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Błąd zapisywania stanu dostawców: {e}")
+
+    def _maybe_save(self):
+        # Zapis co najwyżej raz na 10 s - stan zmienia się przy każdym zapytaniu
+        if time.monotonic() - self._last_save > 10:
+            self.save()
+
+    def _entry(self, key):
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = self._stats[key] = {
+                "latency": None,
+                "error_rate": 0.0,
+                "requests": 0,
+                "failures": 0,
+                "rate_limited": 0,
+                "consecutive_failures": 0,
+                "open_until": 0.0,  # czas epoki (time.time) - przeżywa restart
+            }
+        return entry
+
+    def record_success(self, url, latency):
+        with self._lock:
+            self._probes.pop(provider_key(url), None)
+            entry = self._entry(provider_key(url))
+            entry["requests"] += 1
+            entry["latency"] = latency if entry["latency"] is None else (
+                self.alpha * latency + (1 - self.alpha) * entry["latency"]
+            )
+            entry["error_rate"] *= 1 - self.alpha
+            entry["consecutive_failures"] = 0
+            entry["open_until"] = 0.0
+        self._maybe_save()
+
+    def record_failure(self, url, rate_limited=False, retry_after=None):
+        with self._lock:
+            probing = self._probes.pop(provider_key(url), None) is not None
+            entry = self._entry(provider_key(url))
+            entry["requests"] += 1
+            entry["failures"] += 1
+            entry["error_rate"] = self.alpha + (1 - self.alpha) * entry["error_rate"]
+            entry["consecutive_failures"] += 1
+            if rate_limited:
+                entry["rate_limited"] += 1
+            if retry_after is not None:
+                entry["open_until"] = max(entry["open_until"], time.time() + retry_after)
+            elif probing or entry["consecutive_failures"] >= self.failure_threshold:
+                entry["open_until"] = time.time() + self.open_seconds
+                print(f"Bezpiecznik otwarty dla {provider_key(url)} na {self.open_seconds} s")
+        self._maybe_save()
+
+    def _half_open_busy(self, key, entry, now):
+        """Czy bezpiecznik jest otwarty albo trwa już jedyna próba half-open (pod blokadą)"""
+        if entry is None or not entry["open_until"]:
+            return False
+        return entry["open_until"] > now or self._probes.get(key, 0.0) > now
+
+    def allow(self, url):
+        """Czy wysłać zapytanie; po otwarciu bezpiecznika pierwsze wywołanie rezerwuje próbę half-open"""
+        key = provider_key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._stats.get(key)
+            if self._half_open_busy(key, entry, now):
+                return False
+            if entry is not None and entry["open_until"]:
+                self._probes[key] = now + self.probe_timeout
+            return True
+
+    def available(self, url):
+        """Jak allow(), ale bez rezerwowania próby half-open (do sortowania dostawców)"""
+        key = provider_key(url)
+        with self._lock:
+            return not self._half_open_busy(key, self._stats.get(key), time.time())
+
+    def expected_latency(self, url):
+        """Oczekiwany koszt zapytania: EWMA opóźnienia powiększona o ryzyko błędu"""
+        with self._lock:
+            entry = self._stats.get(provider_key(url))
+            if entry is None or entry["latency"] is None:
+                return DEFAULT_LATENCY
+            # Błąd kosztuje mniej więcej jeszcze jedną próbę
+            return entry["latency"] * (1 + entry["error_rate"])
+
+    def order(self, services, url_of=lambda service: service):
+        """Sortuje dostawców wg oczekiwanego opóźnienia; otwarte bezpieczniki na końcu"""
+        return sorted(
+            services,
+            key=lambda service: (not self.available(url_of(service)), self.expected_latency(url_of(service))),
+        )
+
+    def reset(self):
+        """Zapomina stan wszystkich dostawców (np. między scenariuszami benchmarku)"""
+        with self._lock:
+            self._stats.clear()
+            self._probes.clear()
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
@@ -0,0 +1,201 @@
+"""Limity zapytań dostawców: token bucket per host i dzienne kwoty.
+
+Każdy host z `limits` ma wiadro tokenów (`rate` zapytań/s, maks. `burst`
+naraz) oraz opcjonalną dzienną kwotę (`daily`). Zapytanie rezerwuje token
+przed wysłaniem - gdy wiadro jest puste, reserve() zwraca czas oczekiwania
+na token, a gdy kwota na dziś jest wyczerpana - None (dostawcę trzeba
+pominąć). Odpowiedź 429 wstrzymuje hosta na czas z Retry-After (lub
+`default_backoff`). Liczniki kwot są zapisywane na dysk per dzień (czas
+lokalny), więc restart aplikacji ich nie zeruje.
+
+    budget = ProviderBudget({"ipapi.co": {"rate": 1, "burst": 3, "daily": 1000}}, "provider_budget.json")
+"""
+import json
+import os
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+from provider_health import provider_key
+
+
+class TokenBucket:
+    """Wiadro tokenów z rezerwacją: token może być "pożyczony" z przyszłości"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Czas (s) do dostępności tokenu, bez rezerwacji"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        """Pobiera token (także przyszły) i zwraca, ile trzeba poczekać przed zapytaniem"""
+        wait = self.wait_time(now)
+        self.tokens -= 1
+        return wait
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ProviderBudget:
+    def __init__(self, limits=None, path=None, default_backoff=60):
+        self.limits = limits or {}
+        self.path = Path(path) if path else None
+        self.default_backoff = default_backoff
+        self._buckets = {}
+        self._blocked_until = {}  # host -> czas (time.monotonic) końca wstrzymania po 429
+        self._day = date.today().isoformat()
+        self._used = {}  # host -> liczba zapytań wysłanych dzisiaj
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("day") == self._day:
+                self._used = {host: int(count) for host, count in stored.get("used", {}).items()}
+        except Exception as e:
+            print(f"Błąd wczytywania kwot dostawców: {e}")
+            self._used = {}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = json.dumps({"day": self._day, "used": self._used}, indent=2)
+            self._last_save = time.monotonic()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp_path.write_text(snapshot, encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Błąd zapisywania kwot dostawców: {e}")
+
+    def _maybe_save(self):
+        # Jak w ProviderHealth - zapis co najwyżej raz na 10 s
+        if time.monotonic() - self._last_save > 10:
+            self.save()
+
+    def _roll_day(self):
+        """Zeruje liczniki po zmianie dnia (pod blokadą)"""
+        today = date.today().isoformat()
+        if today != self._day:
+            self._day = today
+            self._used = {}
+
+    def _bucket(self, host):
+        limit = self.limits.get(host)
+        if not limit or not limit.get("rate"):
+            return None
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(limit["rate"], limit.get("burst", 1))
+        return bucket
+
+    def _quota_left(self, host):
+        daily = (self.limits.get(host) or {}).get("daily")
+        return None if not daily else daily - self._used.get(host, 0)
+
+    def reserve(self, url):
+        """Rezerwuje zapytanie do dostawcy; zwraca czas oczekiwania (s) lub None, gdy kwota wyczerpana.
+
+        Zarezerwowane zapytanie liczy się do kwoty - jeśli nie zostanie
+        wysłane (zbyt długie oczekiwanie), trzeba wywołać release().
+        """
+        host = provider_key(url)
+        now = time.monotonic()
+        with self._lock:
+            self._roll_day()
+            left = self._quota_left(host)
+            if left is not None and left <= 0:
+                return None
+            wait = max(0.0, self._blocked_until.get(host, 0.0) - now)
+            bucket = self._bucket(host)
+            if bucket is not None:
+                wait = max(wait, bucket.reserve(now))
+            self._used[host] = self._used.get(host, 0) + 1
+        self._maybe_save()
+        return wait
+
+    def release(self, url):
+        """Zwraca rezerwację zapytania, które nie zostało wysłane"""
+        host = provider_key(url)
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is not None:
+                bucket.refund()
+            if self._used.get(host):
+                self._used[host] -= 1
+
+    def record_rate_limited(self, url, retry_after=None):
+        """Odpowiedź 429: wstrzymuje hosta na Retry-After (albo default_backoff) i opróżnia wiadro"""
+        host = provider_key(url)
+        pause = self.default_backoff if retry_after is None else retry_after
+        with self._lock:
+            self._blocked_until[host] = max(self._blocked_until.get(host, 0.0), time.monotonic() + pause)
+            bucket = self._buckets.get(host)
+            if bucket is not None:
+                bucket.drain()
+
+    def wait_time(self, url):
+        """Oczekiwanie (s) na zapytanie do dostawcy bez rezerwacji; None - kwota wyczerpana"""
+        host = provider_key(url)
+        now = time.monotonic()
+        with self._lock:
+            self._roll_day()
+            left = self._quota_left(host)
+            if left is not None and left <= 0:
+                return None
+            wait = max(0.0, self._blocked_until.get(host, 0.0) - now)
+            bucket = self._bucket(host)
+            return wait if bucket is None else max(wait, bucket.wait_time(now))
+
+    def order(self, services, url_of=lambda service: service):
+        """Dostawcy z dostępnym tokenem najpierw, potem czekający, na końcu z wyczerpaną kwotą.
+
+        Sortowanie jest stabilne, więc w każdej grupie zostaje kolejność
+        wejściowa (np. z ProviderHealth.order).
+        """
+        def key(service):
+            wait = self.wait_time(url_of(service))
+            return (wait is None, wait or 0.0)
+        return sorted(services, key=key)
+
+    def reset(self):
+        """Zapomina wiadra, wstrzymania i liczniki (np. między scenariuszami benchmarku)"""
+        with self._lock:
+            self._buckets.clear()
+            self._blocked_until.clear()
+            self._used.clear()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._roll_day()
+            hosts = sorted(set(self.limits) | set(self._used) | set(self._blocked_until))
+            return {
+                host: {
+                    "used_today": self._used.get(host, 0),
+                    "quota_left": self._quota_left(host),
+                    "blocked_for": round(max(0.0, self._blocked_until.get(host, 0.0) - now), 1),
+                }
+                for host in hosts
+            }
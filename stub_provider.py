@@ -0,0 +1,246 @@
+"""Lokalny serwer udający dostawców z CONFIG (do benchmarków i testów offline).
+
+Odpowiada w formatach używanych serwisów: cloudflare trace, zwykły tekst,
+JSON ipinfo / ipapi / ip-api oraz kafelki mapy. Opóźnienie, odsetek błędów
+i limit zapytań (HTTP 429 z Retry-After) są konfigurowalne globalnie i per
+trasa, a losowość ma stałe ziarno, więc przebiegi są powtarzalne.
+
+    python stub_provider.py --port 8765 --latency 0.05 --error-rate 0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CLIENT_IP = "203.0.113.7"  # Adres "klienta" zwracany przez serwisy IP (TEST-NET-3)
+
+# Przezroczysty kafelek PNG 1x1
+TILE_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+CITIES = [
+    ("Warszawa", "Mazowieckie", "PL", 52.2297, 21.0122),
+    ("Kraków", "Małopolskie", "PL", 50.0647, 19.9450),
+    ("Berlin", "Berlin", "DE", 52.5200, 13.4050),
+    ("Praha", "Praha", "CZ", 50.0755, 14.4378),
+    ("Wien", "Wien", "AT", 48.2082, 16.3738),
+]
+
+
+def fake_location(ip):
+    """Stała (zależna od adresu) lokalizacja dla IP"""
+    digest = hashlib.sha1(ip.encode("utf-8")).digest()
+    city, region, country, lat, lon = CITIES[digest[0] % len(CITIES)]
+    return {
+        "city": city,
+        "region": region,
+        "country": country,
+        "lat": round(lat + (digest[1] - 128) / 1000, 4),
+        "lon": round(lon + (digest[2] - 128) / 1000, 4),
+        "postal": f"{digest[3] % 100:02d}-{digest[4] % 1000:03d}",
+        "timezone": "Europe/Warsaw",
+        "org": f"AS{64512 + digest[5]} Stub Net",
+    }
+
+
+def _ipinfo(ip):
+    loc = fake_location(ip)
+    return {
+        "ip": ip, "city": loc["city"], "region": loc["region"], "country": loc["country"],
+        "loc": f"{loc['lat']},{loc['lon']}", "org": loc["org"], "postal": loc["postal"],
+        "timezone": loc["timezone"],
+    }
+
+
+def _ipapi(ip):
+    loc = fake_location(ip)
+    return {
+        "ip": ip, "city": loc["city"], "region": loc["region"], "country_name": loc["country"],
+        "latitude": loc["lat"], "longitude": loc["lon"], "org": loc["org"], "postal": loc["postal"],
+        "timezone": loc["timezone"],
+    }
+
+
+def _ip_api(ip):
+    loc = fake_location(ip)
+    return {
+        "status": "success", "query": ip, "city": loc["city"], "regionName": loc["region"],
+        "countryCode": loc["country"], "lat": loc["lat"], "lon": loc["lon"], "isp": loc["org"],
+        "zip": loc["postal"], "timezone": loc["timezone"],
+    }
+
+
+def route_of(path):
+    """Nazwa trasy dla ścieżki żądania (klucz ustawień per trasa) i jej argument"""
+    parts = [part for part in path.split("?")[0].split("/") if part]
+    if parts == ["cdn-cgi", "trace"]:
+        return "trace", None
+    if parts == ["ip"]:
+        return "text", None
+    if len(parts) == 3 and parts[0] == "ipinfo" and parts[2] == "json":
+        return "ipinfo", parts[1]
+    if len(parts) == 3 and parts[0] == "ipapi" and parts[2] == "json":
+        return "ipapi", parts[1]
+    if len(parts) == 3 and parts[0] == "ip-api" and parts[1] == "json":
+        return "ip-api", parts[2]
+    if len(parts) == 4 and parts[0] == "tiles" and parts[3].endswith(".png"):
+        return "tiles", None
+    return None, None
+
+
+class StubProviderServer:
+    """Serwer w wątku tła; ustawienia per trasa nadpisują wartości domyślne:
+
+        StubProviderServer(latency=0.02, routes={"ipinfo": {"error_rate": 0.5}})
+
+    `rate_limit` to maksymalna liczba zapytań na sekundę do trasy (0 - bez limitu).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit=0, routes=None, seed=1234):
+        self.defaults = {"latency": latency, "jitter": jitter, "error_rate": error_rate, "rate_limit": rate_limit}
+        self.routes = routes or {}
+        self.counters = {}  # trasa -> {"requests", "errors", "rate_limited"}
+        self._random = random.Random(seed)
+        self._windows = {}  # trasa -> (początek okna sekundowego, liczba zapytań)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def url(self, path=""):
+        host, port = self.address
+        return f"http://{host}:{port}{path}"
+
+    def service_config(self):
+        """Wartości ip_services, info_services i tile_upstream dla CONFIG wskazujące na serwer"""
+        return {
+            'ip_services': [
+                (self.url("/cdn-cgi/trace"), "cloudflare_trace"),
+                (self.url("/ip"), "text"),
+            ],
+            'dual_stack': False,  # Serwer słucha tylko na adresie IPv4
+            'ip6_services': [],
+            'info_services': [
+                self.url("/ipinfo/{ip}/json"),
+                self.url("/ipapi/{ip}/json/"),
+                self.url("/ip-api/json/{ip}"),
+            ],
+            'tile_upstream': self.url("/tiles/{z}/{x}/{y}.png"),
+        }
+
+    def setting(self, route, name):
+        return self.routes.get(route, {}).get(name, self.defaults[name])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-provider", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _decide(self, route):
+        """Zwraca (opóźnienie, kod odpowiedzi) dla kolejnego zapytania do trasy"""
+        with self._lock:
+            counters = self.counters.setdefault(route, {"requests": 0, "errors": 0, "rate_limited": 0})
+            counters["requests"] += 1
+            delay = self.setting(route, "latency") + self._random.uniform(0, self.setting(route, "jitter"))
+            limit = self.setting(route, "rate_limit")
+            if limit:
+                now = time.monotonic()
+                window_start, count = self._windows.get(route, (now, 0))
+                if now - window_start >= 1.0:
+                    window_start, count = now, 0
+                self._windows[route] = (window_start, count + 1)
+                if count >= limit:
+                    counters["rate_limited"] += 1
+                    return 0.0, 429
+            if self._random.random() < self.setting(route, "error_rate"):
+                counters["errors"] += 1
+                return delay, 500
+            return delay, 200
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, jak u prawdziwych dostawców
+
+            def do_GET(self):
+                route, ip = route_of(self.path)
+                if route is None:
+                    self._send(404, b"not found", "text/plain")
+                    return
+                delay, status = server._decide(route)
+                if delay:
+                    time.sleep(delay)
+                if status == 429:
+                    self._send(429, b"rate limited", "text/plain", {"Retry-After": "1"})
+                elif status != 200:
+                    self._send(status, b"stub error", "text/plain")
+                elif route == "trace":
+                    self._send(200, f"fl=1\nh=stub\nip={CLIENT_IP}\nts={time.time():.3f}\n".encode(), "text/plain")
+                elif route == "text":
+                    self._send(200, f"{CLIENT_IP}\n".encode(), "text/plain")
+                elif route == "tiles":
+                    self._send(200, TILE_PNG, "image/png")
+                else:
+                    payload = {"ipinfo": _ipinfo, "ipapi": _ipapi, "ip-api": _ip_api}[route](ip)
+                    self._send(200, json.dumps(payload).encode("utf-8"), "application/json")
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Bez logu każdego zapytania
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokalny serwer udający dostawców IP/geolokalizacji")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Opóźnienie odpowiedzi (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Dodatkowe losowe opóźnienie (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Odsetek odpowiedzi HTTP 500")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Maks. zapytań/s na trasę (0 - bez limitu)")
+    args = parser.parse_args(argv)
+
+    server = StubProviderServer(args.host, args.port, args.latency, args.jitter, args.error_rate, args.rate_limit)
+    print(json.dumps(server.service_config(), indent=2))
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Moduły aplikacji leżą w katalogu głównym repozytorium
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,86 @@
+"""Testy silnika asynchronicznego (async_engine.py)"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("PyQt6.QtCore", exc_type=ImportError)
+
+import async_engine  # noqa: E402
+import ip_lookup  # noqa: E402
+from connectivity import DNS_ERROR  # noqa: E402
+from provider_health import ProviderHealth  # noqa: E402
+
+URL = "https://ipinfo.io/json"
+
+
+@pytest.fixture
+def health(monkeypatch):
+    health = ProviderHealth(failure_threshold=10)
+    monkeypatch.setattr(async_engine, "provider_health", lambda version=None: health)
+    monkeypatch.setattr(async_engine, "reserve_request", lambda url, deadline=None, version=None: 0.0)
+    monkeypatch.setattr(async_engine, "backoff_delay", lambda attempt: 0.0)
+    return health
+
+
+def test_truncated_body_is_retried_as_provider_failure(health, monkeypatch):
+    responses = [asyncio.IncompleteReadError(b"{\"ip\"", 40),
+                 async_engine.AsyncResponse(URL, 200, {}, b"{}")]
+    invalidated = []
+
+    async def http_get(url, timeout, family=0):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(async_engine, "http_get", http_get)
+    monkeypatch.setattr(async_engine.DNS_CACHE, "invalidate", invalidated.append)
+    response = asyncio.run(async_engine.async_fetch_url(URL, time.monotonic() + 5))
+    assert response.status_code == 200
+    assert health.stats()["ipinfo.io"]["failures"] == 1
+    assert invalidated == ["ipinfo.io"]
+
+
+@pytest.fixture
+def checker(monkeypatch):
+    state = {"status": True, "invalidated": [], "errors": [], "results": []}
+    monkeypatch.setattr(ip_lookup.CONNECTIVITY, "status", lambda: state["status"])
+    monkeypatch.setattr(ip_lookup.CONNECTIVITY, "invalidate", state["invalidated"].append)
+    checker = async_engine.AsyncIPChecker()
+    checker.error.connect(state["errors"].append)
+    checker.finished.connect(state["results"].append)
+    state["run"] = lambda: asyncio.run(checker._check())
+    return state
+
+
+def test_async_check_offline_uses_shared_message(checker, monkeypatch):
+    checker["status"] = False
+    monkeypatch.setattr(async_engine, "async_detect_public_ips", pytest.fail)
+    checker["run"]()
+    assert checker["errors"] == ["Brak połączenia z internetem. Sprawdź kabel/WiFi."]
+
+
+def test_async_check_detection_failure_invalidates_connectivity(checker, monkeypatch):
+    async def detect(dns_error_mode, deadline, on_attempt):
+        raise TimeoutError("Przekroczono budżet czasu")
+
+    monkeypatch.setattr(async_engine, "async_detect_public_ips", detect)
+    checker["run"]()
+    assert checker["errors"] == ["Nie udało się pobrać adresu IP. (Przekroczono limit czasu)"]
+    assert checker["invalidated"] == ["nieudane sprawdzenie"]
+
+
+def test_async_check_dns_error_mode_skips_network_lookup(checker, monkeypatch):
+    checker["status"] = DNS_ERROR
+
+    async def detect(dns_error_mode, deadline, on_attempt):
+        assert dns_error_mode
+        return {4: "192.0.2.1"}
+
+    monkeypatch.setattr(async_engine, "async_detect_public_ips", detect)
+    monkeypatch.setattr(async_engine, "async_lookup_addresses", pytest.fail)
+    monkeypatch.setattr(ip_lookup, "offline_infos", lambda addresses: {})
+    checker["run"]()
+    assert checker["results"][0]["ip"] == "192.0.2.1"
+    assert checker["results"][0]["error_loc"] == "Niedostępne (Awaria DNS)"
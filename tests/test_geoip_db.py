@@ -0,0 +1,48 @@
+"""Testy importu i wyszukiwania w offline bazie GeoIP (geoip_db.py)"""
+import pytest
+
+from geoip_db import GeoIPDatabase, build_database, ip_to_int
+
+
+def build(tmp_path, lines):
+    source = tmp_path / "ranges.csv"
+    source.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    count = build_database(source, tmp_path / "geoip.bin")
+    return count, GeoIPDatabase(tmp_path / "geoip.bin")
+
+
+def test_ip_to_int_rejects_numbers_above_ipv4_range():
+    assert ip_to_int("4294967295") == 2 ** 32 - 1
+    with pytest.raises(ValueError):
+        ip_to_int("99999999999")
+
+
+def test_import_skips_out_of_range_rows(tmp_path):
+    count, db = build(tmp_path, [
+        "start,end,country,region,city,postal,timezone,org,lat,lon",
+        "1.0.0.0,1.0.0.255,PL,,Warszawa,,,,52.2297,21.0122",
+        "99999999999,99999999999,XX,,Nigdzie,,,,,",
+    ])
+    try:
+        assert count == 1
+        assert db.lookup("1.0.0.7")["city"] == "Warszawa"
+    finally:
+        db.close()
+
+
+def test_import_resolves_overlapping_ranges(tmp_path):
+    count, db = build(tmp_path, [
+        "10.0.0.0,10.0.0.255,PL,,Kraków,,,,,",
+        "10.0.0.100,10.0.1.255,DE,,Berlin,,,,,",  # Nachodzi na poprzedni - przycięty
+        "10.0.0.10,10.0.0.20,CZ,,Praha,,,,,",  # Całkowicie pokryty - pominięty
+        "10.0.2.0,10.0.2.255,AT,,Wien,,,,,",
+    ])
+    try:
+        assert count == 3
+        assert db.lookup("10.0.0.15")["city"] == "Kraków"
+        assert db.lookup("10.0.0.200")["city"] == "Kraków"
+        assert db.lookup("10.0.1.7")["city"] == "Berlin"
+        assert db.lookup("10.0.2.7")["city"] == "Wien"
+        assert db.lookup("10.0.3.0") is None
+    finally:
+        db.close()
@@ -0,0 +1,32 @@
+"""Testy klastrów historii dla mapy (history_clusters.py)"""
+import numpy as np
+
+from history_clusters import _Level
+
+
+def test_merge_keeps_last_ip_per_cell():
+    level = _Level()
+    level.add(7, 50.0, 19.0, 1, True, "1.1.1.1")
+    keys = np.array([7, 3, 7, 3, 9, 7], dtype=np.int64)
+    ips = np.array(["2.2.2.2", "3.3.3.3", "4.4.4.4", "5.5.5.5", "6.6.6.6", "7.7.7.7"], dtype=object)
+    ones = np.ones(len(keys), dtype=np.int64)
+    level.merge(keys, np.full(len(keys), 50.0), np.full(len(keys), 19.0), ones, ones, ips)
+    assert level.keys.tolist() == [3, 7, 9]
+    assert level.ips.tolist() == ["5.5.5.5", "7.7.7.7", "6.6.6.6"]
+    assert level.counts.tolist() == [2, 4, 1]
+
+
+def test_merge_matches_add():
+    rng = np.random.default_rng(5)
+    keys = rng.integers(0, 20, 500)
+    lat, lon = rng.uniform(-80, 80, 500), rng.uniform(-170, 170, 500)
+    counts = rng.integers(1, 5, 500)
+    ips = np.array([f"10.0.0.{i % 256}" for i in range(500)], dtype=object)
+    added, merged = _Level(), _Level()
+    for i in range(500):
+        added.add(keys[i], lat[i], lon[i], counts[i], True, ips[i])
+    merged.merge(keys, lat, lon, counts, np.ones(500, dtype=np.int64), ips)
+    assert merged.keys.tolist() == added.keys.tolist()
+    assert merged.ips.tolist() == added.ips.tolist()
+    assert merged.counts.tolist() == added.counts.tolist()
+    np.testing.assert_allclose(merged.lat_sums, added.lat_sums)
@@ -0,0 +1,94 @@
+"""Testy wyszukiwania w historii (history_store.py)"""
+import sqlite3
+
+import pytest
+
+from history_store import COLUMNS, HistoryStore, compact_db_file, matches_search
+
+ENTRIES = [
+    {"timestamp": "2024-01-01 10:00:00", "ip": "1.1.1.1", "city": "Kraków", "org": "AS1 100% Net"},
+    {"timestamp": "2024-01-01 11:00:00", "ip": "2.2.2.2", "city": "Łódź", "org": "AS2 my_isp"},
+    {"timestamp": "2024-01-01 12:00:00", "ip": "3.3.3.3", "city": "Berlin", "org": "AS3 myXisp"},
+    {"timestamp": "2024-01-01 13:00:00", "ip": "4.4.4.4", "city": "Wien", "org": "AS4 back\\slash"},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(tmp_path / "history.db")
+    for entry in ENTRIES:
+        store.append(entry)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("search, expected", [
+    ("%", ["1.1.1.1"]),
+    ("_", ["2.2.2.2"]),
+    ("my_isp", ["2.2.2.2"]),
+    ("\\", ["4.4.4.4"]),
+    ("berlin", ["3.3.3.3"]),
+    ("KRAKÓW", []),  # Jak w SQLite: wielkość liter bez znaczenia tylko dla ASCII
+    ("ŁÓDŹ", []),
+    ("Łódź", ["2.2.2.2"]),
+])
+def test_search_matches_literal_text_like_sql(store, search, expected):
+    found = [entry["ip"] for entry in store.query(search=search)]
+    assert found == expected
+    assert store.count(search=search) == len(expected)
+    assert [entry["ip"] for entry in ENTRIES if matches_search(entry, search)] == expected
+
+
+def test_compact_db_to_target_keeps_source(tmp_path):
+    source = tmp_path / "history.db"
+    store = HistoryStore(source, compact_max_gap=0)  # Bez łączenia przy zapisie - wiersz na sprawdzenie
+    for minute in range(3):
+        store.append({"timestamp": f"2024-01-01 10:0{minute}:00", "ip": "1.1.1.1", "city": "Kraków"})
+    store.append({"timestamp": "2024-01-01 10:05:00", "ip": "2.2.2.2", "city": "Łódź"})
+    store.close()
+
+    target = tmp_path / "compact.db"
+    target.write_bytes(b"stara kopia")  # Istniejący plik docelowy jest zastępowany
+    assert compact_db_file(source, target) == (4, 2)
+
+    store, compacted = HistoryStore(source), HistoryStore(target)
+    try:
+        assert store.count() == 4
+        assert compacted.count() == 2
+        assert compacted.observations() == 4
+    finally:
+        store.close()
+        compacted.close()
+    assert not (tmp_path / "compact.db.tmp").exists()
+
+
+def test_compact_db_in_place(tmp_path):
+    source = tmp_path / "history.db"
+    store = HistoryStore(source, compact_max_gap=0)
+    for minute in range(3):
+        store.append({"timestamp": f"2024-01-01 10:0{minute}:00", "ip": "1.1.1.1"})
+    store.close()
+    assert compact_db_file(source) == (3, 1)
+
+
+def test_compact_db_missing_source_is_not_created(tmp_path):
+    source = tmp_path / "literowka.db"
+    with pytest.raises(FileNotFoundError):
+        compact_db_file(source, tmp_path / "out.db")
+    assert not source.exists()
+    assert not (tmp_path / "out.db").exists()
+
+
+def test_compact_db_to_target_leaves_old_schema_source_untouched(tmp_path):
+    source = tmp_path / "old.db"
+    conn = sqlite3.connect(source)  # Baza sprzed kompakcji: bez last_seen/count, bez WAL
+    conn.execute(f"CREATE TABLE history (id INTEGER PRIMARY KEY, {', '.join(f'{c} TEXT' for c in COLUMNS)})")
+    conn.executemany("INSERT INTO history (timestamp, ip) VALUES (?, ?)",
+                     [(f"2024-01-01 10:0{minute}:00", "1.1.1.1") for minute in range(3)])
+    conn.commit()
+    conn.close()
+    before = source.read_bytes()
+
+    assert compact_db_file(source, tmp_path / "out.db") == (3, 1)
+    assert source.read_bytes() == before
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["old.db", "out.db"]
@@ -0,0 +1,52 @@
+"""Testy trybu wsadowego (ip_bulk.py)"""
+import time
+
+import pytest
+
+import ip_bulk
+from ip_bulk import BulkLookup
+from lookup_cache import LookupCache
+
+
+@pytest.fixture
+def failing_lookups(monkeypatch):
+    calls = []
+
+    def lookup(ip, cache=None):
+        calls.append(ip)
+        raise TimeoutError("Przekroczono budżet czasu")
+
+    monkeypatch.setattr(ip_bulk, "lookup_ip_info", lookup)
+    return calls
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LookupCache(tmp_path / "cache.json", autosave=False)
+
+
+def test_failures_are_cached_briefly(failing_lookups, cache):
+    bulk = BulkLookup(cache, workers=2, failure_ttl=0.2)
+    try:
+        first = bulk.submit("192.0.2.1").result()
+        repeated = [bulk.submit("192.0.2.1").result() for _ in range(5)]
+        assert failing_lookups == ["192.0.2.1"]
+        assert repeated == [first] * 5
+        assert first["error"] == "Przekroczono budżet czasu"
+        assert (bulk.lookups, bulk.errors, bulk.failure_hits) == (1, 1, 5)
+
+        time.sleep(0.25)
+        bulk.submit("192.0.2.1").result()
+        assert failing_lookups == ["192.0.2.1"] * 2
+    finally:
+        bulk.shutdown()
+
+
+def test_failure_cache_can_be_disabled(failing_lookups, cache):
+    bulk = BulkLookup(cache, workers=2, failure_ttl=0)
+    try:
+        for _ in range(3):
+            bulk.submit("192.0.2.1").result()
+        assert len(failing_lookups) == 3
+    finally:
+        bulk.shutdown()
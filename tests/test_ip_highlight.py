@@ -0,0 +1,26 @@
+"""Testy wyszukiwania adresów IP do podświetlania (IP_TOKEN_RE z ip_checker_gui.py)"""
+import pytest
+
+# Bez QtWebEngine (lub jego bibliotek systemowych) moduł GUI kończy proces przy imporcie
+pytest.importorskip("PyQt6.QtWebEngineWidgets", exc_type=ImportError)
+
+import ip_checker_gui  # noqa: E402
+
+
+def tokens(text):
+    return [match.group() for match in ip_checker_gui.IP_TOKEN_RE.finditer(text)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Adres: 1.2.3.4", ["1.2.3.4"]),
+    ("Koniec zdania 1.2.3.4.", ["1.2.3.4"]),
+    ("Serwer 1.2.3.4:8080 działa", ["1.2.3.4"]),
+    ("IP:1.2.3.4", ["1.2.3.4"]),
+    ("::ffff:1.2.3.4", ["1.2.3.4"]),
+    ("2001:db8::1.", ["2001:db8::1"]),
+    ("fe80::1%eth0 lokalny", ["fe80::1%eth0"]),
+    ("11.2.3.45", ["11.2.3.45"]),
+    ("a1.2.3.4 1.2.3.4.5", []),
+])
+def test_ip_tokens(text, expected):
+    assert tokens(text) == expected
@@ -0,0 +1,82 @@
+"""Testy pełnego sprawdzenia adresu (ip_lookup.check_public_ip)"""
+import threading
+
+import pytest
+
+import ip_lookup
+from connectivity import DNS_ERROR
+from ip_lookup import (
+    CheckCancelledError, IPDetectionError, NoConnectivityError, check_error_message, check_public_ip,
+)
+
+
+@pytest.fixture
+def connectivity(monkeypatch):
+    state = {"status": True, "invalidated": []}
+    monkeypatch.setattr(ip_lookup.CONNECTIVITY, "status", lambda: state["status"])
+    monkeypatch.setattr(ip_lookup.CONNECTIVITY, "invalidate", state["invalidated"].append)
+    return state
+
+
+def test_offline_raises_without_requests(connectivity, monkeypatch):
+    connectivity["status"] = False
+    monkeypatch.setattr(ip_lookup, "detect_public_ips", pytest.fail)
+    with pytest.raises(NoConnectivityError):
+        check_public_ip()
+
+
+def test_detection_error_keeps_cause_and_dns_mode(connectivity, monkeypatch):
+    connectivity["status"] = DNS_ERROR
+
+    def detect(*args):
+        raise TimeoutError("Przekroczono budżet czasu")
+
+    monkeypatch.setattr(ip_lookup, "detect_public_ips", detect)
+    with pytest.raises(IPDetectionError) as info:
+        check_public_ip()
+    assert info.value.dns_error_mode
+    assert isinstance(info.value.__cause__, TimeoutError)
+    assert connectivity["invalidated"] == ["nieudane sprawdzenie"]
+
+
+def test_cancel_does_not_invalidate_connectivity(connectivity, monkeypatch):
+    cancel_event = threading.Event()
+    seen = []
+
+    def detect(dns_error_mode, deadline, timeout, on_attempt, cancel):
+        seen.append(cancel)
+        cancel.set()
+        raise CheckCancelledError("Sprawdzanie anulowane")
+
+    monkeypatch.setattr(ip_lookup, "detect_public_ips", detect)
+    with pytest.raises(CheckCancelledError):
+        check_public_ip(cancel_event=cancel_event)
+    assert seen == [cancel_event]
+    assert connectivity["invalidated"] == []
+
+
+def test_lookup_passes_cancel_event(connectivity, monkeypatch):
+    cancel_event = threading.Event()
+    monkeypatch.setattr(ip_lookup, "detect_public_ips", lambda *args: {4: "192.0.2.1"})
+
+    def lookup(addresses, deadline, timeout, on_attempt, cache, cancel):
+        assert cancel is cancel_event
+        return {"192.0.2.1": {"ip": "192.0.2.1", "city": "Kraków"}}
+
+    monkeypatch.setattr(ip_lookup, "lookup_addresses", lookup)
+    result = check_public_ip(cancel_event=cancel_event)
+    assert result["city"] == "Kraków"
+    assert result["addresses"]["IPv4"]["ip"] == "192.0.2.1"
+
+
+@pytest.mark.parametrize("cause, dns_error_mode, suffix", [
+    (TimeoutError("Przekroczono budżet czasu"), True, " (Przekroczono limit czasu)"),
+    (ConnectionRefusedError("odmowa"), False, " (Problem z połączeniem/DNS)"),
+    (ValueError("Nieprawidłowa odpowiedź"), True, " (Problem z połączeniem/DNS)"),
+    (ValueError("Nieprawidłowa odpowiedź"), False, ""),
+])
+def test_check_error_message(cause, dns_error_mode, suffix):
+    error = IPDetectionError(str(cause), dns_error_mode)
+    error.__cause__ = cause
+    assert check_error_message(error) == "Nie udało się pobrać adresu IP." + suffix
+    assert check_error_message(NoConnectivityError()) == "Brak połączenia z internetem. Sprawdź kabel/WiFi."
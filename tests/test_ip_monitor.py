@@ -0,0 +1,79 @@
+"""Testy pętli monitora zmian IP (ip_monitor.py) na sztucznym zegarze"""
+import pytest
+
+import ip_monitor
+from ip_monitor import IPMonitor
+
+
+class FakeWatcher:
+    """Zamiast NetlinkWatcher - zdarzenia sieci w zadanych chwilach, wait() przesuwa zegar"""
+
+    def __init__(self, clock, events=()):
+        self.clock = clock
+        self.events = sorted(events)
+
+    def wait(self, timeout):
+        end = self.clock[0] + timeout
+        while self.events and self.events[0] <= self.clock[0]:
+            self.events.pop(0)  # Zdarzenia z czasu sprawdzenia - już w kolejce
+            return True
+        if self.events and self.events[0] <= end:
+            self.clock[0] = self.events.pop(0)
+            return True
+        self.clock[0] = end
+        return False
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def run_monitor(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(ip_monitor.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(ip_monitor, "lookup_ip_info", lambda ip, cancel_event=None: {"ip": ip})
+    monkeypatch.setattr(ip_monitor.CONNECTIVITY, "invalidate", lambda reason: None)
+
+    def run(ips, events=(), min_interval=30, max_interval=120):
+        """Uruchamia monitor do wyczerpania `ips`; zwraca chwile kolejnych sprawdzeń"""
+        ips = list(ips)
+        checks = []
+        monitor = IPMonitor(min_interval, max_interval)
+
+        def resolve(timeout=3, stop_event=None):
+            checks.append(clock[0])
+            if len(ips) == 1:
+                monitor.stop()
+            return ips.pop(0)
+
+        monkeypatch.setattr(ip_monitor, "resolve_public_ip", resolve)
+        monkeypatch.setattr(ip_monitor.NetlinkWatcher, "create", lambda: FakeWatcher(clock, events))
+        monitor.run()
+        return checks
+
+    return run
+
+
+def test_stable_address_backs_off_and_change_resets(run_monitor):
+    checks = run_monitor(["1.1.1.1"] * 5 + ["2.2.2.2", "2.2.2.2"])
+    # Interwał 30 -> 60 -> 120 (maks.) bez zmian, po zmianie znów 30
+    assert checks == [0, 30, 90, 210, 330, 450, 480]
+
+
+def test_netlink_triggers_check_after_debounce(run_monitor):
+    checks = run_monitor(["1.1.1.1"] * 3, events=[70, 71])
+    # Poll o 30 (następny dopiero o 90), zmiana sieci o 70-71 i cisza przez debounce (2 s)
+    assert checks == [0, 30, 73]
+
+
+def test_netlink_check_waits_for_min_interval(run_monitor):
+    checks = run_monitor(["1.1.1.1"] * 3, events=[35])
+    # Zmiana sieci 5 s po sprawdzeniu - kolejne dopiero min_interval po poprzednim
+    assert checks == [0, 30, 60]
+
+
+def test_constant_churn_is_checked_at_most_every_min_interval(run_monitor):
+    churn = [5 + 3 * i for i in range(100)]  # Zmiany tras co 3 s przez 300 s
+    checks = run_monitor(["1.1.1.1"] * 10, events=churn, max_interval=900)
+    assert checks[1] < 35  # Ciągłe zmiany nie wstrzymują sprawdzeń (debounce ograniczony)
+    assert all(later - earlier >= 30 for earlier, later in zip(checks, checks[1:]))
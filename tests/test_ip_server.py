@@ -0,0 +1,172 @@
+"""Testy trybu serwera (ip_server.py)"""
+import json
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import ip_server
+from ip_server import CoalescingCache, IPLookupServer
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+
+    def lookup(ip):
+        calls.append(ip)
+        return {"ip": ip, "city": "Kraków"}
+
+    monkeypatch.setattr(ip_server, "lookup_ip_info", lookup)
+    return calls
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def test_lookup_key_is_normalized(lookups):
+    with IPLookupServer(cache=CoalescingCache(fresh_ttl=60, workers=2)) as server:
+        for spelling in ["2001:DB8::1", "2001:db8::1", "2001:db8:0::1"]:
+            assert get_json(server.url(f"/lookup/{spelling}"))["ip"] == "2001:db8::1"
+    assert lookups == ["2001:db8::1"]
+
+
+def test_url_is_unavailable_on_unix_socket(tmp_path):
+    with IPLookupServer(unix_socket=str(tmp_path / "ip.sock"), cache=CoalescingCache(workers=1)) as server:
+        with pytest.raises(ValueError):
+            server.url("/ip")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ip_server.time, "monotonic", lambda: now[0])
+    return now
+
+
+class Loader:
+    """Loader dla CoalescingCache: zwraca kolejne wyniki lub rzuca zapisane wyjątki"""
+
+    def __init__(self, *results, gate=None):
+        self.results = list(results)
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def settle(cache, flights=0):
+    """Czeka, aż liczba wyszukiwań w tle spadnie (lub wzrośnie) do `flights`"""
+    for _ in range(500):
+        if cache.stats()["in_flight"] == flights:
+            return
+        time.sleep(0.01)
+    raise AssertionError("Wyszukiwanie w tle nie zakończyło się")
+
+
+@pytest.fixture
+def cache():
+    cache = CoalescingCache(fresh_ttl=30, stale_ttl=600, error_ttl=5, workers=4)
+    yield cache
+    cache.close()
+
+
+def test_miss_then_fresh(cache, clock):
+    loader = Loader(b"v1")
+    assert cache.get("ip", loader) == (b"v1", "miss")
+    clock[0] += 29
+    assert cache.get("ip", loader) == (b"v1", "fresh")
+    assert loader.calls == 1
+
+
+def test_concurrent_misses_are_coalesced(cache, clock):
+    gate = threading.Event()
+    loader = Loader(b"v1", gate=gate)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("ip", loader, timeout=5)))
+               for _ in range(3)]
+    threads[0].start()
+    settle(cache, flights=1)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()["coalesced"] < 2:
+        time.sleep(0.01)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(state for _, state in results) == ["coalesced", "coalesced", "miss"]
+    assert loader.calls == 1
+    assert cache.stats()["lookups"] == 1
+
+
+def test_stale_result_is_refreshed_in_background(cache, clock):
+    loader = Loader(b"v1", b"v2")
+    cache.get("ip", loader)
+    clock[0] += 31
+    assert cache.get("ip", loader) == (b"v1", "stale")
+    settle(cache)
+    assert cache.get("ip", loader) == (b"v2", "fresh")
+    assert loader.calls == 2
+
+
+def test_stale_if_error_throttles_refreshes(cache, clock):
+    loader = Loader(b"v1", RuntimeError("dostawca nie odpowiada"), b"v2")
+    cache.get("ip", loader)
+    clock[0] += 31
+    assert cache.get("ip", loader) == (b"v1", "stale")
+    settle(cache)
+    assert loader.calls == 2
+
+    clock[0] += 4  # Nieudane odświeżenie - kolejne najwcześniej po error_ttl
+    assert cache.get("ip", loader) == (b"v1", "stale")
+    assert loader.calls == 2
+
+    clock[0] += 2
+    assert cache.get("ip", loader) == (b"v1", "stale")
+    settle(cache)
+    assert cache.get("ip", loader) == (b"v2", "fresh")
+    assert loader.calls == 3
+
+
+def test_error_without_result_is_remembered_for_error_ttl(cache, clock):
+    error = RuntimeError("dostawca nie odpowiada")
+    loader = Loader(error, b"v1")
+    with pytest.raises(RuntimeError):
+        cache.get("ip", loader)
+    clock[0] += 4
+    with pytest.raises(RuntimeError) as info:
+        cache.get("ip", loader)
+    assert info.value is error
+    assert loader.calls == 1
+
+    clock[0] += 2
+    assert cache.get("ip", loader) == (b"v1", "miss")
+
+
+def test_prune_drops_expired_then_oldest(clock):
+    cache = CoalescingCache(fresh_ttl=30, stale_ttl=600, workers=1, max_entries=2)
+    try:
+        cache.get("a", Loader(b"a"))
+        clock[0] += 601  # "a" przeterminowane
+        cache.get("b", Loader(b"b"))
+        clock[0] += 1
+        cache.get("c", Loader(b"c"))
+        assert cache.age("a") is None
+        assert cache.stats()["entries"] == 2
+
+        clock[0] += 1
+        cache.get("d", Loader(b"d"))  # Nic przeterminowanego - usuwany najstarszy "b"
+        assert cache.age("b") is None
+        assert [cache.age(key) for key in "cd"] == [1.0, 0.0]
+    finally:
+        cache.close()
@@ -0,0 +1,53 @@
+"""Testy cache wyszukiwań (lookup_cache.py)"""
+import json
+
+import pytest
+
+import lookup_cache
+from lookup_cache import LookupCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lookup_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def stored_keys(path):
+    return [key for key, _, _ in json.loads(path.read_text(encoding="utf-8"))["entries"]]
+
+
+def test_autosave_is_throttled(tmp_path, clock):
+    path = tmp_path / "cache.json"
+    cache = LookupCache(path, save_interval=10)
+    cache.put("info_192.0.2.1", {"city": "Kraków"})
+    assert stored_keys(path) == ["info_192.0.2.1"]
+
+    cache.put("info_192.0.2.2", {"city": "Łódź"})  # W ciągu save_interval - tylko w pamięci
+    assert stored_keys(path) == ["info_192.0.2.1"]
+
+    clock[0] += 11
+    cache.put("info_192.0.2.3", {"city": "Gdańsk"})
+    assert stored_keys(path) == ["info_192.0.2.1", "info_192.0.2.2", "info_192.0.2.3"]
+
+
+def test_save_on_exit_persists_pending_entries(tmp_path, clock):
+    path = tmp_path / "cache.json"
+    cache = LookupCache(path, save_interval=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.save()
+    assert LookupCache(path).get("b") == 2
+
+
+def test_save_skips_unchanged_cache(tmp_path, clock):
+    path = tmp_path / "cache.json"
+    cache = LookupCache(path, autosave=False)
+    cache.save()
+    assert not path.exists()
+    cache.put("a", 1)
+    cache.save()
+    path.unlink()
+    cache.save()
+    assert not path.exists()
@@ -0,0 +1,60 @@
+"""Testy bezpiecznika dostawców (provider_health.py)"""
+import pytest
+
+import provider_health
+from provider_health import ProviderHealth
+
+URL = "https://ipinfo.io/{ip}/json"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(provider_health.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def health(clock):
+    health = ProviderHealth(failure_threshold=2, open_seconds=60, probe_timeout=30)
+    for _ in range(2):
+        health.record_failure(URL)
+    return health
+
+
+def test_open_breaker_blocks_requests(health, clock):
+    assert not health.allow(URL)
+    assert not health.available(URL)
+
+
+def test_half_open_allows_single_probe(health, clock):
+    clock[0] += 61
+    assert health.available(URL)
+    assert health.available(URL)  # Sortowanie nie zajmuje próby
+    assert health.allow(URL)
+    assert not health.allow(URL)
+    assert not health.available(URL)
+
+
+def test_probe_success_closes_breaker(health, clock):
+    clock[0] += 61
+    assert health.allow(URL)
+    health.record_success(URL, 0.1)
+    assert health.allow(URL)
+    assert health.allow(URL)
+
+
+def test_probe_failure_reopens_breaker(health, clock):
+    clock[0] += 61
+    assert health.allow(URL)
+    health.record_failure(URL)
+    assert not health.allow(URL)
+    clock[0] += 61
+    assert health.allow(URL)
+
+
+def test_probe_without_result_expires(health, clock):
+    clock[0] += 61
+    assert health.allow(URL)
+    clock[0] += 31
+    assert health.allow(URL)
@@ -0,0 +1,129 @@
+"""Testy limitów zapytań dostawców (rate_limit.py) i ich użycia w ip_lookup.py"""
+from datetime import date
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+import ip_lookup
+import rate_limit
+from lookup_cache import LookupCache
+from provider_health import ProviderHealth
+from rate_limit import ProviderBudget, TokenBucket
+from stub_provider import StubProviderServer
+
+URL = "https://ipapi.co/{ip}/json/"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def today(monkeypatch):
+    day = [date(2024, 3, 1)]
+
+    class FakeDate(date):
+        @classmethod
+        def today(cls):
+            return day[0]
+
+    monkeypatch.setattr(rate_limit, "date", FakeDate)
+    return day
+
+
+def test_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve(1000.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(1000.0) == 0.5  # Token pożyczony z przyszłości
+    assert bucket.wait_time(1000.5) == 0.5
+    assert bucket.wait_time(1001.0) == 0.0
+    bucket.wait_time(2000.0)
+    assert bucket.tokens == 3  # Uzupełnianie nie przekracza burst
+
+
+def test_daily_quota_rolls_over_at_midnight(clock, today):
+    budget = ProviderBudget({"ipapi.co": {"daily": 2}})
+    assert [budget.reserve(URL) for _ in range(2)] == [0.0, 0.0]
+    assert budget.reserve(URL) is None
+    assert budget.wait_time(URL) is None
+
+    today[0] = date(2024, 3, 2)
+    assert budget.wait_time(URL) == 0.0
+    assert budget.reserve(URL) == 0.0
+    assert budget.stats()["ipapi.co"]["used_today"] == 1
+
+
+def test_quota_is_kept_across_restarts_on_the_same_day(tmp_path, clock, today):
+    path = tmp_path / "budget.json"
+    budget = ProviderBudget({"ipapi.co": {"daily": 2}}, path)
+    budget.reserve(URL)
+    budget.save()
+    assert ProviderBudget({"ipapi.co": {"daily": 2}}, path).stats()["ipapi.co"]["quota_left"] == 1
+    today[0] = date(2024, 3, 2)
+    assert ProviderBudget({"ipapi.co": {"daily": 2}}, path).stats()["ipapi.co"]["quota_left"] == 2
+
+
+def test_release_returns_unsent_reservation(clock, today):
+    budget = ProviderBudget({"ipapi.co": {"rate": 1, "burst": 1, "daily": 5}})
+    assert budget.reserve(URL) == 0.0
+    assert budget.reserve(URL) == 1.0  # Za długo - zapytanie nie zostanie wysłane
+    budget.release(URL)
+    assert budget.stats()["ipapi.co"]["used_today"] == 1
+    assert budget.wait_time(URL) == 1.0
+
+
+def test_rate_limited_host_is_paused_and_drained(clock, today):
+    budget = ProviderBudget({"ipapi.co": {"rate": 1, "burst": 5}}, default_backoff=60)
+    budget.record_rate_limited(URL, retry_after=30)
+    assert budget.wait_time(URL) == 30
+    clock[0] += 30
+    assert budget.wait_time(URL) == 0.0  # Wiadro uzupełnione w czasie wstrzymania
+    budget.record_rate_limited(URL)
+    assert budget.wait_time(URL) == 60
+
+
+def test_order_by_remaining_budget(clock, today):
+    exhausted, waiting, free = "https://a.example/{ip}", "https://b.example/{ip}", "https://c.example/{ip}"
+    budget = ProviderBudget({"a.example": {"daily": 1}, "b.example": {"rate": 1, "burst": 1}})
+    budget.reserve(exhausted)
+    budget.reserve(waiting)
+    assert budget.order([exhausted, waiting, free]) == [free, waiting, exhausted]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("120", 120.0),
+    ("-5", 0.0),
+    (formatdate(1_700_000_120, usegmt=True), 120.0),
+    (formatdate(1_699_999_000, usegmt=True), 0.0),
+    ("jutro", None),
+    ("", None),
+])
+def test_retry_after(monkeypatch, value, expected):
+    monkeypatch.setattr(ip_lookup.time, "time", lambda: 1_700_000_000.0)
+    assert ip_lookup._retry_after(SimpleNamespace(headers={"retry-after": value})) == expected
+
+
+def test_budget_keeps_lookups_under_stub_rate_limit(monkeypatch):
+    with StubProviderServer(rate_limit=5) as server:
+        service = server.url("/ipinfo/{ip}/json")
+        host = service.split("/")[2]
+        budget = ProviderBudget({host: {"rate": 4, "burst": 1, "daily": 6}})
+        monkeypatch.setattr(ip_lookup, "PROVIDER_BUDGET", budget)
+        monkeypatch.setattr(ip_lookup, "PROVIDER_HEALTH", ProviderHealth(failure_threshold=100))
+        monkeypatch.setitem(ip_lookup.CONFIG, "info_services", [service])
+        monkeypatch.setitem(ip_lookup.CONFIG, "geoip_db", None)
+        cache = LookupCache(None)
+
+        results = []
+        for i in range(8):
+            try:
+                results.append(ip_lookup.lookup_ip_info(f"192.0.2.{i + 1}", cache=cache)["ip"])
+            except ip_lookup.ProviderRateLimitedError:
+                results.append(None)
+
+    assert results == [f"192.0.2.{i + 1}" for i in range(6)] + [None, None]
+    assert server.counters["ipinfo"] == {"requests": 6, "errors": 0, "rate_limited": 0}
@@ -0,0 +1,162 @@
+"""Testy cache kafelków (tile_cache.py) na lokalnym serwerze stub_provider.py"""
+import time
+
+import pytest
+
+# Bez QtWebEngine (lub jego bibliotek systemowych) testy są pomijane
+pytest.importorskip("PyQt6.QtWebEngineCore", exc_type=ImportError)
+
+from PyQt6.QtCore import QCoreApplication, QObject  # noqa: E402
+from PyQt6.QtWebEngineCore import QWebEngineUrlRequestJob  # noqa: E402
+
+import tile_cache  # noqa: E402
+from stub_provider import TILE_PNG, StubProviderServer  # noqa: E402
+from tile_cache import TileFetcher, TileStore, lat_lon_to_tile  # noqa: E402
+
+TILE = b"x" * 100
+
+
+class FakeJob(QObject):
+    """Zamiast QWebEngineUrlRequestJob - zapisuje odpowiedź albo błąd"""
+
+    def __init__(self):
+        super().__init__()
+        self.data = None
+        self.error = None
+
+    def reply(self, mime_type, buffer):
+        self.mime_type = bytes(mime_type)
+        self.data = bytes(buffer.data())
+
+    def fail(self, error):
+        self.error = error
+
+    @property
+    def done(self):
+        return self.data is not None or self.error is not None
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TileStore(tmp_path / "tiles.mbtiles", max_bytes=10 * len(TILE))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def server():
+    with StubProviderServer() as server:
+        yield server
+
+
+def wait_until(app, condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Przekroczono czas oczekiwania"
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def tile_requests(server):
+    return server.counters.get("tiles", {}).get("requests", 0)
+
+
+def test_store_put_get(store):
+    assert store.get(3, 4, 2) is None
+    store.put(3, 4, 2, TILE)
+    assert store.get(3, 4, 2) == TILE
+    assert (3, 4, 2) in store
+    assert (3, 4, 5) not in store  # Ten sam wiersz TMS nie może trafić pod inne y
+    store.put(3, 4, 2, TILE[:50])
+    assert store.get(3, 4, 2) == TILE[:50]
+    assert store.stats() == {"tiles": 1, "bytes": 50, "max_bytes": store.max_bytes}
+
+
+def test_store_evicts_least_recently_used(store, monkeypatch):
+    clock = iter(range(0, 10 ** 9, 10))
+    monkeypatch.setattr(tile_cache.time, "time", lambda: next(clock))
+    for x in range(10):
+        store.put(5, x, 0, TILE)
+    # Odczyt po TOUCH_INTERVAL odświeża czas użycia (zapisywany przed usuwaniem)
+    monkeypatch.setattr(tile_cache.time, "time", lambda: 10 * store.TOUCH_INTERVAL)
+    assert store.get(5, 0, 0) == TILE
+    store.put(5, 10, 0, TILE)
+
+    assert store.stats()["bytes"] <= store.max_bytes
+    assert store.stats()["bytes"] == 9 * len(TILE)  # Usuwanie do 90% limitu
+    assert (5, 0, 0) in store
+    assert (5, 10, 0) in store
+    assert (5, 1, 0) not in store
+    assert (5, 2, 0) not in store
+
+
+def test_store_batches_access_times(store, monkeypatch):
+    monkeypatch.setattr(tile_cache.time, "time", lambda: 0)
+    store.put(4, 1, 1, TILE)
+    monkeypatch.setattr(tile_cache.time, "time", lambda: store.TOUCH_INTERVAL)
+    store.get(4, 1, 1)
+    row = store._tms_row(4, 1)
+    query = "SELECT last_access FROM tiles WHERE zoom_level = 4 AND tile_column = 1 AND tile_row = ?"
+    assert store._conn.execute(query, (row,)).fetchone()[0] == 0
+    store.close()
+    reopened = TileStore(store.path)
+    try:
+        assert reopened._conn.execute(query, (row,)).fetchone()[0] == store.TOUCH_INTERVAL
+    finally:
+        reopened.close()
+
+
+def test_fetcher_deduplicates_in_flight_requests(app, store, server):
+    fetcher = TileFetcher(store, server.service_config()['tile_upstream'])
+    jobs = [FakeJob() for _ in range(3)]
+    for job in jobs:
+        fetcher.handle(job, 3, 4, 2)
+    wait_until(app, lambda: all(job.done for job in jobs))
+
+    assert tile_requests(server) == 1
+    assert all(job.data == TILE_PNG and job.mime_type == b"image/png" for job in jobs)
+    assert store.get(3, 4, 2) == TILE_PNG
+
+    # Kolejne żądanie obsługuje cache
+    job = FakeJob()
+    fetcher.handle(job, 3, 4, 2)
+    assert job.data == TILE_PNG
+    assert tile_requests(server) == 1
+
+
+def test_fetcher_prefetch(app, store, server):
+    store.max_bytes = 100 * len(TILE_PNG)
+    fetcher = TileFetcher(store, server.service_config()['tile_upstream'])
+    fetcher.prefetch(52.2297, 21.0122, 6)
+    wait_until(app, lambda: not fetcher._in_flight)
+
+    x, y = lat_lon_to_tile(52.2297, 21.0122, 6)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            assert (6, x + dx, y + dy) in store
+    assert tile_requests(server) == 9
+
+    # Kafelki z cache nie są pobierane ponownie
+    fetcher.prefetch(52.2297, 21.0122, 6)
+    assert not fetcher._in_flight
+
+
+def test_fetcher_offline(app, store, server):
+    store.put(3, 1, 1, TILE)
+    fetcher = TileFetcher(store, server.service_config()['tile_upstream'], offline=True)
+
+    cached, missing = FakeJob(), FakeJob()
+    fetcher.handle(cached, 3, 1, 1)
+    fetcher.handle(missing, 3, 2, 2)
+    fetcher.prefetch(52.2297, 21.0122, 6)
+    app.processEvents()
+
+    assert cached.data == TILE
+    assert missing.error == QWebEngineUrlRequestJob.Error.UrlNotFound
+    assert not fetcher._in_flight
+    assert tile_requests(server) == 0
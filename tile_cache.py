@@ -0,0 +1,230 @@
+"""Lokalny cache kafelków mapy (MBTiles/SQLite) serwowany przez schemat ipmap://.
+
+TileStore przechowuje kafelki w formacie MBTiles (wiersze w układzie TMS)
+z dodatkową kolumną czasu ostatniego użycia, która pozwala usuwać najdawniej
+używane kafelki po przekroczeniu limitu rozmiaru. Odczyt nie zapisuje czasu
+od razu - zmiany są zbierane i zapisywane paczką (przy zapisie kafelka, po
+TOUCH_BATCH odczytach i przy zamknięciu), a czas młodszy niż TOUCH_INTERVAL
+nie jest odświeżany wcale. TileFetcher odpowiada na
+żądania strony mapy: kafelek z cache jest zwracany od razu, brakujący jest
+pobierany asynchronicznie (QNetworkAccessManager) i zapisywany.
+"""
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PyQt6 import sip
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QObject, QUrl
+from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkReply, QNetworkRequest
+from PyQt6.QtWebEngineCore import QWebEngineUrlRequestJob
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    tile_data BLOB,
+    last_access INTEGER,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access);
+"""
+
+
+def lat_lon_to_tile(lat, lon, zoom):
+    """Współrzędne kafelka (x, y) w schemacie XYZ dla punktu i poziomu przybliżenia"""
+    n = 2 ** zoom
+    lat_rad = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class TileStore:
+    """Kafelki w pliku MBTiles z limitem rozmiaru (usuwanie LRU)"""
+
+    TOUCH_INTERVAL = 3600  # Dokładność (s) czasu ostatniego użycia - wystarczy dla LRU
+    TOUCH_BATCH = 64  # Tyle odczytanych kafelków czeka na zapis czasu użycia
+
+    def __init__(self, path="tiles.mbtiles", max_bytes=200 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._touched = {}  # (zoom, kolumna, wiersz TMS) -> czas odczytu czekający na zapis
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                [("name", "ip_checker_tiles"), ("format", "png")],
+            )
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles"
+        ).fetchone()[0]
+
+    @staticmethod
+    def _tms_row(zoom, y):
+        # MBTiles przechowuje wiersze w układzie TMS (oś Y od dołu)
+        return (2 ** zoom - 1) - y
+
+    def get(self, zoom, x, y):
+        row = self._tms_row(zoom, y)
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT tile_data, last_access FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, x, row),
+            ).fetchone()
+            if found is None:
+                return None
+            now = int(time.time())
+            if now - (found[1] or 0) >= self.TOUCH_INTERVAL:
+                self._touched[(zoom, x, row)] = now
+                if len(self._touched) >= self.TOUCH_BATCH:
+                    with self._conn:
+                        self._flush_touched()
+            return bytes(found[0])
+
+    def _flush_touched(self):
+        """Zapisuje zebrane czasy odczytu (pod blokadą, w transakcji wywołującego)"""
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE tiles SET last_access = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            [(now, zoom, column, row) for (zoom, column, row), now in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def __contains__(self, key):
+        zoom, x, y = key
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, x, self._tms_row(zoom, y)),
+            ).fetchone() is not None
+
+    def put(self, zoom, x, y, data):
+        row = self._tms_row(zoom, y)
+        with self._lock, self._conn:
+            previous = self._conn.execute(
+                "SELECT LENGTH(tile_data) FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, x, row),
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (zoom, x, row, sqlite3.Binary(data), int(time.time())),
+            )
+            self._total_bytes += len(data) - (previous[0] if previous else 0)
+            self._touched.pop((zoom, x, row), None)
+            # Przed usuwaniem LRU czasy odczytów muszą być w bazie
+            self._flush_touched()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Usuwa najdawniej używane kafelki aż do 90% limitu (wywoływane pod blokadą)"""
+        target = self.max_bytes * 0.9
+        cursor = self._conn.execute(
+            "SELECT zoom_level, tile_column, tile_row, LENGTH(tile_data) FROM tiles ORDER BY last_access"
+        )
+        doomed = []
+        for zoom, column, row, size in cursor:
+            if self._total_bytes <= target:
+                break
+            doomed.append((zoom, column, row))
+            self._total_bytes -= size
+        cursor.close()
+        self._conn.executemany(
+            "DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", doomed
+        )
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        return {"tiles": count, "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            if self._touched:  # Po zamknięciu lista jest pusta - close() można wywołać ponownie
+                with self._conn:
+                    self._flush_touched()
+            self._conn.close()
+
+
+class TileFetcher(QObject):
+    """Obsługuje żądania kafelków ze strony mapy i prefetch okolicy wyniku"""
+
+    def __init__(self, store, upstream_url, offline=False, user_agent="IPChecker/1.0", parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.upstream_url = upstream_url
+        self.offline = offline
+        self.user_agent = user_agent
+        self.network = QNetworkAccessManager(self)
+        self._in_flight = {}  # (z, x, y) -> lista zadań QWebEngineUrlRequestJob czekających na kafelek
+
+    def handle(self, job, zoom, x, y):
+        data = self.store.get(zoom, x, y)
+        if data is not None:
+            self._reply(job, data)
+            return
+        if self.offline:
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        self._fetch((zoom, x, y), job)
+
+    def prefetch(self, lat, lon, zoom, radius=1):
+        """Pobiera w tle kafelki wokół punktu (bez odpowiadania na żadne żądanie)"""
+        if self.offline:
+            return
+        center_x, center_y = lat_lon_to_tile(lat, lon, zoom)
+        n = 2 ** zoom
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                key = (zoom, (center_x + dx) % n, center_y + dy)
+                if 0 <= key[2] < n and key not in self.store:
+                    self._fetch(key, None)
+
+    def _fetch(self, key, job):
+        waiting = self._in_flight.get(key)
+        if waiting is not None:
+            # Ten sam kafelek jest już pobierany - dołącz do oczekujących
+            if job is not None:
+                waiting.append(job)
+            return
+        self._in_flight[key] = [job] if job is not None else []
+        zoom, x, y = key
+        request = QNetworkRequest(QUrl(self.upstream_url.format(z=zoom, x=x, y=y)))
+        # Zasady OSM wymagają identyfikacji aplikacji
+        request.setHeader(QNetworkRequest.KnownHeaders.UserAgentHeader, self.user_agent)
+        reply = self.network.get(request)
+        reply.finished.connect(lambda reply=reply, key=key: self._on_finished(reply, key))
+
+    def _on_finished(self, reply, key):
+        jobs = self._in_flight.pop(key, [])
+        data = None
+        if reply.error() == QNetworkReply.NetworkError.NoError:
+            data = bytes(reply.readAll())
+            self.store.put(*key, data)
+        else:
+            print(f"Błąd pobierania kafelka {key}: {reply.errorString()}")
+        reply.deleteLater()
+        for job in jobs:
+            if sip.isdeleted(job):
+                continue  # Strona przestała czekać (np. przewinięto mapę)
+            if data is None:
+                job.fail(QWebEngineUrlRequestJob.Error.RequestFailed)
+            else:
+                self._reply(job, data)
+
+    @staticmethod
+    def _reply(job, data):
+        buffer = QBuffer(parent=job)
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        job.reply(b"image/png", buffer)